@@ -4,26 +4,99 @@ Better recipe search and ingredient reasoning
 """
 
 import os
+import re
 import json
+import asyncio
+import difflib
+import hashlib
+import diskcache
+import orjson
+import numpy as np
+from pathlib import Path
+from typing import List, Optional
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
+from pydantic import BaseModel, TypeAdapter, ValidationError
 from tavily import TavilyClient
+from config import http_client, http_async_client
 
 load_dotenv()
 
-class CulinaryDecomposer:
-    def __init__(self):
-        self.llm = ChatOpenAI(
-            model="gpt-4o",
-            openai_api_key=os.getenv("OPENAI_API_KEY"),
-            temperature=0.1
-        )
-        self.tavily = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
-    
-    def analyze_food_complexity(self, food_name):
-        """Ask LLM to analyze if decomposition is needed and generate search query"""
-        
-        prompt = f"""Analyze this food item: "{food_name}"
+# Persistent cache for LLM responses and web searches (shared by all agents)
+LLM_CACHE_DIR = "./.llm_cache"
+
+# Outermost JSON object in an LLM response (tolerates code fences / stray prose)
+_JSON_BLOCK = re.compile(r"\{.*\}", re.DOTALL)
+
+
+def _extract_json(text):
+    match = _JSON_BLOCK.search(text)
+    return match.group(0) if match else text
+
+
+def _cache_key(namespace, payload):
+    """Content-addressed key: sha256 of the prompt/query payload"""
+    if not isinstance(payload, str):
+        payload = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS).decode()
+    return f"{namespace}:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+
+# Ingredients that never need decomposition - recognized without the triage LLM call
+_TRIVIAL_SIMPLE = frozenset({
+    "water", "salt", "sugar", "butter", "ghee", "oil", "olive oil", "honey",
+    "rice", "plain rice", "white rice", "steamed rice", "bread", "pav", "egg", "eggs",
+    "boiled egg", "milk", "flour", "blueberries", "strawberries", "banana", "apple",
+    "orange", "grapes", "tomato", "cucumber", "onion", "carrot", "potato", "boiled potato",
+    "lettuce", "spinach", "cheese", "yogurt", "curd", "paneer", "tea", "coffee", "juice"
+})
+
+
+def _trivial_verdict(food_name):
+    """Complexity verdict for allow-listed simple ingredients, None if triage is needed"""
+    key = food_name.lower().strip()
+    if key in _TRIVIAL_SIMPLE or difflib.get_close_matches(key, _TRIVIAL_SIMPLE, n=1, cutoff=0.9):
+        return {"food_name": food_name, "is_simple": True, "reasoning": "Known simple ingredient", "search_query": None}
+    return None
+
+
+class ComplexityVerdict(BaseModel):
+    food_name: Optional[str] = None
+    is_simple: bool
+    reasoning: str = ""
+    search_query: Optional[str] = None
+
+
+class IndexedComplexityVerdict(ComplexityVerdict):
+    idx: int
+
+
+class ComplexityBatch(BaseModel):
+    verdicts: List[IndexedComplexityVerdict]
+
+
+class IngredientVolume(BaseModel):
+    ingredient_name: str
+    percentage: float
+    # Recomputed from percentage after parsing; the prompt's own examples leave it out
+    volume_litres: Optional[float] = None
+    notes: str = ""
+
+
+class DecompositionResult(BaseModel):
+    original_food_name: str
+    total_volume_litres: float
+    reasoning: str = ""
+    ingredient_volumes: List[IngredientVolume]
+    modifications_applied: Optional[str] = None
+
+
+COMPLEXITY_ADAPTER = TypeAdapter(ComplexityVerdict)
+COMPLEXITY_BATCH_ADAPTER = TypeAdapter(ComplexityBatch)
+DECOMPOSITION_ADAPTER = TypeAdapter(DecompositionResult)
+
+
+# Static prompt skeletons, filled per call with str.format_map
+_COMPLEXITY_TEMPLATE = """Analyze this food item: "{food_name}"
 
 CRITICAL RULE: A food is SIMPLE only if >90% of its composition is ONE ingredient.
 
@@ -47,49 +120,40 @@ OUTPUT (JSON only):
   "search_query": "food_name recipe ingredients proportions" (only if complex)
 }}"""
 
-        response = self.llm.invoke(prompt)
-        
-        try:
-            response_text = response.content
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-            json_str = response_text[json_start:json_end]
-            return json.loads(json_str)
-        except:
-            return {"is_simple": True, "reasoning": "Parse error", "search_query": None}
-    
-    def search_web(self, query):
-        """Execute web search for recipes"""
-        print(f"🔍 Searching: {query}")
-        
-        try:
-            search_results = self.tavily.search(
-                query=query,
-                search_depth="advanced",
-                max_results=5,
-                include_answer=True
-            )
-            
-            content = search_results.get('answer', '')
-            for result in search_results.get('results', []):
-                content += f"\n\n{result.get('title', '')}\n{result.get('content', '')}"
-                
-            return content, search_results.get('results', [])
-        except Exception as e:
-            print(f"❌ Search error: {e}")
-            return "", []
-    
-    def decompose_complex_food(self, food_name, volume_litres, search_content, clarifications):
-        """LLM decomposes food with better reasoning"""
-        
-        clarification_text = ""
-        if clarifications:
-            clarification_text = f"\n\nUSER CLARIFICATIONS: {json.dumps(clarifications, indent=2)}"
-        
-        prompt = f"""You are a food scientist analyzing "{food_name}" with total volume {volume_litres} liters.{clarification_text}
+_COMPLEXITY_BATCH_TEMPLATE = """Analyze each of these food items:
+{food_list}
+
+CRITICAL RULE: A food is SIMPLE only if >90% of its composition is ONE ingredient.
+
+Examples:
+- "Pav Bhaji" → COMPLEX (potato + vegetables + butter + tomato = multiple major ingredients)
+- "Plain Pav/Bread" → SIMPLE (>90% is bread)
+- "Pancakes" → COMPLEX (flour + milk + eggs = multiple major ingredients)
+- "Plain Rice" → SIMPLE (>90% is rice)
+- "Butter" → SIMPLE (>90% is milk fat)
+- "Blueberries" → SIMPLE (100% blueberries)
+
+TASK (for EACH food):
+1. Is >90% of this food ONE ingredient?
+2. If COMPLEX: Create a search query to find the RECIPE with ingredient quantities
+
+OUTPUT (JSON only, one entry per food in "verdicts", same order and idx as the list above):
+{{
+  "verdicts": [
+    {{
+      "idx": 0,
+      "food_name": "food name",
+      "is_simple": true/false,
+      "reasoning": "Brief explanation",
+      "search_query": "food_name recipe ingredients proportions" (only if complex)
+    }}
+  ]
+}}"""
+
+_DECOMPOSE_TEMPLATE = """You are a food scientist analyzing "{food_name}" with total volume {volume_litres} liters.{clarification_text}
 
 RECIPE/WEB DATA:
-{search_content if search_content else "No recipe found - use your knowledge"}
+{search_content}
 
 YOUR TASK - THINK STEP BY STEP:
 
@@ -189,31 +253,165 @@ Example 2: Boiled Rice
 
 NOW ANALYZE "{food_name}":"""
 
-        print(f"🧠 LLM reasoning about ingredients and cooking process...")
-        response = self.llm.invoke(prompt)
+
+class CulinaryDecomposer:
+    def __init__(self, max_concurrency=8, search_depth="basic"):
+        self.llm = ChatOpenAI(
+            model="gpt-4o",
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            temperature=0.1,
+            model_kwargs={"response_format": {"type": "json_object"}},
+            http_client=http_client,
+            http_async_client=http_async_client
+        )
+        # Binary simple/complex triage is well within a smaller, faster model
+        self.triage_llm = ChatOpenAI(
+            model="gpt-4o-mini",
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            temperature=0,
+            model_kwargs={"response_format": {"type": "json_object"}},
+            http_client=http_client,
+            http_async_client=http_async_client
+        )
+        self.tavily = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+        self.cache = diskcache.Cache(LLM_CACHE_DIR)
+        # Max items processed concurrently (respects API rate limits)
+        self.max_concurrency = max_concurrency
+        # "basic" is enough for rough ingredient lists; pass "advanced" when debugging recipe quality
+        self.search_depth = search_depth
+    
+    async def _ainvoke_validated(self, prompt, adapter, max_attempts=2, llm=None):
+        """Invoke LLM in JSON mode and validate the response, re-invoking on malformed output"""
+        llm = llm or self.llm
+        key = _cache_key("llm", {"model": llm.model_name, "prompt": prompt})
+        cached = self.cache.get(key)
+        if cached is not None:
+            return adapter.validate_json(cached)
         
-        try:
-            response_text = response.content
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-            json_str = response_text[json_start:json_end]
-            
-            result = json.loads(json_str)
-            result['is_basic_ingredient'] = False
-            
-            
+        for attempt in range(1, max_attempts + 1):
+            response = await llm.ainvoke(prompt)
+            content = _extract_json(response.content)
+            try:
+                result = adapter.validate_json(content)
+            except ValidationError as e:
+                print(f"⚠️  Invalid LLM output (attempt {attempt}/{max_attempts}): {e.error_count()} error(s)")
+                if attempt == max_attempts:
+                    raise
+                continue
+            # Only cache responses that passed validation
+            self.cache.set(key, content)
             return result
+    
+    def _cached_search(self, **search_kwargs):
+        """Tavily search, cached on disk by query + search options"""
+        key = _cache_key("tavily", search_kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        
+        search_results = self.tavily.search(**search_kwargs)
+        self.cache.set(key, search_results)
+        return search_results
+    
+    async def analyze_food_complexity(self, food_name):
+        """Ask LLM to analyze if decomposition is needed and generate search query"""
+        
+        prompt = _COMPLEXITY_TEMPLATE.format_map({"food_name": food_name})
+
+        try:
+            verdict = await self._ainvoke_validated(prompt, COMPLEXITY_ADAPTER, llm=self.triage_llm)
+            return verdict.model_dump()
+        except ValidationError:
+            return {"is_simple": True, "reasoning": "Parse error", "search_query": None}
+    
+    async def analyze_food_complexity_batch(self, food_names):
+        """Analyze complexity of all food items in a single LLM call
+        Returns: dict of {idx: verdict}, missing indices fall back to single-item analysis"""
+        
+        if not food_names:
+            return {}
+        
+        food_list = "\n".join(f"{idx}. \"{name}\"" for idx, name in enumerate(food_names))
+        
+        prompt = _COMPLEXITY_BATCH_TEMPLATE.format_map({"food_list": food_list})
+
+        try:
+            batch = await self._ainvoke_validated(prompt, COMPLEXITY_BATCH_ADAPTER, llm=self.triage_llm)
+        except ValidationError:
+            print(f"⚠️  Batch complexity analysis failed, falling back to per-item")
+            return {}
+        
+        return {
+            verdict.idx: verdict.model_dump(exclude={'idx'})
+            for verdict in batch.verdicts
+            if 0 <= verdict.idx < len(food_names)
+        }
+    
+    async def search_web(self, query):
+        """Execute web search for recipes"""
+        print(f"🔍 Searching: {query}")
+        
+        try:
+            # Tavily client is sync - run it off the event loop
+            search_results = await asyncio.to_thread(
+                self._cached_search,
+                query=query,
+                search_depth=self.search_depth,
+                max_results=3,
+                include_answer=True
+            )
             
+            content = search_results.get('answer', '')
+            for result in search_results.get('results', []):
+                content += f"\n\n{result.get('title', '')}\n{result.get('content', '')}"
+                
+            return content, search_results.get('results', [])
         except Exception as e:
+            print(f"❌ Search error: {e}")
+            return "", []
+    
+    async def decompose_complex_food(self, food_name, volume_litres, search_content, clarifications):
+        """LLM decomposes food with better reasoning"""
+        
+        clarification_text = ""
+        if clarifications:
+            clarification_text = f"\n\nUSER CLARIFICATIONS: {json.dumps(clarifications, indent=2)}"
+        
+        prompt = _DECOMPOSE_TEMPLATE.format_map({
+            "food_name": food_name,
+            "volume_litres": volume_litres,
+            "clarification_text": clarification_text,
+            "search_content": search_content if search_content else "No recipe found - use your knowledge"
+        })
+
+        print(f"🧠 LLM reasoning about ingredients and cooking process...")
+        
+        try:
+            decomposition = await self._ainvoke_validated(prompt, DECOMPOSITION_ADAPTER)
+        except ValidationError as e:
             print(f"❌ Error parsing decomposition: {e}")
-            print(f"Response: {response.content[:500]}")
             return None
+        
+        result = decomposition.model_dump()
+        result['is_basic_ingredient'] = False
+        
+        # Recompute volumes from percentages instead of trusting the LLM's arithmetic
+        ingredients = result['ingredient_volumes']
+        percentages = np.fromiter((ing['percentage'] for ing in ingredients), dtype=np.float64, count=len(ingredients))
+        volumes = percentages * (volume_litres / 100.0)
+        for ing, volume in zip(ingredients, volumes.tolist()):
+            ing['volume_litres'] = volume
+        
+        return result
     
-    def decompose_food(self, food_name, volume_litres, clarifications=None):
+    async def decompose_food(self, food_name, volume_litres, clarifications=None, analysis=None):
         """Main decomposition logic"""
         
-        print(f"🤔 LLM analyzing food complexity...")
-        analysis = self.analyze_food_complexity(food_name)
+        if analysis is None:
+            analysis = _trivial_verdict(food_name)
+        if analysis is None:
+            print(f"🤔 LLM analyzing food complexity...")
+            analysis = await self.analyze_food_complexity(food_name)
         
         print(f"📊 Analysis: {analysis['reasoning']}")
         
@@ -236,13 +434,14 @@ NOW ANALYZE "{food_name}":"""
             }
         
         print(f"✓ COMPLEX dish - needs decomposition")
-        search_query = analysis.get('search_query', f"{food_name} recipe ingredients proportions")
-        search_content, sources = self.search_web(search_query)
+        # model_dump() always carries search_query, None when the verdict gave no query
+        search_query = analysis.get('search_query') or f"{food_name} recipe ingredients proportions"
+        search_content, sources = await self.search_web(search_query)
         
         if not search_content:
             print(f"⚠️  No search results, using LLM general knowledge")
         
-        result = self.decompose_complex_food(food_name, volume_litres, search_content, clarifications)
+        result = await self.decompose_complex_food(food_name, volume_litres, search_content, clarifications)
         
         if result:
             result['sources'] = [s.get('url', '') for s in sources[:3]]
@@ -250,14 +449,15 @@ NOW ANALYZE "{food_name}":"""
         
         return None
     
-    def process_json_file(self, filepath):
-        """Process all food items from JSON"""
+    def load_items(self, filepath):
+        """Load food items from JSON"""
         print(f"\n📂 Reading: {filepath}")
         
-        with open(filepath, 'r') as f:
-            data = json.load(f)
-        
-        results = []
+        try:
+            data = orjson.loads(Path(filepath).read_bytes())
+        except orjson.JSONDecodeError as e:
+            print(f"❌ Error: {filepath} is not valid JSON ({e})")
+            return []
         
         # Handle both verified_volumes.json and final_confirmed_output.json formats
         if 'verified_volumes' in data:
@@ -265,16 +465,18 @@ NOW ANALYZE "{food_name}":"""
             print("✓ Detected verified_volumes.json format")
             verified_items = data.get('verified_volumes', [])
             items = []
+            append = items.append
             for item in verified_items:
-                items.append({
-                    'segment_id': item.get('segment_id'),
-                    'final_food_name': item.get('food_name'),
-                    'volume_litres': item.get('suggested_volume_litres'),  # Use VERIFIED volume!
+                get = item.get
+                append({
+                    'segment_id': get('segment_id'),
+                    'final_food_name': get('food_name'),
+                    'volume_litres': get('suggested_volume_litres'),  # Use VERIFIED volume!
                     'clarifications': {},
-                    'volume_adjusted': item.get('adjustment_made', False),
-                    'original_volume': item.get('original_volume_litres'),
-                    'verification_confidence': item.get('confidence', 0.0),
-                    'verification_reasoning': item.get('reasoning', '')
+                    'volume_adjusted': get('adjustment_made', False),
+                    'original_volume': get('original_volume_litres'),
+                    'verification_confidence': get('confidence', 0.0),
+                    'verification_reasoning': get('reasoning', '')
                 })
         elif 'confirmed_results' in data:
             # Old format (fallback compatibility)
@@ -284,46 +486,92 @@ NOW ANALYZE "{food_name}":"""
             print("❌ Error: Unrecognized input format")
             return []
         
+        return items
+    
+    async def _decompose_item(self, idx, item, total, analysis=None):
+        """Decompose one food item and attach its segment metadata"""
+        # Read each field once
+        food_name = item['final_food_name']
+        volume_litres = item['volume_litres']
+        adjusted = item.get('volume_adjusted')
+        
+        print(f"\n{'='*70}")
+        print(f"Item {idx + 1}/{total}: {food_name}")
+        
+        # Show if volume was adjusted
+        if adjusted:
+            print(f"⚠️  Volume ADJUSTED: {item.get('original_volume', 0):.3f}L → {volume_litres:.3f}L")
+            print(f"   Reason: {item.get('verification_reasoning', 'N/A')}")
+        else:
+            print(f"✓ Volume VERIFIED: {volume_litres:.3f}L")
+        
+        print(f"{'='*70}")
+        
+        result = await self.decompose_food(
+            food_name,
+            volume_litres,
+            item.get('clarifications', {}),
+            analysis=analysis
+        )
+        
+        if result:
+            result['segment_id'] = item['segment_id']
+            
+            # Add volume verification metadata
+            if adjusted:
+                result['volume_verification'] = {
+                    'was_adjusted': True,
+                    'original_volume': item.get('original_volume'),
+                    'adjusted_volume': volume_litres,
+                    'confidence': item.get('verification_confidence'),
+                    'reasoning': item.get('verification_reasoning')
+                }
+            
+            print(f"✅ Complete!\n")
+        else:
+            print(f"❌ Failed\n")
+        
+        return result
+    
+    async def stream(self, items):
+        """Yield (idx, decomposed_food) as soon as each item finishes"""
         print(f"\n🍽️  Processing {len(items)} items...\n")
         
+        # Allow-listed simple ingredients skip triage; the rest share one batched LLM call
+        analyses = {}
+        pending = []
         for idx, item in enumerate(items):
-            print(f"\n{'='*70}")
-            print(f"Item {idx + 1}/{len(items)}: {item['final_food_name']}")
-            
-            # Show if volume was adjusted
-            if item.get('volume_adjusted'):
-                print(f"⚠️  Volume ADJUSTED: {item.get('original_volume', 0):.3f}L → {item['volume_litres']:.3f}L")
-                print(f"   Reason: {item.get('verification_reasoning', 'N/A')}")
+            verdict = _trivial_verdict(item['final_food_name'])
+            if verdict:
+                analyses[idx] = verdict
             else:
-                print(f"✓ Volume VERIFIED: {item['volume_litres']:.3f}L")
-            
-            print(f"{'='*70}")
-            
-            result = self.decompose_food(
-                item['final_food_name'],
-                item['volume_litres'],
-                item.get('clarifications', {})
-            )
-            
+                pending.append(idx)
+        
+        if pending:
+            print(f"🤔 LLM analyzing food complexity for {len(pending)} items...")
+            batch = await self.analyze_food_complexity_batch([items[idx]['final_food_name'] for idx in pending])
+            analyses.update((pending[pos], verdict) for pos, verdict in batch.items())
+        
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async def guarded(idx, item):
+            async with semaphore:
+                return idx, await self._decompose_item(idx, item, len(items), analyses.get(idx))
+        
+        for next_done in asyncio.as_completed([guarded(idx, item) for idx, item in enumerate(items)]):
+            idx, result = await next_done
             if result:
-                result['segment_id'] = item['segment_id']
-                
-                # Add volume verification metadata
-                if item.get('volume_adjusted'):
-                    result['volume_verification'] = {
-                        'was_adjusted': True,
-                        'original_volume': item.get('original_volume'),
-                        'adjusted_volume': item['volume_litres'],
-                        'confidence': item.get('verification_confidence'),
-                        'reasoning': item.get('verification_reasoning')
-                    }
-                
-                results.append(result)
-                print(f"✅ Complete!\n")
-            else:
-                print(f"❌ Failed\n")
+                yield idx, result
+    
+    async def process_json_file(self, filepath):
+        """Process all food items from JSON"""
+        items = self.load_items(filepath)
         
-        return results
+        done = [pair async for pair in self.stream(items)]
+        # Keep input order in the output file
+        done.sort(key=lambda pair: pair[0])
+        
+        return [result for _, result in done]
     
     def save_output(self, results, output_path):
         """Save to JSON"""
@@ -332,10 +580,14 @@ NOW ANALYZE "{food_name}":"""
             "decomposed_foods": results
         }
         
-        with open(output_path, 'w') as f:
-            json.dump(output, f, indent=2)
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps(output, option=orjson.OPT_INDENT_2))
         
         print(f"\n💾 Saved: {output_path}")
+    
+    def run(self, filepath):
+        """Sync entrypoint: process all items concurrently"""
+        return asyncio.run(self.process_json_file(filepath))
 
 
 def main():
@@ -349,7 +601,7 @@ def main():
     output_file = "agent1_output.json"
     
     agent = CulinaryDecomposer()
-    results = agent.process_json_file(input_file)
+    results = agent.run(input_file)
     agent.save_output(results, output_file)
     
     print(f"\n{'='*70}")
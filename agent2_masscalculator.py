@@ -5,33 +5,267 @@ FIXED: Uses OpenAI embeddings instead of Gemini
 """
 
 import os
-import json
+import re
+import asyncio
+import hashlib
+import shutil
+import tempfile
+import diskcache
+import orjson
+import numpy as np
+from pathlib import Path
+from typing import List, Literal, Optional
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_community.vectorstores import FAISS
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from pydantic import BaseModel, TypeAdapter, ValidationError
 from tavily import TavilyClient
+from config import http_client, http_async_client
 
 load_dotenv()
 
+# Persistent cache for LLM responses and web searches (shared by all agents)
+LLM_CACHE_DIR = "./.llm_cache"
+# Serialized FAISS indexes, one subfolder per PDF content hash
+FAISS_CACHE_DIR = "./.faiss_cache"
+# Files FAISS.save_local writes; their digest is recorded at save and checked before unpickling
+FAISS_INDEX_FILES = ("index.faiss", "index.pkl")
+# Texts per embeddings API request (OpenAI accepts up to 2048); FAISS.from_documents batches by it
+EMBEDDING_BATCH_SIZE = 512
+
+# Outermost JSON object in an LLM response (tolerates code fences / stray prose)
+_JSON_BLOCK = re.compile(r"\{.*\}", re.DOTALL)
+
+
+def _extract_json(text):
+    match = _JSON_BLOCK.search(text)
+    return match.group(0) if match else text
+
+
+def _index_digest(index_dir):
+    """sha256 over a saved FAISS index's files, or None if any is missing"""
+    digest = hashlib.sha256()
+    for name in FAISS_INDEX_FILES:
+        path = os.path.join(index_dir, name)
+        if not os.path.isfile(path):
+            return None
+        digest.update(Path(path).read_bytes())
+    return digest.hexdigest()
+
+
+def _cache_key(namespace, payload):
+    """Content-addressed key: sha256 of the prompt/query payload"""
+    if not isinstance(payload, str):
+        payload = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS).decode()
+    return f"{namespace}:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+
+def _normalize_ingredient(ingredient_name):
+    """Key used to share density lookups between identical ingredients"""
+    return ingredient_name.lower().strip()
+
+
+class DensityResult(BaseModel):
+    density_kg_per_L: float
+    method: Literal["PDF_RAG", "WEB_SEARCH", "LLM_ESTIMATE"]
+    matched_item: Optional[str] = None
+    confidence: str = "medium"
+    reasoning: str = ""
+
+
+class IndexedDensityResult(DensityResult):
+    idx: int
+
+
+class DensityBatch(BaseModel):
+    densities: List[IndexedDensityResult]
+
+
+DENSITY_ADAPTER = TypeAdapter(DensityResult)
+DENSITY_BATCH_ADAPTER = TypeAdapter(DensityBatch)
+
+# Ingredients resolved per batched density prompt
+DENSITY_BATCH_SIZE = 20
+
+METHOD_SOURCES = {
+    "PDF_RAG": "PDF database",
+    "WEB_SEARCH": "Web search",
+    "LLM_ESTIMATE": "LLM estimate"
+}
+
+
+# Shared density rules (no format fields), used by the single and batched prompts
+_DENSITY_RULES = """=== FALLBACK_GUIDELINES (realistic densities) ===
+- Water, broths, thin liquids: 0.98-1.05 kg/L
+- Milk, dairy liquids: 1.03-1.05 kg/L
+- Most vegetables (raw): 0.5-0.9 kg/L
+- Most vegetables (cooked/boiled): 0.9-1.1 kg/L
+- Leafy vegetables (raw): 0.1-0.3 kg/L
+- Fruits (fresh): 0.5-1.1 kg/L (berries ~0.6-0.8, dense fruits ~0.9-1.1)
+- Bread/pav/buns (airy): 0.25-0.4 kg/L
+- Cooked rice: 0.7-0.8 kg/L
+- Cooked lentils/dal: 0.9-1.1 kg/L
+- Flour (loose): 0.5-0.6 kg/L
+- Eggs (whole): 1.03-1.05 kg/L
+- Sugar: 0.8-0.9 kg/L (granulated)
+- Butter/ghee: 0.91-0.93 kg/L
+- Oils (cooking): 0.88-0.92 kg/L
+- Baking powder: 0.8-1.0 kg/L
+- Fried foods: Similar to base + 10-15% less (oil reduces density slightly)
+
+ORDER OF PREFERENCE:
+1. PDF_RAG: Use PDF_CONTEXT if it has an acceptable match
+2. WEB_SEARCH: Otherwise use WEB_CONTEXT if it states a density
+3. LLM_ESTIMATE: Otherwise estimate using FALLBACK_GUIDELINES and your knowledge
+
+CRITICAL RULES FOR MATCHING (PDF and web):
+1. Look for EXACT matches first: If searching "bread", accept "bread density"
+2. Accept SIMILAR items with same chemical properties:
+   - "pav" = "bread" = "dinner roll" (all baked leavened dough)
+   - "boiled potato" = "cooked potato" = "steamed potato" (all gelatinized starch)
+   - "fried onion" = "sautéed onion" (both cooked, similar)
+3. REJECT items with different chemical properties:
+   - "chips" ≠ "potato" (fried vs raw - vastly different densities)
+   - "fried potato" ≠ "boiled potato" (oil absorption changes density)
+   - "mashed potato" can approximate "boiled potato" (similar density)
+4. If multiple similar matches found, choose the closest one
+
+UNIT CONVERSION:
+- 1 g/mL = 1 kg/L
+- 1 g/cm³ = 1 kg/L
+- If range given (e.g., 0.9-1.1), use middle value
+
+ESTIMATION RULES:
+1. Most food densities are between 0.2 and 1.5 kg/L
+2. If ingredient has "cooked/boiled/steamed" → higher water content → closer to 1.0
+3. If "fried" → lower than boiled version
+4. If "airy/fluffy/bread" → much lower (0.3-0.5)
+5. Think about: texture, water content, air pockets"""
+
+# Static prompt skeletons, filled per call with str.format_map
+_DENSITY_TEMPLATE = """Determine the density of "{ingredient_name}" in kg/L.
+
+=== PDF_CONTEXT (food density database) ===
+{pdf_context}
+
+=== WEB_CONTEXT (web search results) ===
+{web_context}
+
+""" + _DENSITY_RULES + """
+
+OUTPUT (JSON only):
+{{
+  "density_kg_per_L": numeric_value,
+  "method": "PDF_RAG" or "WEB_SEARCH" or "LLM_ESTIMATE",
+  "matched_item": "what item in PDF/web was matched (null if estimated)",
+  "confidence": "low/medium/high",
+  "reasoning": "Why this match/estimate is acceptable"
+}}"""
+
+_DENSITY_BATCH_TEMPLATE = """Determine the density in kg/L of EACH ingredient below.
+Each ingredient has its own PDF_CONTEXT and WEB_CONTEXT; use only that ingredient's context for it.
+
+{ingredient_blocks}
+
+""" + _DENSITY_RULES + """
+
+OUTPUT (JSON only) - one entry per ingredient, in input order, with its idx:
+{{
+  "densities": [
+    {{
+      "idx": 0,
+      "density_kg_per_L": numeric_value,
+      "method": "PDF_RAG" or "WEB_SEARCH" or "LLM_ESTIMATE",
+      "matched_item": "what item in PDF/web was matched (null if estimated)",
+      "confidence": "low/medium/high",
+      "reasoning": "Why this match/estimate is acceptable"
+    }}
+  ]
+}}"""
+
+
 class MassCalculator:
-    def __init__(self, pdf_path):
+    def __init__(self, pdf_path, max_concurrency=8):
         """Initialize Agent 2 with PDF RAG database"""
         # Changed to OpenAI
         self.llm = ChatOpenAI(
             model="gpt-4o-mini",  # or "gpt-4o"
             openai_api_key=os.getenv("OPENAI_API_KEY"),
-            temperature=0.1
+            temperature=0.1,
+            model_kwargs={"response_format": {"type": "json_object"}},
+            http_client=http_client,
+            http_async_client=http_async_client
         )
         self.tavily = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+        self.cache = diskcache.Cache(LLM_CACHE_DIR)
+        # Density results keyed by normalized ingredient name: (density, method, details)
+        self._density_cache = {}
+        # Lookups in flight, keyed by normalized ingredient name (one task may cover many ingredients)
+        self._density_lookups = {}
+        # Max foods processed concurrently (respects API rate limits)
+        self.max_concurrency = max_concurrency
         
         print(f"📚 Loading PDF database: {pdf_path}")
         self.vectorstore = self._load_pdf_database(pdf_path)
         print(f"✅ PDF database ready!\n")
     
+    async def _ainvoke_validated(self, prompt, adapter, max_attempts=2):
+        """Invoke LLM in JSON mode and validate the response, re-invoking on malformed output"""
+        key = _cache_key("llm", {"model": self.llm.model_name, "prompt": prompt})
+        cached = self.cache.get(key)
+        if cached is not None:
+            return adapter.validate_json(cached)
+        
+        for attempt in range(1, max_attempts + 1):
+            response = await self.llm.ainvoke(prompt)
+            content = _extract_json(response.content)
+            try:
+                result = adapter.validate_json(content)
+            except ValidationError as e:
+                print(f"  ⚠️ Invalid LLM output (attempt {attempt}/{max_attempts}): {e.error_count()} error(s)")
+                if attempt == max_attempts:
+                    raise
+                continue
+            # Only cache responses that passed validation
+            self.cache.set(key, content)
+            return result
+    
+    def _cached_search(self, **search_kwargs):
+        """Tavily search, cached on disk by query + search options"""
+        key = _cache_key("tavily", search_kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        
+        search_results = self.tavily.search(**search_kwargs)
+        self.cache.set(key, search_results)
+        return search_results
+    
     def _load_pdf_database(self, pdf_path):
-        """Load PDF and create RAG vector database"""
+        """Load PDF and create RAG vector database (cached on disk by PDF content hash)"""
+        # Changed to OpenAI embeddings
+        embeddings = OpenAIEmbeddings(
+            model="text-embedding-3-small",  # or "text-embedding-3-large"
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            chunk_size=EMBEDDING_BATCH_SIZE,  # texts per embeddings request
+            max_retries=6,
+            http_client=http_client,
+            http_async_client=http_async_client
+        )
+        
+        with open(pdf_path, 'rb') as f:
+            pdf_hash = hashlib.sha256(f.read()).hexdigest()
+        cache_dir = os.path.join(FAISS_CACHE_DIR, pdf_hash)
+        
+        # load_local unpickles index.pkl, so only an index this agent saved (digest recorded below) is trusted
+        digest_key = _cache_key("faiss", pdf_hash)
+        recorded = self.cache.get(digest_key)
+        if recorded is not None and os.path.isdir(cache_dir) and _index_digest(cache_dir) == recorded:
+            print(f"♻️  Using cached FAISS index: {cache_dir}")
+            return FAISS.load_local(cache_dir, embeddings, allow_dangerous_deserialization=True)
+        
         # Load PDF
         loader = PyPDFLoader(pdf_path)
         documents = loader.load()
@@ -43,240 +277,219 @@ class MassCalculator:
         )
         chunks = text_splitter.split_documents(documents)
         
-        # Changed to OpenAI embeddings
-        embeddings = OpenAIEmbeddings(
-            model="text-embedding-3-small",  # or "text-embedding-3-large"
-            openai_api_key=os.getenv("OPENAI_API_KEY")
-        )
         vectorstore = FAISS.from_documents(chunks, embeddings)
         
+        # Saved to a temp dir and renamed into place: a crash mid-save never leaves a partial index at cache_dir
+        os.makedirs(FAISS_CACHE_DIR, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=f".{pdf_hash}.", dir=FAISS_CACHE_DIR)
+        try:
+            vectorstore.save_local(tmp_dir)
+            digest = _index_digest(tmp_dir)
+            shutil.rmtree(cache_dir, ignore_errors=True)  # unrecorded or stale index
+            os.replace(tmp_dir, cache_dir)
+            self.cache.set(digest_key, digest)
+        except OSError as e:
+            # Disk full, or another process renamed its copy in first: this run still has the index in memory
+            print(f"⚠️  Could not cache FAISS index: {e}")
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        
         return vectorstore
     
-    def search_density_in_pdf(self, ingredient_name):
-        """Search for density in PDF using RAG"""
-        print(f"  📖 Searching PDF for: {ingredient_name}")
+    def batch_search_pdf(self, names, k=5):
+        """
+        Retrieve PDF context for many ingredients with one embeddings request + one FAISS search
+        Returns: {name: context_str}
+        """
+        if not names:
+            return {}
         
-        # Retrieve relevant chunks
-        docs = self.vectorstore.similarity_search(ingredient_name, k=5)
-        context = "\n\n".join([doc.page_content for doc in docs])
+        vectors = self.vectorstore.embeddings.embed_documents(names)
+        _, indices = self.vectorstore.index.search(np.asarray(vectors, dtype=np.float32), k)
         
-        if not context.strip():
-            print(f"  ❌ No relevant content found in PDF")
-            return None
+        contexts = {}
+        for name, row in zip(names, indices):
+            docs = [
+                self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[i])
+                for i in row if i != -1
+            ]
+            contexts[name] = "\n\n".join(doc.page_content for doc in docs)
         
-        # Ask LLM to extract density from PDF content
-        prompt = f"""Extract the density of "{ingredient_name}" from this PDF content.
-
-PDF CONTENT:
-{context}
-
-CRITICAL RULES FOR MATCHING:
-1. Look for EXACT matches first: If searching "bread", accept "bread density"
-2. Accept SIMILAR items with same chemical properties:
-   - "pav" = "bread" = "dinner roll" (all baked leavened dough)
-   - "boiled potato" = "cooked potato" = "steamed potato" (all gelatinized starch)
-   - "fried onion" = "sautéed onion" (both cooked, similar)
-   
-3. REJECT items with different chemical properties:
-   - "chips" ≠ "potato" (fried vs raw - vastly different densities)
-   - "fried potato" ≠ "boiled potato" (oil absorption changes density)
-   - "mashed potato" can approximate "boiled potato" (similar density)
-
-4. If multiple similar matches found, choose the closest one
-
-TASK: Find density in kg/L or g/mL for "{ingredient_name}"
-
-OUTPUT (JSON only):
-{{
-  "found": true/false,
-  "density_kg_per_L": numeric_value or null,
-  "matched_item": "what item in PDF was matched",
-  "reasoning": "why this match is acceptable"
-}}
-
-If not found or no acceptable match, return: {{"found": false}}"""
-
-        response = self.llm.invoke(prompt)
-        
-        try:
-            response_text = response.content
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-            json_str = response_text[json_start:json_end]
-            result = json.loads(json_str)
-            
-            if result.get('found'):
-                density = result['density_kg_per_L']
-                
-                # SANITY CHECK
-                if density > 2.0 or density < 0.05:
-                    print(f"  ⚠️ Unrealistic density {density} kg/L from PDF - likely error")
-                    return None
-                
-                print(f"  ✅ Found in PDF: {density} kg/L (matched: {result['matched_item']})")
-                return density
-            else:
-                print(f"  ❌ Not found in PDF")
-                return None
-        except:
-            print(f"  ❌ PDF search failed")
-            return None
+        return contexts
     
-    def search_density_on_web(self, ingredient_name):
-        """Search for density on web"""
+    async def _fetch_web_context(self, ingredient_name):
+        """Web search for density, returns concatenated snippets"""
         if len(ingredient_name) > 50:
             print(f"  ⏭️ Skipping web search (name too complex)")
-            return None
+            return ""
         print(f"  🌐 Web searching: {ingredient_name}")
         
         query = f"density of {ingredient_name} in kg/L or g/mL"
         
         try:
-            search_results = self.tavily.search(
+            # Tavily client is sync - run it off the event loop
+            search_results = await asyncio.to_thread(
+                self._cached_search,
                 query=query,
                 search_depth="basic",
                 max_results=2,
                 include_answer=True
             )
-            
-            content = search_results.get('answer', '')
-            for result in search_results.get('results', []):
-                content += f"\n{result.get('content', '')}"
-            
-            if not content.strip():
-                print(f"  ❌ No web results")
-                return None
-            
-            # Ask LLM to extract density
-            prompt = f"""Extract density of "{ingredient_name}" from web search results.
-
-SEARCH RESULTS:
-{content}
-
-RULES:
-1. Extract density value in kg/L
-2. If given in g/mL, convert: 1 g/mL = 1 kg/L
-3. If given in g/cm³, convert: 1 g/cm³ = 1 kg/L
-4. If range given (e.g., 0.9-1.1), use middle value
-
-OUTPUT (JSON only):
-{{
-  "found": true/false,
-  "density_kg_per_L": numeric_value,
-  "reasoning": "brief note on extraction"
-}}
-
-If not found: {{"found": false}}"""
-
-            response = self.llm.invoke(prompt)
-            
-            response_text = response.content
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-            json_str = response_text[json_start:json_end]
-            result = json.loads(json_str)
-            
-            if result.get('found'):
-                density = result['density_kg_per_L']
-                
-                # SANITY CHECK: Catch unrealistic densities
-                if density > 2.0 or density < 0.05:
-                    print(f"  ⚠️ Unrealistic density {density} kg/L - likely conversion error")
-                    print(f"  🔄 Falling back to estimation")
-                    return None
-                
-                print(f"  ✅ Found on web: {density} kg/L (from: {result.get('original_value', 'N/A')})")
-                return density
-            else:
-                print(f"  ❌ Not found on web")
-                return None
         except Exception as e:
             print(f"  ❌ Web search error: {e}")
-            return None
+            return ""
+        
+        content = search_results.get('answer', '')
+        for result in search_results.get('results', []):
+            content += f"\n{result.get('content', '')}"
+        return content
     
-    def estimate_density(self, ingredient_name):
-        """LLM estimates density based on reasoning"""
-        print(f"  🧠 LLM estimating density...")
+    async def determine_density(self, ingredient_name, pdf_context, web_context):
+        """Single LLM call: prefer PDF match → web match → estimate
+        Returns: (density, method, details)"""
         
-        prompt = f"""Estimate the density of "{ingredient_name}" in kg/L using your knowledge.
-
-REALISTIC DENSITY GUIDELINES:
-- Water, broths, thin liquids: 0.98-1.05 kg/L
-- Milk, dairy liquids: 1.03-1.05 kg/L
-- Most vegetables (raw): 0.5-0.9 kg/L
-- Most vegetables (cooked/boiled): 0.9-1.1 kg/L
-- Leafy vegetables (raw): 0.1-0.3 kg/L
-- Fruits (fresh): 0.5-1.1 kg/L (berries ~0.6-0.8, dense fruits ~0.9-1.1)
-- Bread/pav/buns (airy): 0.25-0.4 kg/L
-- Cooked rice: 0.7-0.8 kg/L
-- Cooked lentils/dal: 0.9-1.1 kg/L
-- Flour (loose): 0.5-0.6 kg/L
-- Eggs (whole): 1.03-1.05 kg/L
-- Sugar: 0.8-0.9 kg/L (granulated)
-- Butter/ghee: 0.91-0.93 kg/L
-- Oils (cooking): 0.88-0.92 kg/L
-- Baking powder: 0.8-1.0 kg/L
-- Fried foods: Similar to base + 10-15% less (oil reduces density slightly)
-
-CRITICAL RULES:
-1. Most food densities are between 0.2 and 1.5 kg/L
-2. If ingredient has "cooked/boiled/steamed" → higher water content → closer to 1.0
-3. If "fried" → lower than boiled version
-4. If "airy/fluffy/bread" → much lower (0.3-0.5)
-5. Think about: texture, water content, air pockets
-
-YOUR TASK:
-Analyze "{ingredient_name}" and estimate realistic density.
-
-OUTPUT (JSON only):
-{{
-  "estimated_density_kg_per_L": numeric_value (between 0.1-1.5 for most foods),
-  "confidence": "low/medium/high",
-  "reasoning": "Explain: What is the base ingredient? Cooking method? Water/air content? Why this density?"
-}}"""
+        pdf_context = pdf_context.strip() if pdf_context else ""
+        web_context = web_context.strip() if web_context else ""
+        prompt = _DENSITY_TEMPLATE.format_map({
+            "ingredient_name": ingredient_name,
+            "pdf_context": pdf_context or "No relevant content found in PDF",
+            "web_context": web_context or "No web results"
+        })
 
-        response = self.llm.invoke(prompt)
+        print(f"  🧠 LLM determining density...")
+        try:
+            result = await self._ainvoke_validated(prompt, DENSITY_ADAPTER)
+        except ValidationError:
+            print(f"  ❌ Density lookup failed, using default 1.0 kg/L")
+            return 1.0, "LLM_ESTIMATE", {"confidence": "low", "reasoning": "Default fallback"}
+        
+        accepted = self._accept_density(ingredient_name, result)
+        if accepted is None:
+            density = result.density_kg_per_L
+            return 1.0, "LLM_ESTIMATE", {"confidence": "low", "reasoning": f"Rejected unrealistic density {density} kg/L"}
+        return accepted
+    
+    def _accept_density(self, ingredient_name, result):
+        """Sanity-check an LLM density result
+        Returns: (density, method, details), or None if the density is unrealistic"""
+        density = result.density_kg_per_L
+        
+        # SANITY CHECK: Catch unrealistic densities
+        if density > 2.0 or density < 0.05:
+            print(f"  ⚠️ Unrealistic density {density} kg/L for {ingredient_name} ({result.method})")
+            return None
+        
+        print(f"  ✅ {ingredient_name} → {result.method}: {density} kg/L (matched: {result.matched_item or 'N/A'}, confidence: {result.confidence})")
+        details = {
+            "source": METHOD_SOURCES[result.method],
+            "matched_item": result.matched_item,
+            "confidence": result.confidence,
+            "reasoning": result.reasoning
+        }
+        return density, result.method, details
+    
+    async def determine_density_batch(self, entries):
+        """One LLM call for up to DENSITY_BATCH_SIZE ingredients
+        entries: [(ingredient_name, pdf_context, web_context)]
+        Returns: {position: (density, method, details)} for accepted results only"""
+        blocks = []
+        for i, (ingredient_name, pdf_context, web_context) in enumerate(entries):
+            pdf_context = pdf_context.strip() if pdf_context else ""
+            web_context = web_context.strip() if web_context else ""
+            blocks.append(
+                f'### idx {i}: "{ingredient_name}"\n'
+                f"=== PDF_CONTEXT ===\n{pdf_context or 'No relevant content found in PDF'}\n"
+                f"=== WEB_CONTEXT ===\n{web_context or 'No web results'}"
+            )
+        prompt = _DENSITY_BATCH_TEMPLATE.format_map({"ingredient_blocks": "\n\n".join(blocks)})
         
+        print(f"  🧠 LLM determining density for {len(entries)} ingredients...")
         try:
-            response_text = response.content
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-            json_str = response_text[json_start:json_end]
-            result = json.loads(json_str)
-            
-            density = result['estimated_density_kg_per_L']
-            print(f"  💭 Estimated: {density} kg/L (confidence: {result['confidence']})")
-            return density, result
-        except:
-            print(f"  ❌ Estimation failed, using default 1.0 kg/L")
-            return 1.0, {"confidence": "low", "reasoning": "Default fallback"}
+            batch = await self._ainvoke_validated(prompt, DENSITY_BATCH_ADAPTER)
+        except ValidationError:
+            print(f"  ⚠️ Batch density lookup failed, falling back to per-ingredient calls")
+            return {}
+        
+        accepted = {}
+        for result in batch.densities:
+            if 0 <= result.idx < len(entries) and result.idx not in accepted:
+                found = self._accept_density(entries[result.idx][0], result)
+                if found is not None:
+                    accepted[result.idx] = found
+        return accepted
     
-    def get_density_with_fallback(self, ingredient_name, volume_litres):
+    async def build_density_map(self, foods):
         """
-        Waterfall approach: PDF → Web → Estimate
-        Returns: (density, mass, method, details)
+        Look up density once per unique ingredient across all foods
+        Returns: {normalized_name: (density, method, details)}
         """
-        print(f"\n🔍 Finding density for: {ingredient_name} ({volume_litres}L)")
-        
-        # Step 1: Try PDF
-        density = self.search_density_in_pdf(ingredient_name)
-        if density:
-            mass = volume_litres * density * 1000  # Convert to grams
-            return density, mass, "PDF_RAG", {"source": "PDF database"}
-        
-        # Step 2: Try Web
-        density = self.search_density_on_web(ingredient_name)
-        if density:
-            mass = volume_litres * density * 1000
-            return density, mass, "WEB_SEARCH", {"source": "Web search"}
-        
-        # Step 3: Estimate
-        density, estimate_info = self.estimate_density(ingredient_name)
-        mass = volume_litres * density * 1000
-        return density, mass, "LLM_ESTIMATE", estimate_info
+        unique = {}
+        for food in foods:
+            for ing in food['ingredient_volumes']:
+                unique.setdefault(_normalize_ingredient(ing['ingredient_name']), ing['ingredient_name'])
+        
+        # Streaming workers call this concurrently, one food each: an ingredient another call is already
+        # looking up (salt, oil, water) is awaited instead of searched and resolved a second time
+        pending = {key: self._density_lookups[key] for key in unique
+                   if key not in self._density_cache and key in self._density_lookups}
+        missing = {key: name for key, name in unique.items()
+                   if key not in self._density_cache and key not in self._density_lookups}
+        print(f"🧮 {len(unique)} unique ingredients ({len(missing)} need lookup, {len(pending)} already in flight)")
+        
+        if missing:
+            lookup = asyncio.ensure_future(self._resolve_densities(missing))
+            for key in missing:
+                self._density_lookups[key] = lookup
+            pending.update(dict.fromkeys(missing, lookup))
+        
+        try:
+            for found in await asyncio.gather(*set(pending.values())):
+                self._density_cache.update(found)
+        finally:
+            for key in missing:
+                self._density_lookups.pop(key, None)
+        
+        return {key: self._density_cache[key] for key in unique}
     
-    def calculate_mass_for_food(self, food_item):
-        """Calculate total mass for one food item"""
+    async def _resolve_densities(self, missing):
+        """
+        PDF + web context and batched LLM resolution for ingredients nobody has looked up yet
+        Returns: {normalized_name: (density, method, details)} for every ingredient in missing
+        """
+        # Retrieve PDF context for all missing ingredients in one batch
+        names = list(missing.values())
+        pdf_contexts = await asyncio.to_thread(self.batch_search_pdf, names)
+        
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async def fetch_web(ingredient_name):
+            async with semaphore:
+                return await self._fetch_web_context(ingredient_name)
+        
+        web_contexts = await asyncio.gather(*[fetch_web(name) for name in names])
+        entries = [(name, pdf_contexts.get(name), web) for name, web in zip(names, web_contexts)]
+        
+        async def resolve_batch(start):
+            async with semaphore:
+                return start, await self.determine_density_batch(entries[start:start + DENSITY_BATCH_SIZE])
+        
+        resolved = {}
+        for start, accepted in await asyncio.gather(*[resolve_batch(start) for start in range(0, len(entries), DENSITY_BATCH_SIZE)]):
+            resolved.update((start + i, found) for i, found in accepted.items())
+        
+        # Ingredients the batch could not resolve get their own single-ingredient call
+        async def lookup(i):
+            async with semaphore:
+                print(f"\n🔍 Finding density for: {entries[i][0]}")
+                return i, await self.determine_density(*entries[i])
+        
+        retry = [i for i in range(len(entries)) if i not in resolved]
+        resolved.update(await asyncio.gather(*[lookup(i) for i in retry]))
+        
+        return {key: resolved[i] for i, key in enumerate(missing)}
+    
+    def calculate_mass_for_food(self, food_item, density_map):
+        """Calculate total mass for one food item from precomputed densities"""
         
         food_name = food_item['original_food_name']
         is_basic = food_item.get('is_basic_ingredient', False)
@@ -286,26 +499,31 @@ OUTPUT (JSON only):
         print(f"Type: {'BASIC' if is_basic else 'COMPLEX'}")
         print(f"{'='*70}")
         
-        ingredient_masses = []
-        
-        for ing in food_item['ingredient_volumes']:
-            ing_name = ing['ingredient_name']
-            volume = ing['volume_litres']
-            
-            # Get density and calculate mass
-            density, mass, method, details = self.get_density_with_fallback(ing_name, volume)
-            
-            ingredient_masses.append({
-                "ingredient_name": ing_name,
+        ingredients = food_item['ingredient_volumes']
+        # Unpack each ingredient once, then reuse the columns below
+        names = [ing['ingredient_name'] for ing in ingredients]
+        volume_list = [ing['volume_litres'] for ing in ingredients]
+        lookups = [density_map[_normalize_ingredient(name)] for name in names]
+        
+        # Calculate all ingredient masses at once (grams)
+        volumes = np.array(volume_list, dtype=np.float64)
+        densities = np.array([density for density, _, _ in lookups], dtype=np.float64)
+        masses = np.round(volumes * densities * 1000, 2)
+        
+        ingredient_masses = [
+            {
+                "ingredient_name": name,
                 "volume_litres": volume,
                 "density_kg_per_L": density,
-                "mass_grams": round(mass, 2),
+                "mass_grams": mass,
                 "method": method,
                 "details": details
-            })
+            }
+            for name, volume, (density, method, details), mass in zip(names, volume_list, lookups, masses.tolist())
+        ]
         
         # Calculate total mass
-        total_mass = sum(item['mass_grams'] for item in ingredient_masses)
+        total_mass = float(masses.sum())
         
         result = {
             "food_name": food_name,
@@ -319,22 +537,45 @@ OUTPUT (JSON only):
         
         return result
     
-    def process_agent1_output(self, agent1_output_path):
+    async def process_agent1_output(self, agent1_output_path):
         """Process all foods from Agent 1 output"""
         
         print(f"📁 Reading Agent 1 output: {agent1_output_path}\n")
         
-        with open(agent1_output_path, 'r') as f:
-            data = json.load(f)
+        try:
+            data = orjson.loads(Path(agent1_output_path).read_bytes())
+        except orjson.JSONDecodeError as e:
+            print(f"❌ Error: {agent1_output_path} is not valid JSON ({e})")
+            return []
         
         foods = data.get('decomposed_foods', [])
-        results = []
+        density_map = await self.build_density_map(foods)
         
-        for food in foods:
-            result = self.calculate_mass_for_food(food)
-            results.append(result)
+        return [self.calculate_mass_for_food(food, density_map) for food in foods]
+    
+    async def consume(self, queue, num_workers=4):
+        """
+        Streaming mode: calculate masses for (idx, food) pairs taken from an asyncio.Queue.
+        Each worker stops on a None sentinel; results are returned in idx order.
+        """
+        done = []
+        
+        async def worker():
+            while True:
+                entry = await queue.get()
+                try:
+                    if entry is None:
+                        return
+                    idx, food = entry
+                    density_map = await self.build_density_map([food])
+                    done.append((idx, self.calculate_mass_for_food(food, density_map)))
+                finally:
+                    queue.task_done()
         
-        return results
+        await asyncio.gather(*[worker() for _ in range(num_workers)])
+        done.sort(key=lambda pair: pair[0])
+        
+        return [result for _, result in done]
     
     def save_output(self, results, output_path):
         """Save results to JSON"""
@@ -343,10 +584,14 @@ OUTPUT (JSON only):
             "food_masses": results
         }
         
-        with open(output_path, 'w') as f:
-            json.dump(output, f, indent=2)
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps(output, option=orjson.OPT_INDENT_2))
         
         print(f"\n💾 Saved: {output_path}")
+    
+    def run(self, agent1_output_path):
+        """Sync entrypoint: process all foods concurrently"""
+        return asyncio.run(self.process_agent1_output(agent1_output_path))
 
 
 def main():
@@ -365,7 +610,7 @@ def main():
     agent = MassCalculator(pdf_path)
     
     # Process foods
-    results = agent.process_agent1_output(agent1_output)
+    results = agent.run(agent1_output)
     
     # Save output
     agent.save_output(results, output_file)
@@ -8,100 +8,129 @@ Calculates final nutritional information based on mass from Agent 2.
 """
 
 import os
+import re
+import sys
+import logging
 import json
+import asyncio
+import hashlib
+import diskcache
+import orjson
+import numpy as np
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
-from tavily import TavilyClient
+from openai import AsyncOpenAI
+from tavily import AsyncTavilyClient
+from config import http_client, http_async_client
 from datetime import datetime
 
 load_dotenv()
 
-class NutritionProfiler:
-    def __init__(self):
-        """Initialize Agent 3"""
-        self.llm = ChatOpenAI(
-            model="gpt-4o",
-            openai_api_key=os.getenv("OPENAI_API_KEY"),
-            temperature=0.0
-        )
-        self.tavily = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
-        print("✅ Agent 3: Nutritional Profiler (v2) is ready.\n")
+# Per-segment progress goes through logging so served/batch runs can silence it (CALAI_LOG=WARNING)
+logger = logging.getLogger("calai.agent3")
 
-    def _generate_search_query(self, complex_food_name: str) -> str:
-        """
-        Uses an LLM to simplify a detailed food name into a concise, searchable term.
-        """
-        print(f"  🧠 Generating simplified query for: '{complex_food_name}'")
-        prompt = f"""
+# Persistent cache for LLM responses and web searches (shared by all agents)
+LLM_CACHE_DIR = "./.llm_cache"
+
+
+def _cache_key(namespace, payload):
+    """Content-addressed key: sha256 of the prompt/query payload"""
+    if not isinstance(payload, str):
+        payload = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS).decode()
+    return f"{namespace}:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+
+def _normalize_query(name):
+    """Key shared by trivially different spellings of a dish ("Pav  Bhaji" == "pav bhaji")"""
+    return " ".join(name.lower().split())
+
+
+# Local query simplification (most names only need parentheticals, amounts and adjectives removed)
+_PARENTHETICAL = re.compile(r"\([^)]*\)")
+_QUANTITY = re.compile(r"\b\d+(\.\d+)?\s*(-\s*\d+(\.\d+)?\s*)?(g|grams?|gm|ml|kcal)\b", re.IGNORECASE)
+# Everything after one of these describes additions, not the dish
+_ADDITIONS = re.compile(r"\s(with|without|no)\s.*$", re.IGNORECASE)
+_STOPWORDS = {"generous", "added", "enriched", "plain", "chopped", "cut", "fresh", "homemade", "of"}
+# Longer results are probably not a dish name any more - let the LLM handle those
+_MAX_QUERY_TOKENS = 6
+
+
+def _simplify_local(name):
+    """Deterministic query simplification; returns "" when the LLM should decide"""
+    name = _PARENTHETICAL.sub(" ", name)
+    name = _QUANTITY.sub(" ", name)
+    name = _ADDITIONS.sub("", name)
+    tokens = [
+        token for token in name.split()
+        if not any(part in _STOPWORDS for part in token.lower().split("-"))
+    ]
+    if not tokens or len(tokens) > _MAX_QUERY_TOKENS:
+        return ""
+    return " ".join(tokens).title()
+
+
+# Search-context compression: keep only sentences that state a number next to a nutrition term
+_SENTENCE_SPLIT = re.compile(r"\n+|(?<=[.;!?])\s+")
+_NUTRITION_TERMS = re.compile(r"\b(kcal|cal|calories|g|grams?|protein|fat|carb\w*|serving|cup|oz)\b", re.IGNORECASE)
+MAX_CONTEXT_CHARS = 1500
+
+
+def _compress_search_content(content):
+    """Drop scraped text that carries no nutrition numbers, capped at MAX_CONTEXT_CHARS"""
+    kept = [
+        piece.strip() for piece in _SENTENCE_SPLIT.split(content)
+        if piece.strip().startswith("Source:") or (re.search(r"\d", piece) and _NUTRITION_TERMS.search(piece))
+    ]
+    compressed = "\n".join(kept)
+    # Nothing numeric survived - better to send the raw text than only URLs
+    if not _NUTRITION_TERMS.search(compressed):
+        compressed = content
+    return compressed[:MAX_CONTEXT_CHARS]
+
+
+# Per-segment nutrient columns, in the order they are summed
+NUTRIENT_KEYS = ("calories_kcal", "protein_g", "fat_g", "carbohydrates_g")
+# An extraction without these is unusable (and would break the cached-hit log), so it is never cached
+REQUIRED_NUTRITION_KEYS = ("calories_kcal", "serving_size_grams")
+
+# OpenAI Batch API (offline --batch mode): half price, results within 24h
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_POLL_SECONDS = 60
+BATCH_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# Provider-side prompt caching: static instructions come first so every call shares the prefix
+QUERY_PROMPT_CACHE_KEY = "nutrition_query_v1"
+EXTRACTION_PROMPT_CACHE_KEY = "nutrition_extract_v1"
+
+# Static prompt skeletons, filled per call with str.format_map
+_QUERY_TEMPLATE = """
 You are a search query generator. Your task is to simplify a detailed food name into a concise, searchable term for finding nutritional information.
-Remove specific preparations, brand names, additions, or descriptions. Keep the core dish name.
+RULE: Strip adjectives, quantities, brand names, additions and preparation notes. Keep the core dish name.
 
-Here are some examples:
+Examples:
 - Input: "Pav Bhaji with Generous Butter (50g Added)" -> Output: "Pav Bhaji"
-- Input: "Butter-Enriched Pav (Dinner Roll) with 5-10 Grams of Butter" -> Output: "Pav (Dinner Roll)"
 - Input: "chopped raw cut onions (no dressing)" -> Output: "raw onions"
-- Input: "Plain Steamed Rice (No Oil)" -> Output: "Steamed White Rice"
-- Input: "Dal (Lentil Soup)" -> Output: "Dal"
-
-Now, simplify this food name: "{complex_food_name}"
 
-OUTPUT (JSON only with a single key "simple_name"):
+OUTPUT JSON:
 {{
   "simple_name": "your_simplified_name_here"
 }}
-"""
-        try:
-            response = self.llm.invoke(prompt)
-            response_text = response.content.strip()
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-            json_str = response_text[json_start:json_end]
-            result = json.loads(json_str)
-            simple_name = result.get("simple_name", complex_food_name)
-            print(f"  ✅ Simplified query: '{simple_name}'")
-            return simple_name
-        except Exception as e:
-            print(f"  ⚠️ Query generation failed for '{complex_food_name}', using original name. Error: {e}")
-            return complex_food_name
-
-    def search_nutrition_on_web(self, food_name: str):
-        """
-        Web searches for nutritional info using a generated query and uses an LLM to extract it.
-        """
-        # Step 1: Generate a better search query
-        simple_query = self._generate_search_query(food_name)
 
-        print(f"  🌐 Web searching for: '{simple_query}'")
-        query = f"nutritional information for '{simple_query}' calories protein fat carbohydrates per 100g or per serving size"
-        
-        try:
-            search_results = self.tavily.search(
-                query=query, search_depth="basic", max_results=5, include_answer=True
-            )
-            
-            content = search_results.get('answer', '')
-            for result in search_results.get('results', []):
-                content += f"\n---\nSource: {result.get('url')}\nContent: {result.get('content', '')}"
-            
-            if not content.strip():
-                print(f"  ❌ No web results found for '{simple_query}'")
-                return None
-            
-            prompt = f"""
-You are an expert nutritional data analyst. From the provided web search results for "{simple_query}", extract the nutritional information.
+Now, simplify this food name: "{complex_food_name}"
+"""
 
-SEARCH RESULTS:
-{content}
+_EXTRACTION_TEMPLATE = """
+You are an expert nutritional data analyst. From the web search results provided at the end, extract the nutritional information for the DISH named there.
 
 CRITICAL INSTRUCTIONS:
-1.  **DO NOT USE INGREDIENTS:** Analyze the nutritional information for the complete dish "{simple_query}", not its individual ingredients.
+1.  **DO NOT USE INGREDIENTS:** Analyze the nutritional information for the complete DISH, not its individual ingredients.
 2.  **IDENTIFY SERVING SIZE:** This is your most important task. First, find the serving size (e.g., "100g", "1 cup", "250g serving").
 3.  **CONVERT SERVING SIZE TO GRAMS:** If the serving size is not in grams (e.g., "1 cup"), you MUST find a gram equivalent in the text (e.g., "1 cup is approximately 245g"). If no conversion is available, you must make a reasonable estimation and state it in the reasoning.
 4.  **EXTRACT NUTRITION FOR THAT SERVING SIZE:** Extract calories (kcal), protein (g), fat (g), and carbohydrates (g) for the exact serving size you identified.
 5.  **HANDLE RANGES:** If a range is given (e.g., 20-25g protein), use the average value.
 6.  **URL:** Provide the best source URL you used.
 
-OUTPUT (JSON only, no other text):
+OUTPUT JSON:
 {{
   "found": true/false,
   "serving_size_grams": <numeric_value_in_grams>,
@@ -114,87 +143,420 @@ OUTPUT (JSON only, no other text):
 }}
 
 If no reliable data can be found, return {{"found": false}}.
+
+DISH: "{simple_query}"
+
+SEARCH RESULTS:
+{content}
 """
-            response = self.llm.invoke(prompt)
-            response_text = response.content.strip()
-            
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-            json_str = response_text[json_start:json_end]
-            result = json.loads(json_str)
-
-            if result.get("found"):
-                print(f"  ✅ Found on web: {result['calories_kcal']} kcal per {result['serving_size_grams']}g")
-                return result
-            else:
-                print(f"  ❌ Could not find reliable nutritional data for '{simple_query}'")
+
+
+class NutritionProfiler:
+    def __init__(self, max_concurrency=5, model="gpt-4o", query_model="gpt-4o-mini"):
+        """Initialize Agent 3"""
+        # Nutrition extraction needs the stronger model's reasoning
+        self.llm = ChatOpenAI(
+            model=model,
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            temperature=0.0,
+            model_kwargs={"response_format": {"type": "json_object"}},
+            http_client=http_client,
+            http_async_client=http_async_client
+        )
+        # Query simplification is plain text normalization - a smaller model is plenty
+        self.query_llm = ChatOpenAI(
+            model=query_model,
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            temperature=0.0,
+            model_kwargs={"response_format": {"type": "json_object"}},
+            http_client=http_client,
+            http_async_client=http_async_client
+        )
+        # Raw client for the Batch API (files + batches endpoints)
+        self.openai = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_async_client)
+        # Async client keeps one HTTP session for all segments' searches
+        self.tavily = AsyncTavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+        self.cache = diskcache.Cache(LLM_CACHE_DIR)
+        # In-process memo of nutrition lookups, keyed by normalized simplified query
+        self._nutrition_lookups = {}
+        # Max segments looked up concurrently (respects API rate limits)
+        self.max_concurrency = max_concurrency
+        logger.info("✅ Agent 3: Nutritional Profiler (v2) is ready.\n")
+
+    async def _cached_search(self, **search_kwargs):
+        """Tavily search, cached on disk by query + search options"""
+        key = _cache_key("tavily", search_kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        
+        search_results = await self.tavily.search(**search_kwargs)
+        self.cache.set(key, search_results)
+        return search_results
+
+    async def _astream_json_object(self, prompt, **kwargs):
+        """
+        Streams the LLM response and returns as soon as the first top-level JSON object closes.
+        """
+        text = ""
+        start = None
+        depth = 0
+        in_string = escaped = False
+        stream = self.llm.astream(prompt, **kwargs)
+        try:
+            async for chunk in stream:
+                offset = len(text)
+                text += chunk.content
+                for pos in range(offset, len(text)):
+                    char = text[pos]
+                    if start is None:
+                        if char == '{':
+                            start, depth = pos, 1
+                    elif in_string:
+                        if escaped:
+                            escaped = False
+                        elif char == '\\':
+                            escaped = True
+                        elif char == '"':
+                            in_string = False
+                    elif char == '"':
+                        in_string = True
+                    elif char == '{':
+                        depth += 1
+                    elif char == '}':
+                        depth -= 1
+                        if depth == 0:
+                            return text[start:pos + 1]
+        finally:
+            # Returning early leaves the rest of the response streaming over the shared pool until closed
+            await stream.aclose()
+        # Stream ended without a balanced object - let json.loads report it
+        return text[start:] if start is not None else text
+
+    def _query_cache_key(self, complex_food_name):
+        return _cache_key("simple_name", {"model": self.query_llm.model_name, "food_name": complex_food_name})
+
+    def _nutrition_cache_key(self, simple_query):
+        return _cache_key("nutrition", {"model": self.llm.model_name, "query": _normalize_query(simple_query)})
+
+    async def _generate_search_query(self, complex_food_name: str) -> str:
+        """
+        Simplifies a detailed food name into a concise, searchable term.
+        Tries the local regex/stopword pass first and falls back to an LLM.
+        """
+        simple_name = _simplify_local(complex_food_name)
+        if simple_name:
+            logger.info(f"  ✅ Simplified query (local): '{simple_name}'")
+            return simple_name
+
+        key = self._query_cache_key(complex_food_name)
+        cached = self.cache.get(key)
+        if cached is not None:
+            logger.info(f"  ♻️ Cached query for '{complex_food_name}': '{cached}'")
+            return cached
+
+        logger.info(f"  🧠 Generating simplified query for: '{complex_food_name}'")
+        prompt = _QUERY_TEMPLATE.format_map({"complex_food_name": complex_food_name})
+        try:
+            response = await self.query_llm.ainvoke(prompt, extra_body={"prompt_cache_key": QUERY_PROMPT_CACHE_KEY})
+            result = json.loads(response.content)
+            simple_name = result.get("simple_name", complex_food_name)
+            logger.info(f"  ✅ Simplified query: '{simple_name}'")
+            self.cache.set(key, simple_name)
+            return simple_name
+        except Exception as e:
+            logger.warning(f"  ⚠️ Query generation failed for '{complex_food_name}', using original name. Error: {e}")
+            return complex_food_name
+
+    async def _search_content(self, simple_query):
+        """Tavily search for a simplified dish name, concatenated into one context string"""
+        logger.info(f"  🌐 Web searching for: '{simple_query}'")
+        query = f"nutritional information for '{simple_query}' calories protein fat carbohydrates per 100g or per serving size"
+        
+        search_results = await self._cached_search(
+            query=query, search_depth="basic", max_results=5, include_answer=True
+        )
+        
+        content = search_results.get('answer', '')
+        for result in search_results.get('results', []):
+            content += f"\n---\nSource: {result.get('url')}\nContent: {result.get('content', '')}"
+        
+        if not content.strip():
+            logger.error(f"  ❌ No web results found for '{simple_query}'")
+            return ""
+        return _compress_search_content(content)
+
+    def _accept_nutrition(self, simple_query, result, nutrition_key):
+        """Cache and return an extraction result, or None if nothing reliable was found"""
+        if not isinstance(result, dict):
+            logger.error(f"  ❌ Extraction for '{simple_query}' is not a JSON object")
+            return None
+        if result.get("found") and any(result.get(key) is None for key in REQUIRED_NUTRITION_KEYS):
+            logger.error(f"  ❌ Extraction for '{simple_query}' is missing {', '.join(REQUIRED_NUTRITION_KEYS)}")
+            return None
+        if result.get("found"):
+            logger.info(f"  ✅ Found on web: {result['calories_kcal']} kcal per {result['serving_size_grams']}g")
+            # Only successful extractions are cached; misses are retried on the next run
+            self.cache.set(nutrition_key, result)
+            return result
+        logger.error(f"  ❌ Could not find reliable nutritional data for '{simple_query}'")
+        return None
+
+    async def search_nutrition_on_web(self, food_name: str):
+        """
+        Web searches for nutritional info using a generated query and uses an LLM to extract it.
+        """
+        # Step 1: Generate a better search query
+        simple_query = await self._generate_search_query(food_name)
+
+        # Segments of the same dish share one in-flight lookup instead of racing past the disk cache
+        normalized = _normalize_query(simple_query)
+        if normalized not in self._nutrition_lookups:
+            self._nutrition_lookups[normalized] = asyncio.ensure_future(self._lookup_nutrition(simple_query))
+        return await self._nutrition_lookups[normalized]
+
+    async def _lookup_nutrition(self, simple_query):
+        """Disk cache → Tavily → LLM extraction for one simplified dish name"""
+        # Extracted nutrition is cached per normalized dish name: a hit skips Tavily and the LLM
+        nutrition_key = self._nutrition_cache_key(simple_query)
+        cached = self.cache.get(nutrition_key)
+        if cached is not None:
+            logger.info(f"  ♻️ Cached nutrition for '{simple_query}': {cached['calories_kcal']} kcal per {cached['serving_size_grams']}g")
+            return cached
+
+        try:
+            content = await self._search_content(simple_query)
+            if not content:
                 return None
+            
+            prompt = _EXTRACTION_TEMPLATE.format_map({"simple_query": simple_query, "content": content})
+            json_str = await self._astream_json_object(prompt, extra_body={"prompt_cache_key": EXTRACTION_PROMPT_CACHE_KEY})
+            return self._accept_nutrition(simple_query, json.loads(json_str), nutrition_key)
 
         except Exception as e:
-            print(f"  ❌ Web search or extraction error for '{simple_query}': {e}")
+            logger.error(f"  ❌ Web search or extraction error for '{simple_query}': {e}")
             return None
 
-    def process_agent2_output(self, agent2_output_path: str):
+    async def _process_one(self, food_item):
+        """Look up and scale nutrition for one segment from Agent 2"""
+        food_name = food_item.get('food_name', 'Unknown')
+        total_mass = food_item.get('total_mass_grams', 0)
+        segment_id = food_item.get('segment_id')
+
+        logger.info(f"\n{'='*70}")
+        logger.info(f"Processing Segment {segment_id}: {food_name} ({total_mass}g)")
+        logger.info(f"{'='*70}")
+
+        nutrition_per_serving = await self.search_nutrition_on_web(food_name)
+        return self._scale_segment(food_item, nutrition_per_serving)
+
+    def _scale_segment(self, food_item, nutrition_per_serving):
+        """Scale per-serving nutrition to the segment's total mass"""
+        food_name = food_item.get('food_name', 'Unknown')
+        total_mass = food_item.get('total_mass_grams', 0)
+        segment_id = food_item.get('segment_id')
+
+        # Normalize once: a missing/null/non-numeric serving size means the extraction is unusable
+        try:
+            serving_size = float((nutrition_per_serving or {}).get("serving_size_grams") or 0)
+        except (TypeError, ValueError):
+            serving_size = 0.0
+
+        if serving_size > 0:
+            scaling_factor = total_mass / serving_size
+            # Nutrients the source didn't report (None) count as 0
+            final_nutrition = {
+                key: round((nutrition_per_serving.get(key) or 0) * scaling_factor, 2)
+                for key in NUTRIENT_KEYS
+            }
+            
+            logger.info(f"  ⚖️ Scaled Nutrition ({food_name}): {final_nutrition}")
+        else:
+            final_nutrition = dict.fromkeys(NUTRIENT_KEYS, 0)
+            logger.warning(f"  ⚠️ Could not calculate nutrition for segment {segment_id}.")
+
+        return {
+            "segment_id": segment_id,
+            "food_name": food_name,
+            "total_mass_grams": total_mass,
+            "calculated_nutrition": final_nutrition,
+            "source_data": nutrition_per_serving
+        }
+
+    async def process_agent2_output(self, agent2_output_path: str):
         """
-        Loads the output from Agent 2 and processes each food item.
+        Loads the output from Agent 2 and processes all food items concurrently.
         """
-        print(f"📁 Reading Agent 2 output: {agent2_output_path}\n")
+        logger.info(f"📁 Reading Agent 2 output: {agent2_output_path}\n")
         with open(agent2_output_path, 'r') as f:
             data = json.load(f)
 
         food_masses = data.get('food_masses', [])
-        processed_segments = []
+        semaphore = asyncio.Semaphore(self.max_concurrency)
 
-        for food_item in food_masses:
-            food_name = food_item.get('food_name', 'Unknown')
-            total_mass = food_item.get('total_mass_grams', 0)
-            segment_id = food_item.get('segment_id')
+        async def guarded(food_item):
+            async with semaphore:
+                return await self._process_one(food_item)
 
-            print(f"\n{'='*70}")
-            print(f"Processing Segment {segment_id}: {food_name} ({total_mass}g)")
-            print(f"{'='*70}")
+        results = await asyncio.gather(*[guarded(item) for item in food_masses], return_exceptions=True)
 
-            nutrition_per_serving = self.search_nutrition_on_web(food_name)
-            
-            final_nutrition = {"calories_kcal": 0, "protein_g": 0, "fat_g": 0, "carbohydrates_g": 0}
-
-            if nutrition_per_serving and nutrition_per_serving.get("serving_size_grams") > 0:
-                serving_size = nutrition_per_serving["serving_size_grams"]
-                scaling_factor = total_mass / serving_size
-                
-                for key in final_nutrition:
-                    # Handle cases where a nutrient might not be found (e.g., 'protein_g')
-                    base_value = nutrition_per_serving.get(key, 0)
-                    if base_value is not None:
-                        final_nutrition[key] = round(base_value * scaling_factor, 2)
-                
-                print(f"  ⚖️ Scaled Nutrition: {final_nutrition}")
-            else:
-                print(f"  ⚠️ Could not calculate nutrition for this segment.")
-
-            processed_segments.append({
-                "segment_id": segment_id,
-                "food_name": food_name,
-                "total_mass_grams": total_mass,
-                "calculated_nutrition": final_nutrition,
-                "source_data": nutrition_per_serving
-            })
+        processed_segments = []
+        for food_item, result in zip(food_masses, results):
+            if isinstance(result, Exception):
+                # Keep the segment in the output with zeroed nutrition, as for a failed lookup
+                logger.error(f"  ❌ Segment {food_item.get('segment_id')} failed: {result}")
+                result = {
+                    "segment_id": food_item.get('segment_id'),
+                    "food_name": food_item.get('food_name', 'Unknown'),
+                    "total_mass_grams": food_item.get('total_mass_grams', 0),
+                    "calculated_nutrition": dict.fromkeys(NUTRIENT_KEYS, 0),
+                    "source_data": None
+                }
+            processed_segments.append(result)
 
         return processed_segments
 
+    async def _run_openai_batch(self, requests):
+        """
+        Submits chat prompts through the OpenAI Batch API and polls until the batch finishes.
+        requests: {custom_id: (model, prompt)}
+        Returns: {custom_id: response_text} for requests that succeeded
+        """
+        if not requests:
+            return {}
+
+        lines = [
+            orjson.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {
+                    "model": model,
+                    "temperature": 0.0,
+                    "response_format": {"type": "json_object"},
+                    "messages": [{"role": "user", "content": prompt}]
+                }
+            })
+            for custom_id, (model, prompt) in requests.items()
+        ]
+        batch_file = await self.openai.files.create(file=("batch.jsonl", b"\n".join(lines)), purpose="batch")
+        batch = await self.openai.batches.create(
+            input_file_id=batch_file.id, endpoint=BATCH_ENDPOINT, completion_window="24h"
+        )
+        logger.info(f"  📦 Submitted batch {batch.id} ({len(requests)} requests)")
+
+        while batch.status not in BATCH_FINAL_STATUSES:
+            await asyncio.sleep(BATCH_POLL_SECONDS)
+            batch = await self.openai.batches.retrieve(batch.id)
+            logger.info(f"  ⏳ Batch {batch.id}: {batch.status}")
+
+        if batch.status != "completed" or not batch.output_file_id:
+            logger.error(f"  ❌ Batch {batch.id} ended with status '{batch.status}'")
+            return {}
+
+        output = await self.openai.files.content(batch.output_file_id)
+        responses = {}
+        for line in output.text.splitlines():
+            record = orjson.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") == 200:
+                responses[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+        return responses
+
+    async def process_agent2_output_batch(self, agent2_output_path: str):
+        """
+        Offline mode: same output as process_agent2_output, but every LLM prompt goes through
+        the OpenAI Batch API (stage 1: query simplification, stage 2: nutrition extraction).
+        """
+        logger.info(f"📁 Reading Agent 2 output: {agent2_output_path}\n")
+        with open(agent2_output_path, 'r') as f:
+            data = json.load(f)
+
+        food_masses = data.get('food_masses', [])
+        names = [item.get('food_name', 'Unknown') for item in food_masses]
+
+        # Stage 1: search queries - local pass and disk cache first, the rest in one batch
+        queries = {}
+        query_ids = {}
+        requests = {}
+        for idx, name in enumerate(names):
+            simple_name = _simplify_local(name) or self.cache.get(self._query_cache_key(name))
+            if simple_name:
+                queries[idx] = simple_name
+                continue
+            custom_id = f"seg_{idx}_query"
+            query_ids[custom_id] = idx
+            requests[custom_id] = (self.query_llm.model_name, _QUERY_TEMPLATE.format_map({"complex_food_name": name}))
+
+        for custom_id, text in (await self._run_openai_batch(requests)).items():
+            idx = query_ids[custom_id]
+            try:
+                simple_name = json.loads(text).get("simple_name")
+            except ValueError:
+                simple_name = None
+            if simple_name:
+                self.cache.set(self._query_cache_key(names[idx]), simple_name)
+                queries[idx] = simple_name
+
+        for idx, name in enumerate(names):
+            queries.setdefault(idx, name)
+
+        # Stage 2: nutrition extraction - cached dishes skip search and batch
+        nutrition = {}
+        unresolved = []
+        for idx, simple_query in queries.items():
+            cached = self.cache.get(self._nutrition_cache_key(simple_query))
+            if cached is not None:
+                nutrition[idx] = cached
+            else:
+                unresolved.append(idx)
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def search(idx):
+            async with semaphore:
+                try:
+                    return idx, await self._search_content(queries[idx])
+                except Exception as e:
+                    logger.error(f"  ❌ Web search error for '{queries[idx]}': {e}")
+                    return idx, ""
+
+        extract_ids = {}
+        requests = {}
+        for idx, content in await asyncio.gather(*[search(idx) for idx in unresolved]):
+            if content:
+                custom_id = f"seg_{idx}_extract"
+                extract_ids[custom_id] = idx
+                prompt = _EXTRACTION_TEMPLATE.format_map({"simple_query": queries[idx], "content": content})
+                requests[custom_id] = (self.llm.model_name, prompt)
+
+        for custom_id, text in (await self._run_openai_batch(requests)).items():
+            idx = extract_ids[custom_id]
+            try:
+                result = json.loads(text)
+                nutrition[idx] = self._accept_nutrition(queries[idx], result, self._nutrition_cache_key(queries[idx]))
+            except Exception as e:
+                # One malformed reply costs its own segment, not the whole batch run
+                logger.error(f"  ❌ Could not parse extraction for '{queries[idx]}': {e}")
+
+        return [self._scale_segment(item, nutrition.get(idx)) for idx, item in enumerate(food_masses)]
+
+    def run(self, agent2_output_path: str, batch=False):
+        """Synchronous entry point for the CLI (batch=True uses the OpenAI Batch API)"""
+        if batch:
+            return asyncio.run(self.process_agent2_output_batch(agent2_output_path))
+        return asyncio.run(self.process_agent2_output(agent2_output_path))
+
     def calculate_totals(self, processed_segments):
         """Calculates the sum of nutritional information from all segments."""
-        total_nutrition = {"total_calories_kcal": 0, "total_protein_g": 0, "total_fat_g": 0, "total_carbohydrates_g": 0}
-        for segment in processed_segments:
-            for key, value in segment['calculated_nutrition'].items():
-                total_key = f"total_{key}"
-                if total_key in total_nutrition and value is not None:
-                    total_nutrition[total_key] += value
+        # One row per segment, one column per nutrient (missing values count as 0)
+        matrix = np.array(
+            [[segment['calculated_nutrition'].get(key) or 0 for key in NUTRIENT_KEYS] for segment in processed_segments],
+            dtype=np.float64
+        ).reshape(-1, len(NUTRIENT_KEYS))
+        sums = matrix.sum(axis=0).round(2).tolist()
         
-        for key in total_nutrition:
-            total_nutrition[key] = round(total_nutrition[key], 2)
-            
-        return total_nutrition
+        return {f"total_{key}": value for key, value in zip(NUTRIENT_KEYS, sums)}
 
     def save_output(self, segments, totals, output_path, session_folder=None):
         """Saves the final results to a JSON file."""
@@ -206,9 +568,9 @@ If no reliable data can be found, return {{"found": false}}.
         }
         
         # ALWAYS save to root (backward compatibility)
-        with open(output_path, 'w') as f:
-            json.dump(output, f, indent=2)
-        print(f"\n💾 Saved final nutritional analysis to: {output_path}")
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps(output, option=orjson.OPT_INDENT_2))
+        logger.info(f"\n💾 Saved final nutritional analysis to: {output_path}")
         
         # ALSO save to session folder if provided
         if session_folder:
@@ -216,23 +578,18 @@ If no reliable data can be found, return {{"found": false}}.
             session_path = f"{session_folder}/calorie_outputs/calc_{timestamp}.json"
             os.makedirs(f"{session_folder}/calorie_outputs", exist_ok=True)
             
-            with open(session_path, 'w') as f:
-                json.dump(output, f, indent=2)
-            print(f"💾 ALSO saved to session: {session_path}")
-
-def main():
-    import sys
-    if len(sys.argv) < 2:
-        print("Usage: python agent3_nutritioncalculator.py <agent2_output.json> [session_folder]")
-        sys.exit(1)
-
-    agent2_output_file = sys.argv[1]
-    session_folder = sys.argv[2] if len(sys.argv) > 2 else None
-
-    output_file = "agent3_output.json"
+            # Session copies are only read by other agents - skip the indentation
+            with open(session_path, 'wb') as f:
+                f.write(orjson.dumps(output))
+            logger.info(f"💾 ALSO saved to session: {session_path}")
 
+async def arun(agent2_output_file, session_folder=None, batch=False, output_file="agent3_output.json"):
+    """In-process entry point: profiles agent2_output_file and writes output_file"""
     agent = NutritionProfiler()
-    processed_results = agent.process_agent2_output(agent2_output_file)
+    if batch:
+        processed_results = await agent.process_agent2_output_batch(agent2_output_file)
+    else:
+        processed_results = await agent.process_agent2_output(agent2_output_file)
     total_summary = agent.calculate_totals(processed_results)
     agent.save_output(processed_results, total_summary, output_file, session_folder=session_folder)
 
@@ -241,6 +598,23 @@ def main():
     print(f"Total Summary: {total_summary}")
     print(f"{'='*70}")
 
+    return processed_results, total_summary
+
+
+def main():
+    logging.basicConfig(level=os.getenv("CALAI_LOG", "INFO"), format="%(message)s", stream=sys.stdout)
+    # --batch: offline runs (evaluation, re-scoring) through the cheaper OpenAI Batch API
+    batch = "--batch" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "--batch"]
+    if len(args) < 1:
+        print("Usage: python agent3_nutritioncalculator.py <agent2_output.json> [session_folder] [--batch]")
+        sys.exit(1)
+
+    agent2_output_file = args[0]
+    session_folder = args[1] if len(args) > 1 else None
+
+    asyncio.run(arun(agent2_output_file, session_folder, batch=batch))
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
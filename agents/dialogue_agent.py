@@ -1,12 +1,178 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+import re
 import json
+import asyncio
+import aiohttp
+from config import http_client
+
+# Long-poll endpoint of input_server.py (server gives up after 300s)
+INPUT_SERVER_URL = 'http://localhost:5001/get-input'
+INPUT_TIMEOUT_SECONDS = 310
+# "1. answer" / "2) answer" - one numbered answer per line
+NUMBERED_ANSWER = re.compile(r'^\s*(\d+)[.)]\s*(.+)$', re.M)
+
+
+def _parse_numbered_answers(questions, bulk_answer):
+    """Map a cleanly numbered (or single-question) answer to segment ids without an LLM
+    Returns: {segment_id: answer}, or None if the answer needs LLM parsing"""
+    lines = [line for line in bulk_answer.splitlines() if line.strip()]
+    if len(questions) == 1 and not NUMBERED_ANSWER.match(bulk_answer):
+        return {questions[0]['segment_id']: bulk_answer.strip()}
+    
+    matches = NUMBERED_ANSWER.findall(bulk_answer)
+    if not matches or len(matches) != len(lines):
+        return None
+    
+    answers = {}
+    for number, answer in matches:
+        position = int(number) - 1
+        if not 0 <= position < len(questions) or questions[position]['segment_id'] in answers:
+            return None
+        answers[questions[position]['segment_id']] = answer.strip()
+    return answers
+
+
+# Static prompt skeletons, filled per call with str.format_map
+_SELECT_QUESTIONS_TEMPLATE = """Select the {max_questions} most important questions from this list.
+
+QUESTIONS:
+{questions_json}
+
+RULES:
+1. Select max {max_questions} questions
+2. Prioritize questions with lowest confidence scores
+3. Avoid duplicate/similar questions
+4. Focus on questions that affect calories significantly
+
+OUTPUT JSON:
+{{
+  "selected_segment_ids": [1, 3, 5],
+  "reasoning": "why these were chosen"
+}}"""
+
+_PARSE_ANSWERS_TEMPLATE = """Parse user's bulk answer and extract answers for each specific question.
+
+QUESTIONS ASKED:
+{questions_json}
+
+USER'S BULK ANSWER:
+{bulk_answer}
+
+TASK:
+Extract what the user said for each segment. If user didn't answer a question, set to null.
+
+RULES:
+- Match user's response to the correct segment
+- Extract relevant portion of answer for each segment
+- If user numbered their answers (1., 2., 3.), map accordingly
+- If user mentioned segment/food explicitly, match that
+- Keep answers concise but complete
+
+OUTPUT JSON:
+{{
+  "answers": {{
+    "1": "answer for segment 1 or null",
+    "2": "answer for segment 2 or null",
+    "3": "answer for segment 3 or null"
+  }}
+}}"""
+
+_SYNTHESIZE_ALL_TEMPLATE = """Parse the user's bulk answer, then create a detailed food name for each segment.
+
+SEGMENTS (each with the question that was asked):
+{segments_json}
+
+USER'S BULK ANSWER:
+{bulk_answer}
+
+TASK:
+1. Extract what the user said for each segment. If user didn't answer a question, set user_answer to null.
+   - If user numbered their answers (1., 2., 3.), map them in the order the questions are listed
+   - If user mentioned segment/food explicitly, match that
+   - Keep answers concise but complete
+2. For each answered segment, create a detailed, specific food name incorporating the clarification.
+   - If user clarified food identity → update food name
+   - If user mentioned specifics → include them
+   - Be descriptive but concise
+
+EXAMPLES:
+User: "paneer not tofu" → "Paneer Curry"
+User: "plain rice no oil" → "Plain Steamed Rice (No Oil)"
+User: "it's grilled" → "Grilled [Food]"
+
+OUTPUT JSON (one entry per segment, keyed by segment_id):
+{{
+  "segments": {{
+    "1": {{"user_answer": "answer or null", "food_name": "detailed name", "clarifications": {{"key": "value"}}}}
+  }}
+}}"""
+
+_SYNTHESIZER_TEMPLATE = """Create detailed food name from user input.
+
+VLM IDENTIFIED: {vlm_name}
+VOLUME: {volume:.3f} litres
+
+UNCERTAINTIES:
+{uncertainties}
+
+QUESTION ASKED:
+{question}
+
+USER ANSWERED:
+{user_answer}
+
+TASK:
+Create a detailed, specific food name incorporating user's clarification.
+
+RULES:
+- If user clarified food identity → update food name
+- If user mentioned specifics → include them
+- Be descriptive but concise
+
+EXAMPLES:
+User: "paneer not tofu" → "Paneer Curry"
+User: "plain rice no oil" → "Plain Steamed Rice (No Oil)"
+User: "it's grilled" → "Grilled [Food]"
+
+OUTPUT JSON:
+{{
+  "food_name": "detailed name",
+  "clarifications": {{"key": "value"}}
+}}"""
+
+_REFINE_TEMPLATE = """Update food names based on additional user suggestions.
+
+CURRENT:
+{results_json}
+
+USER SUGGESTIONS:
+{suggestions}
+
+Update relevant items based on suggestions. Keep others unchanged.
+
+OUTPUT JSON:
+{{
+  "updates": [
+    {{"segment_id": 1, "new_name": "updated name", "changed": true}},
+    {{"segment_id": 2, "changed": false}}
+  ]
+}}"""
+
 
 class DialogueAgent:
-    def __init__(self, api_key, input_callback=None):
-        self.client = OpenAI(api_key=api_key)
+    def __init__(self, api_key, input_callback=None, client=None):
+        # Sync calls share the process-wide connection pool (callers that already hold a client, like
+        # script2, pass it in). There is no long-lived async client: the per-segment synthesizer calls
+        # run on their own short-lived event loop (asyncio.run in a worker thread), see _synthesize_segments
+        self.api_key = api_key
+        self.client = client or OpenAI(api_key=api_key, http_client=http_client)
         self.input_callback = input_callback 
 
     def confirm_analysis(self, vlm_output: dict) -> dict:
+        """Synchronous entry point, see aconfirm_analysis"""
+        return asyncio.run(self.aconfirm_analysis(vlm_output))
+
+    async def aconfirm_analysis(self, vlm_output: dict) -> dict:
         """Collect all VLM questions → Filter to top 3 → Ask user once → Process all answers"""
         
         print("\n" + "="*70)
@@ -66,7 +232,7 @@ class DialogueAgent:
             print()
         
         # STEP 4: Ask all selected questions at once
-        user_answers = {}
+        synthesis = None
         
         if selected_questions:
             print("="*70)
@@ -80,42 +246,48 @@ class DialogueAgent:
                 print()
             
             print("Your answers (type freely, press Enter twice when done):")
-            bulk_answer = self._get_user_input()
+            bulk_answer = await self._get_user_input()
             
             if bulk_answer:
-                # Parse answers using LLM
-                user_answers = self._parse_bulk_answers(selected_questions, bulk_answer)
-                
-                print("\n" + "="*70)
-                print("PARSED ANSWERS:")
-                print("="*70)
-                for seg_id, answer in user_answers.items():
-                    print(f"Segment {seg_id}: {answer}")
-                print()
+                # Parse answers and synthesize final names in one LLM call,
+                # running while the user types their additional suggestions
+                synthesis = asyncio.create_task(asyncio.to_thread(
+                    self._synthesize_all, selected_questions, segment_data_list, bulk_answer
+                ))
             else:
                 print("\nNo answers provided - using defaults\n")
         else:
             print("All segments have high confidence - no questions needed\n")
         
-        # STEP 5: Synthesize final food names for each segment
+        # STEP 5: Ask for additional suggestions
+        print("\n" + "="*70)
+        print("ADDITIONAL SUGGESTIONS")
+        print("="*70 + "\n")
+        print("Any additional details you'd like to add about any food item?")
+        print("(cooking method, ingredients, preparation, etc.)")
+        print("(Press Enter twice to finish):\n")
+        
+        additional_suggestions = await self._get_user_input()
+        
+        # STEP 6: Collect synthesized food names for each segment
+        user_answers, synthesized = await synthesis if synthesis else ({}, {})
+        
+        if synthesis:
+            print("\n" + "="*70)
+            print("PARSED ANSWERS:")
+            print("="*70)
+            for seg_id, answer in user_answers.items():
+                print(f"Segment {seg_id}: {answer}")
+            print()
+        
         final_results = []
         
         for seg_data in segment_data_list:
             seg_id = seg_data['segment_id']
-            user_answer = user_answers.get(seg_id, None)
-            
-            # Check if a question was actually ASKED for this segment
-            question_was_asked = any(q['segment_id'] == seg_id for q in selected_questions)
             
-            if user_answer and question_was_asked:
-                # Synthesize with user input
-                final_spec = self._call_synthesizer(
-                    seg_data['food_name'],
-                    seg_data['major_uncertainties'],
-                    [seg_data['most_important_question']],
-                    user_answer,
-                    seg_data['volume']
-                )
+            # Only segments whose question was asked AND answered were synthesized
+            if seg_id in synthesized:
+                final_spec = synthesized[seg_id]
             else:
                 # No question asked OR no answer - use original VLM name
                 final_spec = {
@@ -135,16 +307,7 @@ class DialogueAgent:
                 "questions_asked": final_spec.get('questions_asked', [])
             })
         
-        # STEP 6: Ask for additional suggestions
-        print("\n" + "="*70)
-        print("ADDITIONAL SUGGESTIONS")
-        print("="*70 + "\n")
-        print("Any additional details you'd like to add about any food item?")
-        print("(cooking method, ingredients, preparation, etc.)")
-        print("(Press Enter twice to finish):\n")
-        
-        additional_suggestions = self._get_user_input()
-        
+        # STEP 7: Apply additional suggestions
         if additional_suggestions:
             print(f"\nAdditional input: {additional_suggestions}\n")
             final_results = self._refine_with_suggestions(final_results, additional_suggestions)
@@ -168,27 +331,15 @@ class DialogueAgent:
             return all_questions
         
         # Ask LLM to rank and select
-        prompt = f"""Select the {max_questions} most important questions from this list.
-
-QUESTIONS:
-{json.dumps([{
-    'segment_id': q['segment_id'],
-    'food': q['food_name'],
-    'question': q['question'],
-    'confidence': q['confidence']
-} for q in all_questions], indent=2)}
-
-RULES:
-1. Select max {max_questions} questions
-2. Prioritize questions with lowest confidence scores
-3. Avoid duplicate/similar questions
-4. Focus on questions that affect calories significantly
-
-OUTPUT JSON:
-{{
-  "selected_segment_ids": [1, 3, 5],
-  "reasoning": "why these were chosen"
-}}"""
+        prompt = _SELECT_QUESTIONS_TEMPLATE.format_map({
+            "max_questions": max_questions,
+            "questions_json": json.dumps([{
+                'segment_id': q['segment_id'],
+                'food': q['food_name'],
+                'question': q['question'],
+                'confidence': q['confidence']
+            } for q in all_questions], indent=2)
+        })
 
         try:
             response = self.client.chat.completions.create(
@@ -216,36 +367,18 @@ OUTPUT JSON:
     def _parse_bulk_answers(self, questions, bulk_answer):
         """Parse user's bulk answer and map to specific segments"""
         
-        prompt = f"""Parse user's bulk answer and extract answers for each specific question.
-
-QUESTIONS ASKED:
-{json.dumps([{
-    'segment_id': q['segment_id'],
-    'food': q['food_name'],
-    'question': q['question']
-} for q in questions], indent=2)}
-
-USER'S BULK ANSWER:
-{bulk_answer}
-
-TASK:
-Extract what the user said for each segment. If user didn't answer a question, set to null.
-
-RULES:
-- Match user's response to the correct segment
-- Extract relevant portion of answer for each segment
-- If user numbered their answers (1., 2., 3.), map accordingly
-- If user mentioned segment/food explicitly, match that
-- Keep answers concise but complete
-
-OUTPUT JSON:
-{{
-  "answers": {{
-    "1": "answer for segment 1 or null",
-    "2": "answer for segment 2 or null",
-    "3": "answer for segment 3 or null"
-  }}
-}}"""
+        answers = _parse_numbered_answers(questions, bulk_answer)
+        if answers is not None:
+            return answers
+        
+        prompt = _PARSE_ANSWERS_TEMPLATE.format_map({
+            "questions_json": json.dumps([{
+                'segment_id': q['segment_id'],
+                'food': q['food_name'],
+                'question': q['question']
+            } for q in questions], indent=2),
+            "bulk_answer": bulk_answer
+        })
 
         try:
             response = self.client.chat.completions.create(
@@ -268,83 +401,142 @@ OUTPUT JSON:
             print(f"Answer parsing failed: {e}")
             return {}
 
-    def _get_user_input(self):
-        """Get user input via API or terminal"""
+    def _synthesize_all(self, questions, segment_data_list, bulk_answer):
+        """Parse the bulk answer and synthesize final food names for all asked segments in one call
+        Returns: (user_answers, final_specs), both keyed by segment_id"""
+        
+        segments_by_id = {seg['segment_id']: seg for seg in segment_data_list}
+        asked = [segments_by_id[q['segment_id']] for q in questions if q['segment_id'] in segments_by_id]
+        
+        prompt = _SYNTHESIZE_ALL_TEMPLATE.format_map({
+            "segments_json": json.dumps([{
+                'segment_id': seg['segment_id'],
+                'vlm_name': seg['food_name'],
+                'volume_litres': round(seg['volume'], 3),
+                'uncertainties': seg['major_uncertainties'],
+                'question': seg['most_important_question']
+            } for seg in asked], indent=2),
+            "bulk_answer": bulk_answer
+        })
+
+        try:
+            response = self.client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": "You are a food identification assistant. Always respond with valid JSON."},
+                    {"role": "user", "content": prompt}
+                ],
+                response_format={"type": "json_object"},
+                temperature=0.3
+            )
+            
+            entries = json.loads(response.choices[0].message.content)['segments']
+            
+            user_answers = {}
+            final_specs = {}
+            for seg in asked:
+                seg_id = seg['segment_id']
+                entry = entries.get(str(seg_id))
+                if not isinstance(entry, dict) or not entry.get('user_answer'):
+                    continue
+                
+                user_answers[seg_id] = entry['user_answer']
+                final_specs[seg_id] = {
+                    "food_name": entry.get('food_name') or seg['food_name'],
+                    "volume_litres": seg['volume'],
+                    "clarifications": entry.get('clarifications') or {},
+                    "user_response": entry['user_answer'],
+                    "questions_asked": [seg['most_important_question']]
+                }
+            
+            return user_answers, final_specs
+            
+        except Exception as e:
+            print(f"Combined synthesis failed: {e} - falling back to per-segment calls")
+        
+        user_answers = self._parse_bulk_answers(questions, bulk_answer)
+        answered = [seg for seg in asked if seg['segment_id'] in user_answers]
+        final_specs = asyncio.run(self._synthesize_segments(answered, user_answers))
+        
+        return user_answers, final_specs
+
+    async def _synthesize_segments(self, segments, user_answers, max_concurrency=10):
+        """Run the per-segment synthesizer calls concurrently
+        Returns: {segment_id: final_spec}"""
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def synthesize(seg):
+            async with semaphore:
+                return seg['segment_id'], await self._call_synthesizer(
+                    async_client,
+                    seg['food_name'],
+                    seg['major_uncertainties'],
+                    [seg['most_important_question']],
+                    user_answers[seg['segment_id']],
+                    seg['volume']
+                )
+        
+        # An httpx pool is bound to the loop it runs on, so the client lives exactly as long as this one
+        async with AsyncOpenAI(api_key=self.api_key) as async_client:
+            return dict(await asyncio.gather(*[synthesize(seg) for seg in segments]))
+
+    async def _get_user_input(self):
+        """Get user input via API or terminal, without blocking the event loop"""
         if self.input_callback:
             # Use callback
             print("\n[WAITING_FOR_INPUT]")
-            user_input = self.input_callback()
+            user_input = await asyncio.to_thread(self.input_callback)
             print(f"[INPUT_RECEIVED]: {user_input[:100]}...")
             return user_input
-        else:
-            # Try API first, fallback to terminal
+        
+        # Try API first, fallback to terminal
+        try:
+            print("\n[WAITING_FOR_INPUT]")
+            timeout = aiohttp.ClientTimeout(total=INPUT_TIMEOUT_SECONDS)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.get(INPUT_SERVER_URL) as response:
+                    if response.status == 200:
+                        user_input = (await response.json()).get('input', '')
+                        print(f"[INPUT_RECEIVED]: {user_input[:100]}...")
+                        return user_input
+        except Exception:
+            pass
+        
+        # Fallback to terminal input
+        print("(Type your answer and press Enter twice):")
+        return await asyncio.to_thread(self._read_terminal_input)
+
+    def _read_terminal_input(self):
+        """Read lines until two consecutive empty lines"""
+        lines = []
+        empty_count = 0
+        while True:
             try:
-                import requests
-                print("\n[WAITING_FOR_INPUT]")
-                response = requests.get('http://localhost:5001/get-input', timeout=310)
-                if response.status_code == 200:
-                    user_input = response.json().get('input', '')
-                    print(f"[INPUT_RECEIVED]: {user_input[:100]}...")
-                    return user_input
+                line = input()
+                if line == "":
+                    empty_count += 1
+                    if empty_count >= 2:
+                        break
+                else:
+                    empty_count = 0
+                    lines.append(line)
             except:
-                pass
-            
-            # Fallback to terminal input
-            print("(Type your answer and press Enter twice):")
-            lines = []
-            empty_count = 0
-            while True:
-                try:
-                    line = input()
-                    if line == "":
-                        empty_count += 1
-                        if empty_count >= 2:
-                            break
-                    else:
-                        empty_count = 0
-                        lines.append(line)
-                except:
-                    break
-            return "\n".join(lines).strip()
-
-    def _call_synthesizer(self, vlm_name, uncertainties, questions, user_answer, volume):
+                break
+        return "\n".join(lines).strip()
+
+    async def _call_synthesizer(self, async_client, vlm_name, uncertainties, questions, user_answer, volume):
         """Synthesize final food name with user clarifications"""
         
-        prompt = f"""Create detailed food name from user input.
-
-VLM IDENTIFIED: {vlm_name}
-VOLUME: {volume:.3f} litres
-
-UNCERTAINTIES:
-{chr(10).join(uncertainties) if uncertainties else "None"}
-
-QUESTION ASKED:
-{questions[0] if questions else "None"}
-
-USER ANSWERED:
-{user_answer}
-
-TASK:
-Create a detailed, specific food name incorporating user's clarification.
-
-RULES:
-- If user clarified food identity → update food name
-- If user mentioned specifics → include them
-- Be descriptive but concise
-
-EXAMPLES:
-User: "paneer not tofu" → "Paneer Curry"
-User: "plain rice no oil" → "Plain Steamed Rice (No Oil)"
-User: "it's grilled" → "Grilled [Food]"
-
-OUTPUT JSON:
-{{
-  "food_name": "detailed name",
-  "clarifications": {{"key": "value"}}
-}}"""
+        prompt = _SYNTHESIZER_TEMPLATE.format_map({
+            "vlm_name": vlm_name,
+            "volume": volume,
+            "uncertainties": chr(10).join(uncertainties) if uncertainties else "None",
+            "question": questions[0] if questions else "None",
+            "user_answer": user_answer
+        })
 
         try:
-            response = self.client.chat.completions.create(
+            response = await async_client.chat.completions.create(
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": "You are a food identification assistant. Always respond with valid JSON."},
@@ -377,27 +569,14 @@ OUTPUT JSON:
     def _refine_with_suggestions(self, results, suggestions):
         """Refine results with additional suggestions"""
         
-        prompt = f"""Update food names based on additional user suggestions.
-
-CURRENT:
-{json.dumps([{
-    'id': r['segment_id'],
-    'name': r['final_food_name'],
-    'volume': r['volume_litres']
-} for r in results], indent=2)}
-
-USER SUGGESTIONS:
-{suggestions}
-
-Update relevant items based on suggestions. Keep others unchanged.
-
-OUTPUT JSON:
-{{
-  "updates": [
-    {{"segment_id": 1, "new_name": "updated name", "changed": true}},
-    {{"segment_id": 2, "changed": false}}
-  ]
-}}"""
+        prompt = _REFINE_TEMPLATE.format_map({
+            "results_json": json.dumps([{
+                'id': r['segment_id'],
+                'name': r['final_food_name'],
+                'volume': r['volume_litres']
+            } for r in results], indent=2),
+            "suggestions": suggestions
+        })
 
         try:
             response = self.client.chat.completions.create(
@@ -1,85 +1,195 @@
 """
 calai.py
 A barebones script to run the entire agent pipeline in sequence with timing.
-This script executes each step individually without a loop.
+Every stage is called in-process; the JSON files between stages are kept for the router and UI.
 
 Usage:
 1. In one terminal, run the Flask server: `python app.py`
-2. In a second terminal, run this script: `python calai.py "path/to/image.jpg"`
+2. In a second terminal, run this script: `python calai.py "path/to/image.jpg"` (add `--no-cache` to force a full rerun,
+   `--output <path>` to have the final nutrition JSON moved there instead of left in agent3_output.json)
 """
 
 import sys
-import subprocess
 import os
+import asyncio
+import hashlib
+import logging
+import shutil
+from pathlib import Path
+from typing import Awaitable, Callable, NamedTuple, Tuple
+
+from script2 import run as run_food_analysis
+from volume_verify import run as run_volume_verify
+from main_pipeline import arun as run_mass_pipeline
+from agent2_masscalculator import MassCalculator
+from agent3_nutritioncalculator import arun as run_nutrition
+
+# --- Hardcoded filenames as used by the agents (still the interface the router and UI read) ---
+confirmed_food_file = "final_confirmed_output.json"
+verified_volumes_file = "verified_volumes.json"
+agent1_output_file = "agent1_output.json"
+agent2_output_file = "agent2_output.json"
+agent3_output_file = "agent3_output.json"
+density_pdf_file = "food_density_database.pdf"
+
+# Content-addressed stage outputs: .cache/<hash>/<output_file>
+STAGE_CACHE_DIR = Path(".cache")
+
+
+class Stage(NamedTuple):
+    """One pipeline step; edges come from matching one stage's inputs to another's outputs"""
+    name: str
+    run: Callable[[], Awaitable]
+    inputs: Tuple[str, ...] = ()
+    outputs: Tuple[str, ...] = ()
+    # Agent code hashed into the cache key; empty = never cached. A cache hit only restores the output files,
+    # so stages with other effects (asking the user, writing into the session folder) must leave it empty
+    sources: Tuple[str, ...] = ()
+    version: int = 1               # bump to invalidate cached outputs by hand
+
+
+def hash_stage(name, version, input_paths):
+    """SHA256 over the stage identity and the bytes of every input file (upstream outputs included)"""
+    digest = hashlib.sha256(f"{name}|{version}|{list(input_paths)}".encode("utf-8"))
+    for path in input_paths:
+        if os.path.isfile(path):
+            digest.update(Path(path).read_bytes())
+    return digest.hexdigest()
+
+
+async def run_stage(stage, use_cache=True):
+    """Runs one stage, or replays its outputs from .cache/<hash>/ when nothing it depends on changed"""
+    if not use_cache or not stage.sources:
+        await stage.run()
+        return
+    
+    key = hash_stage(stage.name, stage.version, stage.inputs + stage.sources)
+    cache_dir = STAGE_CACHE_DIR / key
+    if all((cache_dir / output).is_file() for output in stage.outputs):
+        for output in stage.outputs:
+            shutil.copy(cache_dir / output, output)
+        print(f"♻️  {stage.name}: unchanged inputs, reused cached {', '.join(stage.outputs)}")
+        return
+    
+    await stage.run()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for output in stage.outputs:
+        shutil.copy(output, cache_dir / output)
+
+
+def topo_levels(stages):
+    """Kahn's algorithm, grouped into level-sets: every stage in a level can run concurrently"""
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    deps = {stage.name: {producers[i] for i in stage.inputs if i in producers} for stage in stages}
+    by_name = {stage.name: stage for stage in stages}
+    
+    levels = []
+    done = set()
+    while len(done) < len(stages):
+        ready = [name for name in by_name if name not in done and deps[name] <= done]
+        if not ready:
+            raise ValueError(f"Pipeline stages have a dependency cycle: {sorted(set(by_name) - done)}")
+        levels.append([by_name[name] for name in ready])
+        done.update(ready)
+    return levels
+
+
+def build_stages(image_path, session_folder=None, use_cache=True):
+    """The CalAI pipeline as a DAG. "density_calculator" is an in-memory artifact, not a file."""
+    artifacts = {}
+    
+    async def load_density_calculator():
+        # PDF parse + embeddings only need the PDF, so this overlaps with Step 1's VLM/dialogue
+        artifacts["density_calculator"] = await asyncio.to_thread(MassCalculator, density_pdf_file)
+    
+    async def food_analysis():
+        # Blocking, and the dialogue agent drives its own event loop, so it gets a worker thread
+        # use_cache also covers script2's per-segment VLM answers (.vlm_cache/)
+        await asyncio.to_thread(run_food_analysis, image_path, use_cache=use_cache)
+    
+    async def volume_verify():
+        await asyncio.to_thread(run_volume_verify, confirmed_food_file, image_path, verified_volumes_file)
+    
+    async def mass_pipeline():
+        # Food Decomposition (Agent 1) streamed into Mass Calculation (Agent 2). For debugging, the agents
+        # can still be run one at a time: agent1_decomposer.py, then agent2_masscalculator.py on agent1_output.json
+        await run_mass_pipeline(density_pdf_file, verified_volumes_file,
+                                calculator=artifacts["density_calculator"])
+    
+    async def nutrition():
+        # Same loop as Agents 1 + 2, so the shared async HTTP pool in config.py stays valid
+        print(f"DEBUG: About to run Agent 3 with session_folder = '{session_folder}'")
+        print(f"DEBUG: agent2_output_file exists: {os.path.exists(agent2_output_file)}")
+        await run_nutrition(agent2_output_file, session_folder, output_file=agent3_output_file)
+    
+    return [
+        Stage("Density Database Load (Agent 2)", load_density_calculator,
+              inputs=(density_pdf_file,), outputs=("density_calculator",)),
+        # Interactive: the user's answers are part of its output, so a replay would skip the questions
+        Stage("VLM Analysis (script2)", food_analysis,
+              inputs=(image_path,), outputs=(confirmed_food_file,)),
+        Stage("Volume Verification", volume_verify,
+              inputs=(confirmed_food_file, image_path), outputs=(verified_volumes_file,),
+              sources=("volume_verify.py", "image_cache.py")),
+        Stage("Food Decomposition → Mass Calculation (Agents 1 + 2)", mass_pipeline,
+              inputs=(verified_volumes_file, "density_calculator", density_pdf_file),
+              outputs=(agent1_output_file, agent2_output_file),
+              sources=("main_pipeline.py", "agent1_decomposer.py", "agent2_masscalculator.py")),
+        # Also writes a copy into session_folder/calorie_outputs, which a replay would skip
+        Stage("Nutritional Profiling (Agent 3)", nutrition,
+              inputs=(agent2_output_file,), outputs=(agent3_output_file,)),
+    ]
+
+
+async def run_pipeline(image_path, session_folder=None, use_cache=True):
+    """Runs the stage DAG level by level in this one process and event loop"""
+    for step, level in enumerate(topo_levels(build_stages(image_path, session_folder, use_cache)), 1):
+        names = " | ".join(stage.name for stage in level)
+        print(f"\n--- Running Step {step}: {names} ---")
+        await asyncio.gather(*(run_stage(stage, use_cache) for stage in level))
+        print(f"--- Step {step} Completed ---")
+
 
 def main():
+    # --no-cache: rerun every stage even when its inputs and code are unchanged
+    use_cache = "--no-cache" not in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "--no-cache"]
+
+    # --output <path>: final destination of the Agent 3 JSON (the router passes its session file)
+    output_path = None
+    if "--output" in args:
+        output_idx = args.index("--output")
+        output_path = args[output_idx + 1] if output_idx + 1 < len(args) else None
+        del args[output_idx:output_idx + 2]
+
     # Check for the image path argument
-    if len(sys.argv) < 2:
-        print("Usage: python calai.py \"<path_to_your_image>\"")
+    if len(args) < 1 or ("--output" in sys.argv and not output_path):
+        print("Usage: python calai.py \"<path_to_your_image>\" [session_folder] [--no-cache] [--output <path>]")
         sys.exit(1)
 
-    image_path = sys.argv[1]
-    session_folder = sys.argv[2] if len(sys.argv) > 2 else None
+    image_path = args[0]
+    session_folder = args[1] if len(args) > 1 else None
 
-    # --- Define Hardcoded Filenames as used by the agents ---
-    confirmed_food_file = "final_confirmed_output.json"
-    verified_volumes_file = "verified_volumes.json"
-    agent1_output_file = "agent1_output.json"
-    agent2_output_file = "agent2_output.json"
-    agent3_output_file = "agent3_output.json" 
-    density_pdf_file = "food_density_database.pdf"
+    logging.basicConfig(level=os.getenv("CALAI_LOG", "INFO"), format="%(message)s", stream=sys.stdout)
 
     print("🚀 Starting Barebones Pipeline Execution...")
 
     try:
-        # --- Step 1: VLM Analysis (script2.py) ---
-        print("\n--- Running Step 1: VLM Analysis (script2.py) ---")
-        cmd_step1 = ["python", "script2.py", image_path]
-        print(f"Command: {' '.join(cmd_step1)}")
-        subprocess.run(cmd_step1, check=True, text=True)
-        print("--- Step 1 Completed ---")
-
-        # --- Step 2: Volume Verification ---
-        print("\n--- Running Step 2: Volume Verification ---")
-        cmd_step2 = ["python", "volume_verify.py", confirmed_food_file, image_path]
-        print(f"Command: {' '.join(cmd_step2)}")
-        subprocess.run(cmd_step2, check=True, text=True)
-        print("--- Step 2 Completed ---")
-
-        # --- Step 3: Food Decomposition (Agent 1) ---
-        print("\n--- Running Step 3: Food Decomposition (Agent 1) ---")
-        cmd_step3 = ["python", "agent1_decomposer.py", verified_volumes_file]
-        print(f"Command: {' '.join(cmd_step3)}")
-        subprocess.run(cmd_step3, check=True, text=True)
-        print("--- Step 3 Completed ---")
-
-        # --- Step 4: Mass Calculation (Agent 2) ---
-        print("\n--- Running Step 4: Mass Calculation (Agent 2) ---")
-        cmd_step4 = ["python", "agent2_masscalculator.py", density_pdf_file, agent1_output_file]
-        print(f"Command: {' '.join(cmd_step4)}")
-        subprocess.run(cmd_step4, check=True, text=True)
-        print("--- Step 4 Completed ---")
-
-        # --- Step 5: Nutritional Profiling (Agent 3) ---
-        print("\n--- Running Final Step 5: Nutritional Profiling (Agent 3) ---")
-        print(f"DEBUG: About to run Agent 3 with session_folder = '{session_folder}'")
-        print(f"DEBUG: agent2_output_file exists: {os.path.exists(agent2_output_file)}")
-        cmd_step5 = ["python", "agent3_nutritioncalculator.py", agent2_output_file, session_folder]
-        print(f"Command: {' '.join(cmd_step5)}")
-        subprocess.run(cmd_step5, check=True, text=True)
-        print("--- Final Step 5 Completed ---")
+        asyncio.run(run_pipeline(image_path, session_folder, use_cache))
+
+        final_output = agent3_output_file
+        if output_path:
+            # A rename on the same filesystem: no re-read or re-serialize of the nutrition JSON
+            os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+            final_output = shutil.move(agent3_output_file, output_path)
 
         # --- Success Message ---
         print("\nFull Pipeline Completed Successfully! ")
-        print(f"Final output is in: {agent3_output_file}")
-        print("\n--- Running Final Confirmation Print ---")
-        subprocess.run(["python", "-c", "print(' DONE - All agents completed successfully!')"], check=True)
+        print(f"Final output is in: {final_output}")
+        print(" DONE - All agents completed successfully!")
 
-    except subprocess.CalledProcessError as e:
-        print(f"\n❌ ERROR: A command failed with exit code {e.returncode}. The pipeline has stopped.")
-        sys.exit(1)
     except FileNotFoundError as e:
-        print(f"\n❌ ERROR: A script was not found. Please check the file name and path.")
+        print(f"\n❌ ERROR: A required file was not found. The pipeline has stopped.")
         print(f"Details: {e}")
         sys.exit(1)
     except Exception as e:
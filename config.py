@@ -1,5 +1,14 @@
 import os
+import httpx
 from dotenv import load_dotenv
 
 load_dotenv()
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
\ No newline at end of file
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# Retries of 429 / 5xx / timeout / connection errors, with the SDK's exponential backoff + jitter
+# (it also honours Retry-After); the SDK default is 2
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '4'))
+
+# One connection pool shared by every LLM client in the process (amortizes TLS handshakes)
+HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+http_client = httpx.Client(http2=True, limits=HTTP_LIMITS, timeout=60.0)
+http_async_client = httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=60.0)
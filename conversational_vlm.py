@@ -5,61 +5,271 @@ Now correctly extracts calorie calculation context
 
 import os
 import sys
-import json
-import base64
+import orjson
+import heapq
+import hashlib
+import socket
+import functools
+import threading
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import diskcache
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, NOT_GIVEN
+from config import http_client
+import image_cache
+
+# Linux-only kernel change notifications for daemon mode (mtime checks everywhere else)
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
 
 load_dotenv()
 
+logger = logging.getLogger("calai.vlm")
+
+# Only the last K meals go into the prompt (keeps token count and latency bounded)
+CONTEXT_MEALS = int(os.getenv("CALAI_CTX_MEALS", 5))
+PREVIEW_CHARS = 300
+VLM_MODEL = "gpt-4o"
+# Replies cached per session by (model, query, calorie outputs, image); repeats within a day skip the API.
+# The running transcript is left out of the key: every turn is logged, so it never repeats
+RESPONSE_CACHE_DIR = ".llm_cache"
+RESPONSE_CACHE_TTL_SECONDS = 24 * 60 * 60
+# Slim copies of each calorie output (only what build_context_summary reads), next to the originals
+SUMMARY_DIR = ".summaries"
+SEGMENT_FIELDS = ("food_name", "total_mass_grams")
+SEGMENT_NUTRIENTS = ("calories_kcal", "protein_g", "carbohydrates_g", "fat_g")
+TOTAL_NUTRIENTS = ("total_calories_kcal", "total_protein_g", "total_carbohydrates_g", "total_fat_g")
+# Daemon mode: one long-lived VLM per session, reached through this Unix socket (see vlm_client.py)
+DAEMON_SOCKET = ".vlm.sock"
+# GPT-4o downsamples server-side anyway: bigger photos are shrunk to this before encoding
+MAX_IMAGE_SIDE = 1024
+IMAGE_JPEG_QUALITY = 85
+
+
+# Static system prompt first (identical every turn, so OpenAI's prompt cache can reuse the prefix),
+# then the per-session context block last
+_SYSTEM_PROMPT_STATIC = """You are an intelligent food and nutrition assistant. You can:
+- Answer general food and nutrition questions
+- Analyze food images
+- Provide meal recommendations
+- Compare foods and meals
+- Give dietary advice
+- Access conversation history and past calorie calculations
+
+INSTRUCTIONS:
+1. When user asks about "my meal", "the food I ate", "what I calculated" - refer to the calorie calculations in the context below
+2. You have access to DETAILED nutritional breakdowns - use them!
+3. If comparing foods, use the exact values from calculations
+4. Be specific with numbers when you have them
+5. If you see an image, describe it and answer accordingly
+6. Always be accurate with nutritional information
+7. If you don't have specific data, say so clearly
+
+IMPORTANT: The calorie calculations contain exact values for calories, protein, carbs, and fat. Use these precise numbers in your responses!
+
+Respond naturally and conversationally.
+
+CONTEXT AVAILABLE TO YOU:
+"""
+
+# Routes every turn's request to the same prompt-cache shard
+VLM_PROMPT_CACHE_KEY = "conversational_vlm_v1"
+
+NO_CONTEXT = "No previous context available."
+_EMPTY_CONTEXT_PROMPT = _SYSTEM_PROMPT_STATIC + NO_CONTEXT
+
+
+@functools.lru_cache(maxsize=1)
+def _get_client():
+    """One OpenAI client per process, on the shared connection pool (keep-alive across turns)"""
+    load_dotenv()
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
+
+
+def _context_fields(data):
+    """Project an Agent 3 / Agent 2 output down to the fields the context summary uses"""
+    if 'nutritional_breakdown_per_segment' in data:
+        segments = []
+        for seg in data.get('nutritional_breakdown_per_segment', []):
+            slim = {key: seg[key] for key in SEGMENT_FIELDS if key in seg}
+            nutr = seg.get('calculated_nutrition', {})
+            slim['calculated_nutrition'] = {key: nutr[key] for key in SEGMENT_NUTRIENTS if key in nutr}
+            segments.append(slim)
+        totals = data.get('total_nutrition_summary', {})
+        return {
+            "nutritional_breakdown_per_segment": segments,
+            "total_nutrition_summary": {key: totals[key] for key in TOTAL_NUTRIENTS if key in totals}
+        }
+    if 'food_masses' in data:
+        return {"food_masses": [{key: food[key] for key in SEGMENT_FIELDS if key in food}
+                                for food in data.get('food_masses', [])]}
+    return {}
+
+
+def _log_cached_tokens(usage):
+    """Report how much of the prompt OpenAI served from its prompt cache"""
+    details = getattr(usage, "prompt_tokens_details", None) if usage else None
+    if details is not None:
+        logger.info(f"🧠 Prompt cache: {details.cached_tokens or 0}/{usage.prompt_tokens} prompt tokens cached")
+
+
+def _preview(text, limit=PREVIEW_CHARS):
+    """Truncate long context entries"""
+    text = str(text)
+    return text[:limit] + "..." if len(text) > limit else text
+
+
 class ConversationalVLM:
     def __init__(self, session_folder):
         """Initialize conversational VLM with session context"""
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        self.session_folder = session_folder
-        self.conversation_file = f"{session_folder}/conversation_history.json"
-        self.calorie_outputs_folder = f"{session_folder}/calorie_outputs"
+        self.client = _get_client()
+        # Paths are built once and reused by every method
+        self.session_folder = Path(session_folder)
+        # Whole-file history from sessions started before the router moved to the .jsonl log
+        self.conversation_file = self.session_folder / "conversation_history.json"
+        # Append-only JSON-Lines log shared with router_agent.py: one write per turn, no rewrites
+        self.conversation_log = self.session_folder / "conversation_history.jsonl"
+        self.calorie_outputs_folder = self.session_folder / "calorie_outputs"
+        # context_summary per (history mtimes, calorie outputs mtime); pays off in long-running callers
+        self._ctx_cache = {}
+        # Set by watch_session(): context is only re-checked after the kernel reports a change
+        self._watching = False
+        self._ctx_dirty = True
+        self._cached_ctx = None
+        self.response_cache = diskcache.Cache(str(self.session_folder / RESPONSE_CACHE_DIR))
     
     def load_conversation_history(self):
-        """Load conversation history from session"""
-        if os.path.exists(self.conversation_file):
-            with open(self.conversation_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {"messages": []}
+        """Load conversation history from session (legacy .json + the appended .jsonl log)"""
+        # Read directly and treat a missing file as empty (no separate exists() stat)
+        try:
+            history = orjson.loads(self.conversation_file.read_bytes())
+        except FileNotFoundError:
+            history = {"messages": []}
+        
+        try:
+            with self.conversation_log.open('rb') as f:
+                history.setdefault("messages", []).extend(orjson.loads(line) for line in f if line.strip())
+        except FileNotFoundError:
+            return history
+        
+        # Legacy .json messages predate the log, but keep any mix in chronological order
+        history["messages"].sort(key=lambda msg: msg.get("timestamp", ""))
+        return history
     
-    def save_conversation_history(self, conversation_history):
-        """Save updated conversation history back to file"""
-        with open(self.conversation_file, 'w', encoding='utf-8') as f:
-            json.dump(conversation_history, f, indent=2, ensure_ascii=False)
+    def save_conversation_history(self, new_messages):
+        """Append this turn's messages to the conversation log"""
+        with self.conversation_log.open('ab') as f:
+            f.write(b"".join(orjson.dumps(msg) + b"\n" for msg in new_messages))
+    
+    @staticmethod
+    def _load_one(entry):
+        """Read one calorie output, preferring its slim summary copy (None if unreadable)"""
+        summary_path = Path(entry.path).parent / SUMMARY_DIR / entry.name
+        try:
+            if summary_path.stat().st_mtime_ns >= entry.stat().st_mtime_ns:
+                return {"file": entry.name, "data": orjson.loads(summary_path.read_bytes())}
+        except (OSError, orjson.JSONDecodeError):
+            pass
+        
+        try:
+            data = _context_fields(orjson.loads(Path(entry.path).read_bytes()))
+        except Exception:
+            return None
+        
+        # Written once; later loads parse only the fields the context needs
+        try:
+            summary_path.parent.mkdir(exist_ok=True)
+            summary_path.write_bytes(orjson.dumps(data))
+        except OSError:
+            pass
+        return {"file": entry.name, "data": data}
     
     def load_calorie_calculations(self):
-        """Load all calorie calculation outputs from session"""
-        calculations = []
+        """Load the most recent calorie calculation outputs from session (oldest first)"""
+        # scandir yields entries lazily with the path attached (no full listing, no os.path.join);
+        # only the newest CONTEXT_MEALS by mtime are kept, so only those get parsed
+        try:
+            with os.scandir(self.calorie_outputs_folder) as entries:
+                json_files = (entry for entry in entries if entry.name.endswith('.json') and entry.is_file())
+                files = heapq.nlargest(CONTEXT_MEALS, json_files, key=lambda entry: entry.stat().st_mtime_ns)
+        except FileNotFoundError:
+            return []
+        files.reverse()
+        
+        if not files:
+            return []
+        
+        # I/O-bound, so threads overlap the reads; each task only returns its own result
+        with ThreadPoolExecutor(max_workers=min(32, len(files))) as executor:
+            return [calc for calc in executor.map(self._load_one, files) if calc]
+    
+    @staticmethod
+    def _mtime_ns(path):
+        """Modification time of path, 0 if it doesn't exist"""
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return 0
+    
+    def _calorie_outputs_mtime(self):
+        """Changes whenever any calorie output is written, added or removed"""
+        calorie_mtime = self._mtime_ns(self.calorie_outputs_folder)
+        if calorie_mtime:
+            with os.scandir(self.calorie_outputs_folder) as entries:
+                calorie_mtime = max([calorie_mtime] + [entry.stat().st_mtime_ns for entry in entries])
+        return calorie_mtime
+    
+    def _context_key(self):
+        """Changes whenever the history or any calorie output is written, added or removed"""
+        return (self._mtime_ns(self.conversation_file), self._mtime_ns(self.conversation_log),
+                self._calorie_outputs_mtime())
+    
+    def watch_session(self):
+        """Start an inotify watcher thread on the session files; False if inotify is unavailable"""
+        if INotify is None:
+            return False
         
-        if not os.path.exists(self.calorie_outputs_folder):
-            return calculations
+        self.calorie_outputs_folder.mkdir(parents=True, exist_ok=True)
+        inotify = INotify()
+        mask = inotify_flags.MODIFY | inotify_flags.CREATE | inotify_flags.DELETE | inotify_flags.MOVED_TO
+        inotify.add_watch(self.session_folder, mask)
+        inotify.add_watch(self.calorie_outputs_folder, mask)
         
-        files = [f for f in os.listdir(self.calorie_outputs_folder) if f.endswith('.json')]
+        def mark_dirty():
+            while True:
+                if inotify.read():
+                    self._ctx_dirty = True
         
-        for filename in files:
-            filepath = os.path.join(self.calorie_outputs_folder, filename)
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    calculations.append({
-                        "file": filename,
-                        "data": data
-                    })
-            except Exception as e:
-                continue
+        threading.Thread(target=mark_dirty, name="session-watch", daemon=True).start()
+        self._watching = True
+        return True
+    
+    def get_context_summary(self):
+        """Context summary for the current session state, rebuilt only when its files changed"""
+        if self._watching:
+            if not self._ctx_dirty:
+                return self._cached_ctx
+            # Cleared before reloading, so a write that lands mid-rebuild marks it dirty again
+            self._ctx_dirty = False
         
-        return calculations
+        key = self._context_key()
+        context_summary = self._ctx_cache.get(key)
+        if context_summary is None:
+            context_summary = self.build_context_summary(self.load_conversation_history(),
+                                                         self.load_calorie_calculations())
+            self._ctx_cache[key] = context_summary
+        self._cached_ctx = context_summary
+        return context_summary
     
     def encode_image(self, image_path):
         """Encode image to base64 for GPT-4V"""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        # Upright JPEGs within MAX_IMAGE_SIDE are sent as-is (re-encoding would only lose quality)
+        return image_cache.encode_image(image_path, MAX_IMAGE_SIDE, IMAGE_JPEG_QUALITY)
     
     def build_context_summary(self, conversation_history, calorie_calculations):
         """Build a summary of available context"""
@@ -69,24 +279,24 @@ class ConversationalVLM:
         # Recent conversation (last 10 messages)
         recent_messages = conversation_history.get('messages', [])[-10:]
         if recent_messages:
-            conv_summary = "RECENT CONVERSATION:\n"
+            conv_parts = ["RECENT CONVERSATION:\n"]
             for msg in recent_messages:
                 role = msg.get('role', 'unknown')
-                content = msg.get('content', '')
                 timestamp = msg.get('timestamp', '')
-                content_preview = content[:300] + "..." if len(content) > 300 else content
-                conv_summary += f"{role.upper()} [{timestamp}]: {content_preview}\n"
-            context_parts.append(conv_summary)
+                conv_parts.append(f"{role.upper()} [{timestamp}]: {_preview(msg.get('content', ''))}\n")
+            context_parts.append("".join(conv_parts))
         
-        # FIXED: Better extraction of calorie calculations
+        # FIXED: Better extraction of calorie calculations (only the most recent meals)
+        calorie_calculations = calorie_calculations[-CONTEXT_MEALS:]
         if calorie_calculations:
-            calc_summary = "\n=== AVAILABLE CALORIE CALCULATIONS ===\n"
+            calc_parts = ["\n=== AVAILABLE CALORIE CALCULATIONS ===\n"]
+            add = calc_parts.append
             
             for idx, calc in enumerate(calorie_calculations, 1):
                 data = calc.get('data', {})
                 filename = calc.get('file', 'Unknown')
                 
-                calc_summary += f"\n📊 CALCULATION {idx} (from {filename}):\n"
+                add(f"\n📊 CALCULATION {idx} (from {filename}):\n")
                 
                 # Handle Agent 3 output structure (nutritional_breakdown_per_segment)
                 if 'nutritional_breakdown_per_segment' in data:
@@ -95,177 +305,240 @@ class ConversationalVLM:
                     
                     # Show each food item
                     for seg in segments:
-                        food_name = seg.get('food_name', 'Unknown')
+                        food_name = _preview(seg.get('food_name', 'Unknown'))
                         mass = seg.get('total_mass_grams', 0)
                         nutr = seg.get('calculated_nutrition', {})
                         
-                        calc_summary += f"  • {food_name} ({mass}g)\n"
-                        calc_summary += f"    - Calories: {nutr.get('calories_kcal', 0):.1f} kcal\n"
-                        calc_summary += f"    - Protein: {nutr.get('protein_g', 0):.1f}g\n"
-                        calc_summary += f"    - Carbs: {nutr.get('carbohydrates_g', 0):.1f}g\n"
-                        calc_summary += f"    - Fat: {nutr.get('fat_g', 0):.1f}g\n"
+                        add(f"  • {food_name} ({mass}g)\n"
+                            f"    - Calories: {nutr.get('calories_kcal', 0):.1f} kcal\n"
+                            f"    - Protein: {nutr.get('protein_g', 0):.1f}g\n"
+                            f"    - Carbs: {nutr.get('carbohydrates_g', 0):.1f}g\n"
+                            f"    - Fat: {nutr.get('fat_g', 0):.1f}g\n")
                     
                     # Show totals
                     if total_summary:
-                        calc_summary += f"\n  TOTAL MEAL:\n"
-                        calc_summary += f"    - Total Calories: {total_summary.get('total_calories_kcal', 0):.1f} kcal\n"
-                        calc_summary += f"    - Total Protein: {total_summary.get('total_protein_g', 0):.1f}g\n"
-                        calc_summary += f"    - Total Carbs: {total_summary.get('total_carbohydrates_g', 0):.1f}g\n"
-                        calc_summary += f"    - Total Fat: {total_summary.get('total_fat_g', 0):.1f}g\n"
+                        add(f"\n  TOTAL MEAL:\n"
+                            f"    - Total Calories: {total_summary.get('total_calories_kcal', 0):.1f} kcal\n"
+                            f"    - Total Protein: {total_summary.get('total_protein_g', 0):.1f}g\n"
+                            f"    - Total Carbs: {total_summary.get('total_carbohydrates_g', 0):.1f}g\n"
+                            f"    - Total Fat: {total_summary.get('total_fat_g', 0):.1f}g\n")
                 
                 # Handle old format (food_masses from Agent 2)
                 elif 'food_masses' in data:
                     for food in data.get('food_masses', []):
-                        food_name = food.get('food_name', 'Unknown')
+                        food_name = _preview(food.get('food_name', 'Unknown'))
                         mass = food.get('total_mass_grams', 0)
-                        calc_summary += f"  • {food_name}: {mass}g\n"
+                        add(f"  • {food_name}: {mass}g\n")
                 
                 # Generic fallback
                 else:
-                    calc_summary += f"  • Calculation data available (check file for details)\n"
+                    add(f"  • Calculation data available (check file for details)\n")
                 
-                calc_summary += "\n"
+                add("\n")
             
-            context_parts.append(calc_summary)
+            context_parts.append("".join(calc_parts))
         
-        final_context = "\n\n".join(context_parts) if context_parts else "No previous context available."
+        final_context = "\n\n".join(context_parts) if context_parts else NO_CONTEXT
         
         return final_context
     
     def create_system_prompt(self, context_summary):
         """Create system prompt with context"""
-        
-        return f"""You are an intelligent food and nutrition assistant. You can:
-- Answer general food and nutrition questions
-- Analyze food images
-- Provide meal recommendations
-- Compare foods and meals
-- Give dietary advice
-- Access conversation history and past calorie calculations
-
-CONTEXT AVAILABLE TO YOU:
-{context_summary}
-
-INSTRUCTIONS:
-1. When user asks about "my meal", "the food I ate", "what I calculated" - refer to the calorie calculations above
-2. You have access to DETAILED nutritional breakdowns - use them!
-3. If comparing foods, use the exact values from calculations
-4. Be specific with numbers when you have them
-5. If you see an image, describe it and answer accordingly
-6. Always be accurate with nutritional information
-7. If you don't have specific data, say so clearly
-
-IMPORTANT: The calorie calculations contain exact values for calories, protein, carbs, and fat. Use these precise numbers in your responses!
-
-Respond naturally and conversationally."""
+        if context_summary == NO_CONTEXT:
+            return _EMPTY_CONTEXT_PROMPT
+        return _SYSTEM_PROMPT_STATIC + context_summary
     
-    def chat_with_image(self, user_query, image_path, context_summary):
-        """Chat with both text and image"""
-        
-        # Encode image
-        base64_image = self.encode_image(image_path)
-        
-        messages = [
-            {
-                "role": "system",
-                "content": self.create_system_prompt(context_summary)
-            },
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": user_query
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
-                        }
-                    }
-                ]
-            }
-        ]
-        
+    def _complete(self, messages, stream=None):
+        """Run the chat completion; with a stream (e.g. sys.stdout), write tokens to it as they arrive"""
         response = self.client.chat.completions.create(
-            model="gpt-4o",
+            model=VLM_MODEL,
             messages=messages,
             max_tokens=1500,
-            temperature=0.7
+            temperature=0.7,
+            stream=stream is not None,
+            # Final stream chunk carries usage, so cache hits can be checked either way
+            stream_options={"include_usage": True} if stream is not None else NOT_GIVEN,
+            extra_body={"prompt_cache_key": VLM_PROMPT_CACHE_KEY}
         )
+        if stream is None:
+            _log_cached_tokens(response.usage)
+            return response.choices[0].message.content
+        
+        parts = []
+        for chunk in response:
+            if not chunk.choices:
+                _log_cached_tokens(chunk.usage)
+                continue
+            delta = chunk.choices[0].delta.content or ""
+            stream.write(delta)
+            stream.flush()
+            parts.append(delta)
         
-        return response.choices[0].message.content
+        stream.write("\n")
+        return "".join(parts)
     
-    def chat_text_only(self, user_query, context_summary):
-        """Chat with text only"""
+    def _build_messages(self, user_query, context_summary, image_path=None):
+        """System prompt + user turn (text, or text and image)"""
+        user_content = user_query
+        if image_path:
+            user_content = [
+                {
+                    "type": "text",
+                    "text": user_query
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image_cache.data_url(image_path, MAX_IMAGE_SIDE, IMAGE_JPEG_QUALITY)
+                    }
+                }
+            ]
         
-        messages = [
+        return [
             {
                 "role": "system",
                 "content": self.create_system_prompt(context_summary)
             },
             {
                 "role": "user",
-                "content": user_query
+                "content": user_content
             }
         ]
-        
-        response = self.client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            max_tokens=1500,
-            temperature=0.7
-        )
-        
-        return response.choices[0].message.content
     
-    def process(self, user_query, image_path=None):
-        """Main processing logic"""
+    def _response_cache_key(self, user_query, image_path=None):
+        """sha256 over the inputs that stay the same when a question is repeated: the image by path, mtime
+        and size (not its bytes), the calorie outputs by their latest mtime"""
+        image_sig = b""
+        if image_path:
+            stat = os.stat(image_path)
+            image_sig = f"{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}".encode()
+        return hashlib.sha256(b"\0".join([
+            VLM_MODEL.encode(), user_query.encode(), str(self._calorie_outputs_mtime()).encode(), image_sig
+        ])).hexdigest()
+    
+    def process(self, user_query, image_path=None, stream=None, use_cache=True):
+        """Main processing logic (a stream receives the reply while it is generated)"""
         
-        # Load context
-        conversation_history = self.load_conversation_history()
-        calorie_calculations = self.load_calorie_calculations()
+        # Load context + build context summary (cached while the session files are unchanged)
+        context_summary = self.get_context_summary()
+        if not (image_path and os.path.exists(image_path)):
+            image_path = None
         
-        # Build context summary
-        context_summary = self.build_context_summary(conversation_history, calorie_calculations)
+        key = self._response_cache_key(user_query, image_path) if use_cache else None
+        response = self.response_cache.get(key) if use_cache else None
         
-        # Generate response
-        if image_path and os.path.exists(image_path):
-            response = self.chat_with_image(user_query, image_path, context_summary)
+        if response is not None:
+            if stream is not None:
+                stream.write(response + "\n")
+                stream.flush()
         else:
-            response = self.chat_text_only(user_query, context_summary)
+            # Generate response (one call path for text-only and image turns)
+            messages = self._build_messages(user_query, context_summary, image_path)
+            response = self._complete(messages, stream)
+            if use_cache:
+                self.response_cache.set(key, response, expire=RESPONSE_CACHE_TTL_SECONDS)
         
         # Save this interaction to conversation history
-        conversation_history['messages'].append({
-            "role": "user",
-            "content": user_query,
-            "timestamp": datetime.now().isoformat(),
-            "had_image": bool(image_path)
-        })
-        
-        conversation_history['messages'].append({
-            "role": "assistant",
-            "content": response,
-            "timestamp": datetime.now().isoformat(),
-            "agent": "CONVERSATIONAL_VLM"
-        })
+        turn = [
+            {
+                "role": "user",
+                "content": user_query,
+                "timestamp": datetime.now().isoformat(),
+                "had_image": bool(image_path)
+            },
+            {
+                "role": "assistant",
+                "content": response,
+                "timestamp": datetime.now().isoformat(),
+                "agent": "CONVERSATIONAL_VLM"
+            }
+        ]
         
-        self.save_conversation_history(conversation_history)
+        self.save_conversation_history(turn)
         
         return response
 
 
+def run(query, image_path=None, session_folder=None, stream=None, use_cache=True):
+    """One conversational turn for a session (what the CLI does, callable in-process); returns the reply"""
+    if not session_folder:
+        raise ValueError("session_folder is required")
+    os.makedirs(session_folder, exist_ok=True)
+    return ConversationalVLM(session_folder).process(query, image_path, stream=stream, use_cache=use_cache)
+
+
+class _SocketStream:
+    """Text sink that forwards streamed reply deltas to a daemon client as JSON lines"""
+    def __init__(self, conn_file):
+        self.conn_file = conn_file
+    
+    def write(self, text):
+        if text:
+            self.conn_file.write(orjson.dumps({"delta": text}) + b"\n")
+    
+    def flush(self):
+        self.conn_file.flush()
+
+
+def _run_daemon(session_folder):
+    """Serve {"query", "image_path"} requests on session_folder/.vlm.sock, one at a time, in-process"""
+    vlm = ConversationalVLM(session_folder)
+    socket_path = vlm.session_folder / DAEMON_SOCKET
+    socket_path.unlink(missing_ok=True)
+    
+    if not vlm.watch_session():
+        print("ℹ️ inotify not available, checking session file mtimes each turn")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(socket_path))
+    server.listen()
+    print(f"🟢 Conversational VLM daemon listening on {socket_path}")
+    
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn, conn.makefile('rwb') as conn_file:
+                try:
+                    request = orjson.loads(conn_file.readline())
+                    # Turns are handled strictly in order: each one reads the history the previous one wrote
+                    vlm.process(request["query"], request.get("image_path"), stream=_SocketStream(conn_file),
+                                use_cache=request.get("use_cache", True))
+                    conn_file.write(orjson.dumps({"done": True}) + b"\n")
+                except Exception as e:
+                    conn_file.write(orjson.dumps({"error": str(e)}) + b"\n")
+                conn_file.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        socket_path.unlink(missing_ok=True)
+
+
 def main():
     """Main entry point"""
     
+    # stdout carries the reply (the router captures it), so diagnostics go to stderr
+    logging.basicConfig(level=os.getenv("CALAI_LOG", "WARNING"), format="%(message)s", stream=sys.stderr)
+    
+    # --daemon --session <folder>: keep this process (clients, pools, context cache) alive across turns
+    if '--daemon' in sys.argv and '--session' in sys.argv:
+        session_idx = sys.argv.index('--session')
+        if session_idx + 1 < len(sys.argv):
+            session_folder = sys.argv[session_idx + 1]
+            os.makedirs(session_folder, exist_ok=True)
+            _run_daemon(session_folder)
+            return
+    
     if len(sys.argv) < 2:
         print("Usage: python conversational_vlm.py <query> [image_path] --session <session_folder>")
         print("\nExamples:")
         print('  python conversational_vlm.py "What should I eat?" --session ./session_001')
         print('  python conversational_vlm.py "Is this healthy?" food.jpg --session ./session_001')
+        print('  python conversational_vlm.py "What should I eat?" --session ./session_001 --no-cache')
+        print('  python conversational_vlm.py --daemon --session ./session_001')
         sys.exit(1)
     
-    # Parse arguments
+    # Parse arguments (--no-cache: always call the API, even for a repeated question)
+    use_cache = '--no-cache' not in sys.argv
     user_query = sys.argv[1]
     image_path = None
     session_folder = None
@@ -290,15 +563,10 @@ def main():
         print(f"⚠️ Warning: Session folder doesn't exist, creating: {session_folder}")
         os.makedirs(session_folder, exist_ok=True)
     
-    # Initialize VLM
-    vlm = ConversationalVLM(session_folder)
-    
     # Process request
     try:
-        response = vlm.process(user_query, image_path)
-        
-        # Print response (router will capture this)
-        print(response)
+        # Response is streamed to stdout as it is generated (router will capture this)
+        run(user_query, image_path, session_folder, stream=sys.stdout, use_cache=use_cache)
         
     except Exception as e:
         print(f"❌ Error: {e}", file=sys.stderr)
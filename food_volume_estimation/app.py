@@ -3,27 +3,45 @@ Flask API for Food Volume Estimation
 Wraps the terminal-based volume estimation model into a REST API
 """
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_from_directory
+from werkzeug.exceptions import NotFound
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.targets import FileTarget
 import os
 import subprocess
+import csv
 import json
 import uuid
+import hashlib
 from datetime import datetime
 import shutil
+import threading
+import zipfile
 from pathlib import Path
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: the in-process lock still serializes this server's requests
+    fcntl = None
 
 app = Flask(__name__)
+# Uploads are read in big chunks, so bound the total size instead (no unbounded reads)
+app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024
+# Set FLASK_X_SENDFILE=1 behind nginx/Apache so the web server streams output images itself
+app.config['USE_X_SENDFILE'] = os.getenv('FLASK_X_SENDFILE') == '1'
 
 # Configuration
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-UPLOAD_FOLDER = 'uploads'
-OUTPUT_FOLDER = 'outputs'
-RESULTS_FOLDER = 'results'
+# Everything a request produces lives under sessions/<session_id>/, so cleanup is a single rmtree
+SESSIONS_FOLDER = 'sessions'
+UPLOAD_FOLDER = 'uploads'  # sessions/<session_id>/uploads/
+OUTPUT_FOLDER = 'outputs'  # sessions/<session_id>/outputs/ (plots)
+RESULTS_FILE = 'results.csv'  # sessions/<session_id>/results.csv
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 
 # Create necessary directories
-for folder in [UPLOAD_FOLDER, OUTPUT_FOLDER, RESULTS_FOLDER]:
-    os.makedirs(folder, exist_ok=True)
+os.makedirs(SESSIONS_FOLDER, exist_ok=True)
 
 # Model configuration (adjust these paths to your actual model files)
 DEPTH_MODEL_ARCHITECTURE = 'C:/Users/Kavya Shah/Downloads/food_volume_estimation/monovideo_fine_tune_food_videos.json'
@@ -34,6 +52,13 @@ GT_DEPTH_SCALE = 0.5  # Expected distance
 MIN_DEPTH = 0.01
 MAX_DEPTH = 10
 RELAXATION_PARAM = 0.01
+# Set to 1 to run volume_estimator.py in a fresh interpreter per request (old behaviour)
+USE_SUBPROCESS_ESTIMATOR = os.getenv('VOLUME_ESTIMATOR_SUBPROCESS') == '1'
+RESPONSE_CACHE_SIZE = 128  # Responses kept for identical re-uploads (e.g. UI retries)
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes per parser step: a multi-MB photo parses in a handful of steps
+IMAGE_CACHE_SECONDS = 3600  # Output images never change once written, so clients may reuse them
+# Last output number handed out (the outputN.json files are written next to app.py)
+OUTPUT_COUNTER_PATH = os.path.join(BASE_DIR, '.output_counter')
 
 
 def allowed_file(filename):
@@ -41,24 +66,118 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def run_volume_estimation(image_path, output_dir, session_id):
+# sha256 of uploaded image bytes -> JSON response, least recently used evicted first
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+
+class HashingFileTarget(FileTarget):
+    """FileTarget that sha256-hashes each chunk as it is written (upload hashed in the same pass)"""
+    def __init__(self, filename, *args, **kwargs):
+        super().__init__(filename, *args, **kwargs)
+        self.sha256 = hashlib.sha256()
+    
+    def on_data_received(self, chunk):
+        self.sha256.update(chunk)
+        super().on_data_received(chunk)
+
+
+def get_cached_response(digest):
+    """Response previously computed for the same image, or None"""
+    with _response_cache_lock:
+        response = _response_cache.get(digest)
+        if response is not None:
+            _response_cache.move_to_end(digest)
+        return response
+
+
+def cache_response(digest, response):
+    """Remember a response, evicting the least recently used past RESPONSE_CACHE_SIZE"""
+    with _response_cache_lock:
+        _response_cache[digest] = response
+        _response_cache.move_to_end(digest)
+        if len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+
+
+def evict_session_responses(session_id):
+    """Drop cached responses whose output files belong to session_id"""
+    with _response_cache_lock:
+        for digest in [d for d, r in _response_cache.items() if r['session_id'] == session_id]:
+            del _response_cache[digest]
+
+
+def session_path(session_id, *parts):
+    """Path inside a session's root directory (session_id comes from URLs, so it must not escape it)"""
+    if session_id in ('', '.', '..') or '/' in session_id or os.sep in session_id:
+        raise NotFound()
+    return os.path.join(SESSIONS_FOLDER, session_id, *parts)
+
+
+def receive_upload(session_id, field_name='image'):
     """
-    Run the volume estimation command and capture results
-    
-    Args:
-        image_path: Path to input image
-        output_dir: Directory to store output plots
-        session_id: Unique session identifier
+    Stream the multipart upload straight from the socket into the session's UPLOAD_FOLDER
+    (no werkzeug form parsing, no in-memory/spooled copy of the image)
     
     Returns:
-        dict: Results containing volumes and output paths
+        tuple: (saved filename, path, sha256 hex digest), or (None, None, None) if the field was missing
     """
-    results_file = os.path.join(RESULTS_FOLDER, f'{session_id}_results.csv')
-    
-    # Build the command to run the volume estimator
-    cmd = [
-        'python', 'volume_estimator.py',
-        '--input_images', image_path,
+    upload_dir = session_path(session_id, UPLOAD_FOLDER)
+    os.makedirs(upload_dir, exist_ok=True)
+    partial_path = os.path.join(upload_dir, f"{session_id}.part")
+    target = HashingFileTarget(partial_path)
+    parser = StreamingFormDataParser(headers=request.headers)
+    parser.register(field_name, target)
+    
+    while True:
+        chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        parser.data_received(chunk)
+    
+    if target.multipart_filename is None:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        return None, None, None
+    
+    filename = f"{session_id}_{os.path.basename(target.multipart_filename)}"
+    input_path = os.path.join(upload_dir, filename)
+    os.replace(partial_path, input_path)
+    return filename, input_path, target.sha256.hexdigest()
+
+
+_output_counter_lock = threading.Lock()
+
+
+def next_output_number():
+    """Increment and return the persistent output counter (no directory scan per request)"""
+    with _output_counter_lock:
+        fd = os.open(OUTPUT_COUNTER_PATH, os.O_RDWR | os.O_CREAT)
+        with open(fd, 'r+') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)  # Other server processes; released on close
+            value = f.read().strip()
+            if value:
+                output_num = int(value) + 1
+            else:
+                # First run: continue after the output files already on disk
+                existing_outputs = [name for name in os.listdir(BASE_DIR) if name.startswith('output') and name.endswith('.json')]
+                output_num = len(existing_outputs) + 1
+            f.seek(0)
+            f.write(str(output_num))
+            f.truncate()
+    return output_num
+
+
+# Depth + segmentation models, loaded once per server process
+_volume_estimator = None
+# Serializes model loading and estimation (one TF session, matplotlib is not thread-safe)
+_estimator_lock = threading.Lock()
+
+
+def estimator_argv():
+    """Model configuration as volume_estimator.py command-line arguments"""
+    return [
         '--depth_model_architecture', DEPTH_MODEL_ARCHITECTURE,
         '--depth_model_weights', DEPTH_MODEL_WEIGHTS,
         '--segmentation_weights', SEGMENTATION_WEIGHTS,
@@ -67,10 +186,58 @@ def run_volume_estimation(image_path, output_dir, session_id):
         '--min_depth', str(MIN_DEPTH),
         '--max_depth', str(MAX_DEPTH),
         '--relaxation_param', str(RELAXATION_PARAM),
-        '--plot_results',
-        '--results_file', results_file,
-        '--plots_directory', output_dir
+        '--plot_results'
     ]
+
+
+def get_volume_estimator():
+    """Load the volume estimator on first use and reuse it for every request"""
+    global _volume_estimator
+    with _estimator_lock:
+        if _volume_estimator is None:
+            from food_volume_estimation.volume_estimator import VolumeEstimator
+            _volume_estimator = VolumeEstimator(argv=estimator_argv())
+    return _volume_estimator
+
+
+def run_volume_estimation(image_path, output_dir, session_id, output_num):
+    """
+    Run the volume estimation command and capture results
+    
+    Args:
+        image_path: Path to input image
+        output_dir: Directory to store output plots
+        session_id: Unique session identifier
+        output_num: N of the outputN.json metadata file
+    
+    Returns:
+        dict: Results containing volumes and output paths
+    """
+    results_file = session_path(session_id, RESULTS_FILE)
+    
+    if not USE_SUBPROCESS_ESTIMATOR:
+        try:
+            estimator = get_volume_estimator()
+            with _estimator_lock, estimator.graph.as_default():
+                estimator.run([image_path], plots_directory=output_dir, output_num=output_num)
+            
+            return {
+                'success': True,
+                'stdout': '',
+                'stderr': '',
+                'results_file': results_file
+            }
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f'Volume estimation failed: {e}'
+            }
+    
+    # Build the command to run the volume estimator
+    cmd = (['python', 'volume_estimator.py', '--input_images', image_path]
+           + estimator_argv()
+           + ['--results_file', results_file, '--plots_directory', output_dir,
+              '--output_num', str(output_num)])
     
     try:
         # Run the command and capture output (Python 3.6 compatible)
@@ -122,8 +289,6 @@ def parse_results(results_file, output_dir):
     Returns:
         dict: Parsed results with image paths
     """
-    import pandas as pd
-    
     results = {
         'segments': [],
         'output_images': [],
@@ -133,35 +298,75 @@ def parse_results(results_file, output_dir):
     # Read results CSV if it exists
     if os.path.exists(results_file):
         try:
-            df = pd.read_csv(results_file)
-            for idx, row in df.iterrows():
-                segment = {
-                    'segment_id': idx + 1,
-                    'volume': float(row.get('volume', 0))
-                }
-                results['segments'].append(segment)
-                results['total_volume'] += segment['volume']
+            # A handful of rows: the stdlib reader avoids importing pandas per request
+            with open(results_file, newline='') as fh:
+                results['segments'] = [
+                    {'segment_id': idx + 1, 'volume': float(row.get('volume') or 0)}
+                    for idx, row in enumerate(csv.DictReader(fh))
+                ]
+            results['total_volume'] = sum(segment['volume'] for segment in results['segments'])
         except Exception as e:
             print(f"Error parsing results: {e}")
     
-    # Collect all generated images
-    if os.path.exists(output_dir):
-        for file in sorted(os.listdir(output_dir)):
-            if file.endswith(('.png', '.jpg', '.jpeg')):
-                results['output_images'].append(
-                    os.path.join(output_dir, file)
-                )
+    # Collect all generated images (one scandir pass; a missing directory just means no plots)
+    try:
+        with os.scandir(output_dir) as it:
+            entries = [e for e in it if e.name.endswith(('.png', '.jpg', '.jpeg')) and e.is_file()]
+    except FileNotFoundError:
+        entries = []
+    entries.sort(key=lambda e: e.name)
+    results['output_images'] = [e.path for e in entries]
     
     return results
 
 
+class _ChunkSink:
+    """Write-only file object collecting zipfile output for stream_zip"""
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def stream_zip(files):
+    """
+    Yield a zip archive of files chunk by chunk
+    
+    Args:
+        files: (path, arcname) pairs
+    """
+    # Unseekable target: zipfile writes data descriptors instead of seeking back
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for path, arcname in files:
+            with open(path, 'rb') as src, zf.open(arcname, 'w') as dst:
+                for block in iter(lambda: src.read(UPLOAD_CHUNK_SIZE), b''):
+                    dst.write(block)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
+
+
+# Serialized once: load-balancer probes get the same bytes with no per-request formatting
+_HEALTH_BODY = json.dumps({
+    'status': 'healthy',
+    'started_at': datetime.now().isoformat()
+}).encode('utf-8')
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.now().isoformat()
-    })
+    return Response(_HEALTH_BODY, mimetype='application/json')
 
 
 @app.route('/estimate-volume', methods=['POST'])
@@ -174,31 +379,41 @@ def estimate_volume():
     """
     
     # Check if image file is present
-    if 'image' not in request.files:
+    if request.mimetype != 'multipart/form-data':
         return jsonify({'error': 'No image file provided'}), 400
     
-    file = request.files['image']
+    # The streaming parser bypasses werkzeug's form parsing, which is where MAX_CONTENT_LENGTH is enforced
+    if request.content_length and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({'error': 'Image too large'}), 413
+    
+    # Generate unique session ID
+    session_id = str(uuid.uuid4())
+    
+    # Save uploaded image (streamed to disk while it is received)
+    filename, input_path, digest = receive_upload(session_id)
+    
+    if input_path is None:
+        shutil.rmtree(session_path(session_id), ignore_errors=True)
+        return jsonify({'error': 'No image file provided'}), 400
     
-    if file.filename == '':
+    if filename == f"{session_id}_":
+        shutil.rmtree(session_path(session_id), ignore_errors=True)
         return jsonify({'error': 'Empty filename'}), 400
     
-    if not allowed_file(file.filename):
+    if not allowed_file(filename):
+        shutil.rmtree(session_path(session_id), ignore_errors=True)
         return jsonify({'error': 'Invalid file type. Allowed: png, jpg, jpeg'}), 400
     
-    # Generate unique session ID
-    session_id = str(uuid.uuid4())
-    
-    # Save uploaded image
-    filename = f"{session_id}_{file.filename}"
-    input_path = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(input_path)
+    # Identical image already processed: return its results without running the model
+    cached = get_cached_response(digest)
+    if cached is not None:
+        shutil.rmtree(session_path(session_id), ignore_errors=True)
+        return jsonify(cached), 200
     
     # Generate sequential output number
-    base_dir = os.path.dirname(os.path.abspath(__file__))
     # IMPORTANT: This assumes the output JSON files are in the same directory as app.py
-    existing_outputs = [f for f in os.listdir(base_dir) if f.startswith('output') and f.endswith('.json')]
-    output_num = len(existing_outputs) + 1
-    output_dir = f'output{output_num}'
+    output_num = next_output_number()
+    output_dir = session_path(session_id, OUTPUT_FOLDER)
     
     # --- CHANGE #1: Define the correct filename here ---
     actual_metadata_file = f'output{output_num}.json'
@@ -208,7 +423,8 @@ def estimate_volume():
         estimation_result = run_volume_estimation(
             input_path, 
             output_dir, 
-            session_id
+            session_id,
+            output_num
         )
         
         if not estimation_result['success']:
@@ -247,6 +463,7 @@ def estimate_volume():
             'num_segments': len(results['segments'])
         }
         
+        cache_response(digest, response)
         return jsonify(response), 200
     
     except Exception as e:
@@ -265,12 +482,17 @@ def get_image(session_id, filename):
         session_id: Session identifier
         filename: Image filename
     """
-    image_path = os.path.join(OUTPUT_FOLDER, session_id, filename)
-    
-    if not os.path.exists(image_path):
+    # Conditional: ETag / If-None-Match 304s, and sendfile(2) / X-Sendfile where the server supports it
+    try:
+        return send_from_directory(
+            session_path(session_id, OUTPUT_FOLDER),
+            filename,
+            mimetype='image/png',
+            conditional=True,
+            cache_timeout=IMAGE_CACHE_SECONDS
+        )
+    except NotFound:
         return jsonify({'error': 'Image not found'}), 404
-    
-    return send_file(image_path, mimetype='image/png')
 
 
 @app.route('/get-all-images/<session_id>', methods=['GET'])
@@ -281,29 +503,25 @@ def get_all_images(session_id):
     Args:
         session_id: Session identifier
     """
-    import zipfile
-    import io
-    
-    output_dir = os.path.join(OUTPUT_FOLDER, session_id)
+    try:
+        output_dir = session_path(session_id, OUTPUT_FOLDER)
+    except NotFound:
+        output_dir = None
     
-    if not os.path.exists(output_dir):
+    if output_dir is None or not os.path.exists(output_dir):
         return jsonify({'error': 'Session not found'}), 404
     
-    # Create zip file in memory
-    memory_file = io.BytesIO()
-    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for file in os.listdir(output_dir):
-            if file.endswith(('.png', '.jpg', '.jpeg')):
-                file_path = os.path.join(output_dir, file)
-                zf.write(file_path, arcname=file)
-    
-    memory_file.seek(0)
+    files = [
+        (os.path.join(output_dir, file), file)
+        for file in os.listdir(output_dir)
+        if file.endswith(('.png', '.jpg', '.jpeg'))
+    ]
     
-    return send_file(
-        memory_file,
+    # Zip is generated while it is sent (no in-memory copy of every image)
+    return Response(
+        stream_zip(files),
         mimetype='application/zip',
-        as_attachment=True,
-        download_name=f'{session_id}_outputs.zip'
+        headers={'Content-Disposition': f'attachment; filename={session_id}_outputs.zip'}
     )
 
 
@@ -316,20 +534,11 @@ def cleanup_session(session_id):
         session_id: Session identifier
     """
     try:
-        # Remove uploaded image
-        for file in os.listdir(UPLOAD_FOLDER):
-            if file.startswith(session_id):
-                os.remove(os.path.join(UPLOAD_FOLDER, file))
-        
-        # Remove output directory
-        output_dir = os.path.join(OUTPUT_FOLDER, session_id)
-        if os.path.exists(output_dir):
-            shutil.rmtree(output_dir)
+        # Cached responses would point at the files removed below
+        evict_session_responses(session_id)
         
-        # Remove results file
-        results_file = os.path.join(RESULTS_FOLDER, f'{session_id}_results.csv')
-        if os.path.exists(results_file):
-            os.remove(results_file)
+        # Upload, plots and results CSV all live in the session root
+        shutil.rmtree(session_path(session_id), ignore_errors=True)
         
         return jsonify({
             'success': True,
@@ -343,4 +552,9 @@ def cleanup_session(session_id):
 
 
 if __name__ == '__main__':
+    # Development server only; deployments use wsgi.py under gunicorn
+    # Pay the model load at startup instead of on the first request
+    # (in the debug reloader's serving child only, not in the watcher process)
+    if not USE_SUBPROCESS_ESTIMATOR and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_volume_estimator()
     app.run(debug=True, host='0.0.0', port=5000)
\ No newline at end of file
@@ -69,18 +69,20 @@ class DensityDatabase():
 
 class VolumeEstimator():
     """Volume estimator object."""
-    def __init__(self, arg_init=True):
+    def __init__(self, arg_init=True, argv=None):
         """Load depth model and create segmentator object.
 
         Inputs:
             arg_init: Flag to initialize volume estimator with 
                 command-line arguments.
+            argv: Argument list to parse instead of sys.argv (in-process
+                use; input images are then passed to run()).
         """
         if not arg_init:
             # For usage in jupyter notebook 
             print('[*] VolumeEstimator not initialized.')
         else:    
-            self.args = self.__parse_args()
+            self.args = self.__parse_args(argv)
 
             # Load depth estimation model
             custom_losses = Losses()
@@ -109,6 +111,8 @@ class VolumeEstimator():
 
             # Create segmentator object
             self.segmentator = FoodSegmentator(self.args.segmentation_weights)
+            # Graph holding both models, for run() calls from other threads
+            self.graph = K.get_session().graph
 
             # Plate adjustment relaxation parameter
             self.relax_param = self.args.relaxation_param
@@ -118,9 +122,11 @@ class VolumeEstimator():
                 self.density_db = DensityDatabase(self.args.density_db)
 
 
-    def __parse_args(self):
+    def __parse_args(self, argv=None):
         """Parse command-line input arguments.
 
+        Inputs:
+            argv: Argument list or None to parse sys.argv.
         Returns:
             args: The arguments object.
         """
@@ -130,7 +136,7 @@ class VolumeEstimator():
         parser.add_argument('--input_images', type=str, nargs='+',
                             help='Paths to input images.',
                             metavar='/path/to/image1 /path/to/image2 ...',
-                            required=True)
+                            required=argv is None)
         parser.add_argument('--depth_model_architecture', type=str,
                             help=('Depth estimation model '
                                   'architecture (.json).'),
@@ -180,6 +186,11 @@ class VolumeEstimator():
                             help='Directory to save plots at (.png).',
                             metavar='/path/to/plot/directory/',
                             default=None)
+        parser.add_argument('--output_num', type=int,
+                            help=('Number N of the outputN.json metadata ' +
+                                  'file (default: from plots_directory).'),
+                            metavar='<output_num>',
+                            default=None)
         parser.add_argument('--density_db', type=str,
                             help=('Path to food density database (.xlsx) ' +
                                   'or Google Sheets ID.'),
@@ -189,13 +200,13 @@ class VolumeEstimator():
                             help='Food type to calculate weight for.',
                             metavar='<food_type>',
                             default=None)
-        args = parser.parse_args()
+        args = parser.parse_args(argv)
         
 
         return args
 
     def estimate_volume(self, input_image, fov=70,  plate_diameter_prior=0.3,
-            plot_results=False, plots_directory=None):
+            plot_results=False, plots_directory=None, output_num=1):
         """Volume estimation procedure.
 
         Inputs:
@@ -204,6 +215,8 @@ class VolumeEstimator():
             plate_diameter_prior: Expected plate diameter.
             plot_results: Result plotting flag.
             plots_directory: Directory to save plots at or None.
+            output_num: N of the outputN.json file, prefixed to the plot
+                filenames so every request's plots have their own names.
         Returns:
             estimated_volume: Estimated volume.
         """
@@ -403,16 +416,9 @@ class VolumeEstimator():
                 if plot_results:
                     plt.show()
                 if plots_directory is not None:
-                    # Save images independently outside food_volume_estimation
-                    parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-                    
-                    # Extract output number from plots_directory name
-                    import re
-                    match = re.search(r'output(\d+)', plots_directory)
-                    output_num = match.group(1) if match else '1'
-                    
+                    os.makedirs(plots_directory, exist_ok=True)
                     filename = f'output{output_num}_segment{k}.png'
-                    image_path = os.path.join(parent_dir, filename)
+                    image_path = os.path.join(plots_directory, filename)
                     plt.savefig(image_path)
                     image_filenames.append(filename)
 
@@ -430,6 +436,78 @@ class VolumeEstimator():
 
         return estimated_volumes, image_filenames   
 
+    def run(self, input_images, plots_directory=None, output_num=None):
+        """Estimate volumes for input images and write the outputN.json
+        segment metadata next to the package (the command-line procedure).
+
+        Inputs:
+            input_images: Paths to input images.
+            plots_directory: Directory to save plots at or None.
+            output_num: N of the outputN.json file, or None to take it
+                from an outputN plots_directory name.
+        Returns:
+            all_segments_data: Segment metadata of all input images.
+        """
+        plot_results = self.args.plot_results
+        all_segments_data = []
+        metadata_file = None
+
+        if output_num is None:
+            # Command line without --output_num: take it from an outputN plots_directory name
+            import re
+            match = re.search(r'output(\d+)', plots_directory or '')
+            output_num = match.group(1) if match else '1'
+
+        for input_image in input_images:
+            print('[*] Input:', input_image)
+            
+            # Now returns both volumes and filenames
+            volumes, image_filenames = self.estimate_volume(
+                input_image, self.args.fov, 
+                self.args.plate_diameter_prior, plot_results,
+                plots_directory, output_num)
+
+            # Create structured data for each segment
+            if plot_results or plots_directory is not None:
+                volumes_ml = [x[0] * 1000 for x in volumes]
+            else:
+                volumes_ml = [v * 1000 for v in volumes]
+            
+            # Build metadata for each segment
+            for idx, (vol, img_file) in enumerate(zip(volumes_ml, image_filenames)):
+                if img_file is not None:  # Only include segments with images
+                    segment_data = {
+                        'segment_id': idx,
+                        'image_filename': img_file,
+                        'volume': float(vol),
+                        # Absolute: script2 reads the plots from the repo root
+                        'image_path': os.path.abspath(os.path.join(plots_directory, img_file))
+                    }
+                    all_segments_data.append(segment_data)
+                    print(f'[*] Segment {idx}: {vol:.2f} ml saved as {img_file}')
+            
+            plt.close('all')
+
+            # Save metadata as JSON independently outside food_volume_estimation
+            if plots_directory is not None and len(all_segments_data) > 0:
+                parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+                
+                metadata = {
+                    'total_segments': len(all_segments_data),
+                    'segments': all_segments_data
+                }
+                
+                metadata_file = os.path.join(parent_dir, f'output{output_num}.json')
+                with open(metadata_file, 'w') as f:
+                    json.dump(metadata, f, indent=2)
+            
+            print(f'\n[*] ===== SUMMARY =====')
+            print(f'[*] Metadata saved to: {metadata_file}')
+            print(f'[*] Total segments: {len(all_segments_data)}')
+            print(f'[*] Total volume: {sum(s["volume"] for s in all_segments_data):.2f} litres')
+
+        return all_segments_data
+
     def __create_intrinsics_matrix(self, input_image_shape, fov):
         """Create intrinsics matrix from given camera fov.
 
@@ -465,67 +543,6 @@ class VolumeEstimator():
 
 
 if __name__ == '__main__':
-    import json
-    
     estimator = VolumeEstimator()
-
-    # Iterate over input images to estimate volumes
-    all_segments_data = []
-    
-    for input_image in estimator.args.input_images:
-        print('[*] Input:', input_image)
-        
-        # Now returns both volumes and filenames
-        volumes, image_filenames = estimator.estimate_volume(
-            input_image, estimator.args.fov, 
-            estimator.args.plate_diameter_prior, estimator.args.plot_results,
-            estimator.args.plots_directory)
-
-        # Create structured data for each segment
-        if estimator.args.plot_results or estimator.args.plots_directory is not None:
-            volumes_ml = [x[0] * 1000 for x in volumes]
-        else:
-            volumes_ml = [v * 1000 for v in volumes]
-        
-        # Build metadata for each segment
-        for idx, (vol, img_file) in enumerate(zip(volumes_ml, image_filenames)):
-            if img_file is not None:  # Only include segments with images
-                segment_data = {
-                    'segment_id': idx,
-                    'image_filename': img_file,
-                    'volume': float(vol),
-                    'image_path': os.path.join(estimator.args.plots_directory, img_file)
-                }
-                all_segments_data.append(segment_data)
-                print(f'[*] Segment {idx}: {vol:.2f} ml saved as {img_file}')
-        
-        plt.close('all')
-
-    # Save metadata as JSON
-# Save metadata as JSON independently outside food_volume_estimation
-        if estimator.args.plots_directory is not None and len(all_segments_data) > 0:
-            parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            
-            # Extract output number
-            import re
-            match = re.search(r'output(\d+)', estimator.args.plots_directory)
-            output_num = match.group(1) if match else '1'
-            
-            # Update image paths in metadata
-            for segment in all_segments_data:
-                segment['image_path'] = os.path.join(parent_dir, segment['image_filename'])
-            
-            metadata = {
-                'total_segments': len(all_segments_data),
-                'segments': all_segments_data
-            }
-            
-            metadata_file = os.path.join(parent_dir, f'output{output_num}.json')
-            with open(metadata_file, 'w') as f:
-                json.dump(metadata, f, indent=2)
-        
-        print(f'\n[*] ===== SUMMARY =====')
-        print(f'[*] Metadata saved to: {metadata_file}')
-        print(f'[*] Total segments: {len(all_segments_data)}')
-        print(f'[*] Total volume: {sum(s["volume"] for s in all_segments_data):.2f} litres')
-
+    estimator.run(estimator.args.input_images, estimator.args.plots_directory,
+                  estimator.args.output_num)
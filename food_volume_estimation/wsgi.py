@@ -0,0 +1,12 @@
+"""
+WSGI entry point for the Food Volume Estimation API
+Production server instead of the single-process Werkzeug dev server, run from this directory:
+    gunicorn -w 2 -k gthread --threads 8 --timeout 180 wsgi:app
+Every worker loads its own copy of the models, so size -w by memory (no --preload: TF sessions are not fork-safe)
+"""
+
+from app import app, get_volume_estimator, USE_SUBPROCESS_ESTIMATOR
+
+# Imported once per worker after the fork: pay the model load before the first request
+if not USE_SUBPROCESS_ESTIMATOR:
+    get_volume_estimator()
@@ -0,0 +1,87 @@
+"""
+Shared image encoding for the VLM agents
+Turns an image file into the data: URL sent to the OpenAI vision models (EXIF-rotated, scaled down, JPEG),
+cached per process by (path, mtime, size, encoding settings), so every agent that sends the same image
+in one process (calai runs all stages in-process; the router and the VLM daemon serve many turns)
+decodes, resizes and base64-encodes it once.
+"""
+
+import io
+import os
+import functools
+import logging
+from PIL import Image, ImageOps
+
+# SIMD-accelerated base64 when available, same API as the stdlib module
+try:
+    import pybase64 as b64
+except ImportError:
+    import base64 as b64
+
+logger = logging.getLogger("calai.image")
+
+# GPT-4o tiles large images down server-side anyway: bigger photos are shrunk to this long edge
+DEFAULT_MAX_SIDE = 1024
+DEFAULT_JPEG_QUALITY = 85
+# EXIF orientation; anything but 1 (upright) needs the PIL path to rotate the pixels
+ORIENTATION_TAG = 0x0112
+# Original files are base64'd in chunks of this many bytes (a multiple of 3, so no padding mid-stream)
+B64_CHUNK_SIZE = 3 * 1360
+
+
+def _b64_file(path):
+    """base64 text of a file, encoded chunk by chunk: only the output plus one small chunk is held in memory"""
+    out = bytearray()
+    chunk = bytearray(B64_CHUNK_SIZE)
+    view = memoryview(chunk)
+    # Buffered readinto fills the whole chunk unless at EOF, so only the last chunk can carry padding
+    with open(path, "rb") as image_file:
+        while True:
+            n = image_file.readinto(chunk)
+            if not n:
+                break
+            out += b64.b64encode(view[:n])
+    return out.decode('ascii')
+
+
+def _downscaled_jpeg(image_path, max_side, quality):
+    """JPEG bytes of the image scaled down to max_side, or None to send the original file
+    (already an upright RGB JPEG within max_side, or PIL cannot read it)"""
+    try:
+        with Image.open(image_path) as img:
+            # open() only parses the header: a web-sized JPEG skips the decode + re-encode entirely
+            if (img.format == 'JPEG' and img.mode == 'RGB' and max(img.size) <= max_side
+                    and img.getexif().get(ORIENTATION_TAG, 1) == 1):
+                return None
+            # Apply the EXIF rotation before thumbnail() drops the metadata
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            buffer = io.BytesIO()
+            img.save(buffer, format='JPEG', quality=quality, optimize=True)
+        return buffer.getbuffer()
+    except Exception as e:
+        logger.warning(f"⚠️  Could not downscale {image_path}, sending original: {e}")
+        return None
+
+
+def encode_image(image_path, max_side=DEFAULT_MAX_SIDE, quality=DEFAULT_JPEG_QUALITY, resize=True):
+    """base64 of the image as JPEG scaled down to max_side (uncached; resize=False sends the original file)"""
+    jpeg = _downscaled_jpeg(image_path, max_side, quality) if resize else None
+    if jpeg is None:
+        # Resizing off, nothing to resize, or PIL cannot read it: send the original file
+        return _b64_file(image_path)
+    return b64.b64encode(jpeg).decode('ascii')
+
+
+@functools.lru_cache(maxsize=64)
+def _encoded_url(image_path, mtime_ns, size, max_side, quality, resize):
+    """Prepared image as a data: URL; keyed on mtime and size so an edited file is re-encoded"""
+    return f"data:image/jpeg;base64,{encode_image(image_path, max_side, quality, resize)}"
+
+
+def data_url(image_path, max_side=DEFAULT_MAX_SIDE, quality=DEFAULT_JPEG_QUALITY, resize=True):
+    """data: URL of the encoded image, cached while the file's mtime and size are unchanged"""
+    stat = os.stat(image_path)
+    return _encoded_url(os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, max_side, quality, resize)
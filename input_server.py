@@ -10,8 +10,10 @@ import time
 app = Flask(__name__)
 
 # Store pending input requests
-pending_input = {"data": None, "ready": False}
+pending_input = {"data": None}
 input_lock = threading.Lock()
+# Set by /submit-input; /get-input blocks on it instead of polling
+input_ready = threading.Event()
 
 @app.route('/get-input', methods=['GET'])
 def get_input():
@@ -20,19 +22,18 @@ def get_input():
     
     # Wait until input is ready (timeout after 5 minutes)
     timeout = 300  # 5 minutes
-    start_time = time.time()
+    deadline = time.monotonic() + timeout
     
-    while time.time() - start_time < timeout:
+    while input_ready.wait(timeout=max(0, deadline - time.monotonic())):
         with input_lock:
-            if pending_input["ready"]:
+            # Re-check under the lock: another waiter may have taken this input
+            if input_ready.is_set():
                 user_data = pending_input["data"]
                 # Reset for next time
                 pending_input["data"] = None
-                pending_input["ready"] = False
+                input_ready.clear()
                 print(f"[INPUT_SERVER] Serving input to agent: {user_data[:100]}...")
                 return jsonify({"input": user_data})
-        
-        time.sleep(0.5)  # Check every 0.5 seconds
     
     return jsonify({"input": "", "error": "timeout"}), 408
 
@@ -46,7 +47,7 @@ def submit_input():
     
     with input_lock:
         pending_input["data"] = user_input
-        pending_input["ready"] = True
+        input_ready.set()
     
     return jsonify({"status": "received"})
 
@@ -54,7 +55,7 @@ def submit_input():
 def status():
     """Check if agent is waiting for input"""
     with input_lock:
-        return jsonify({"waiting": not pending_input["ready"]})
+        return jsonify({"waiting": not input_ready.is_set()})
 
 if __name__ == '__main__':
     print("="*60)
@@ -0,0 +1,67 @@
+"""
+Streaming Pipeline: Agent 1 → Agent 2
+Each decomposed food flows into Agent 2 as soon as Agent 1 finishes it,
+overlapping recipe decomposition with density lookups.
+Writes the same agent1_output.json / agent2_output.json as the standalone agents.
+
+Usage: python main_pipeline.py <pdf_database> <input_json>
+"""
+
+import sys
+import asyncio
+from agent1_decomposer import CulinaryDecomposer
+from agent2_masscalculator import MassCalculator
+
+
+async def run_pipeline(decomposer, calculator, input_file, num_workers=4):
+    """Run Agent 1 and Agent 2 concurrently, connected by a queue"""
+    items = decomposer.load_items(input_file)
+    queue = asyncio.Queue()
+    decomposed = []
+    
+    async def produce():
+        try:
+            async for idx, food in decomposer.stream(items):
+                decomposed.append((idx, food))
+                await queue.put((idx, food))
+        finally:
+            # One stop sentinel per Agent 2 worker
+            for _ in range(num_workers):
+                await queue.put(None)
+    
+    _, masses = await asyncio.gather(produce(), calculator.consume(queue, num_workers))
+    
+    decomposed.sort(key=lambda pair: pair[0])
+    return [food for _, food in decomposed], masses
+
+
+async def arun(pdf_path, input_file, calculator=None):
+    """In-process entry point: writes agent1_output.json and agent2_output.json"""
+    decomposer = CulinaryDecomposer()
+    # Callers may pass a MassCalculator whose density PDF was loaded ahead of time
+    if calculator is None:
+        calculator = MassCalculator(pdf_path)
+    
+    foods, masses = await run_pipeline(decomposer, calculator, input_file)
+    
+    decomposer.save_output(foods, "agent1_output.json")
+    calculator.save_output(masses, "agent2_output.json")
+    
+    print(f"\n{'='*70}")
+    print(f"✅ Agents 1 + 2 Complete! Decomposed {len(foods)} items, calculated {len(masses)} masses")
+    print(f"{'='*70}")
+    
+    return foods, masses
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: python main_pipeline.py <pdf_database> <input_json>")
+        print("Example: python main_pipeline.py food_density_database.pdf verified_volumes.json")
+        sys.exit(1)
+    
+    asyncio.run(arun(sys.argv[1], sys.argv[2]))
+
+
+if __name__ == "__main__":
+    main()
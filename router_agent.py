@@ -2,18 +2,76 @@
 Router Agent - Intelligent Workflow Orchestrator
 Decides which agent to call based on user input
 Usage: python router_agent.py "user query" [image_path]
+(or in-process: router_agent.run(session_folder, user_query, image_path), as ui_st.py does)
 """
 
 import os
+import re
 import sys
 import json
+import hashlib
 import subprocess
+import threading
+from collections import deque
 from datetime import datetime
+import diskcache
 from dotenv import load_dotenv
 from openai import OpenAI
 
+from conversational_vlm import run as vlm_run
+
 load_dotenv()
 
+# Routing decisions per (normalized query, has_image, conversation context); kept on disk since the router runs once per request
+ROUTING_CACHE_DIR = ".router_cache"
+ROUTING_CACHE_TTL_SECONDS = 24 * 60 * 60
+ROUTING_QUERY_KEY_CHARS = 128
+ROUTING_CONTEXT_MESSAGES = 5
+# Two-way classification: a small model in JSON mode is enough
+ROUTER_MODEL = "gpt-4o-mini"
+VLM_TIMEOUT_SECONDS = 60
+# Set to 1 to run each VLM reply in a separate interpreter via vlm_client.py (old behaviour)
+USE_SUBPROCESS_VLM = os.getenv('ROUTER_VLM_SUBPROCESS') == '1'
+
+
+def _drain(pipe, lines, echo=False):
+    """Collect a child pipe line by line (optionally echoing it live) until EOF; lines=None only echoes"""
+    for line in pipe:
+        if echo:
+            print(line, end="", flush=True)
+        if lines is not None:
+            lines.append(line)
+
+
+def _run_echoed(command, timeout):
+    """subprocess.run(check=True) for a caller whose sys.stdout is redirected in-process: the child's
+    stdout+stderr go through print() so they land wherever sys.stdout currently points"""
+    env = os.environ.copy()
+    env['PYTHONUNBUFFERED'] = '1'  # the pipe would otherwise make the child block-buffer its prompts
+    env['PYTHONIOENCODING'] = 'utf-8'
+    proc = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        encoding='utf-8',
+        errors='replace',
+        bufsize=1,
+        close_fds=False,
+        env=env
+    )
+    reader = threading.Thread(target=_drain, args=(proc.stdout, None, True), daemon=True)
+    reader.start()
+    try:
+        returncode = proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        raise
+    finally:
+        reader.join()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+
 class RouterAgent:
     def __init__(self, session_folder):
         """Initialize router with OpenAI and session storage"""
@@ -25,28 +83,32 @@ class RouterAgent:
         os.makedirs(f"{session_folder}/calorie_outputs", exist_ok=True)
         os.makedirs(f"{session_folder}/conversations", exist_ok=True)
         
-        self.conversation_file = f"{session_folder}/conversation_history.json"
+        self.metadata_file = f"{session_folder}/session_metadata.json"
+        # Append-only JSON-Lines log, shared with conversational_vlm.py (one line per message)
+        self.messages_file = f"{session_folder}/conversation_history.jsonl"
         self._init_conversation_history()
+        # Routing context kept in memory: the log is read once per router, not once per decision
+        self._recent_messages = deque(self._load_conversation_history(), maxlen=ROUTING_CONTEXT_MESSAGES)
+        self.routing_cache = diskcache.Cache(f"{session_folder}/{ROUTING_CACHE_DIR}")
     
     def _init_conversation_history(self):
-        """Initialize or load conversation history"""
-        if not os.path.exists(self.conversation_file):
-            with open(self.conversation_file, 'w') as f:
+        """Initialize session metadata and the message log"""
+        if not os.path.exists(self.metadata_file):
+            with open(self.metadata_file, 'w') as f:
                 json.dump({
                     "session_id": os.path.basename(self.session_folder),
-                    "started_at": datetime.now().isoformat(),
-                    "messages": []
+                    "started_at": datetime.now().isoformat()
                 }, f, indent=2)
+        open(self.messages_file, 'a', encoding='utf-8').close()
     
-    def _load_conversation_history(self):
-        """Load conversation history"""
-        with open(self.conversation_file, 'r') as f:
-            return json.load(f)
+    def _load_conversation_history(self, limit=ROUTING_CONTEXT_MESSAGES):
+        """Load the last `limit` messages (only those lines are parsed)"""
+        with open(self.messages_file, 'r', encoding='utf-8') as f:
+            lines = deque((line for line in f if line.strip()), maxlen=limit)
+        return [json.loads(line) for line in lines]
     
     def _save_message(self, role, content, metadata=None):
-        """Save message to conversation history"""
-        history = self._load_conversation_history()
-        
+        """Append message to conversation history"""
         message = {
             "role": role,
             "content": content,
@@ -56,23 +118,48 @@ class RouterAgent:
         if metadata:
             message["metadata"] = metadata
         
-        history["messages"].append(message)
-        
-        with open(self.conversation_file, 'w') as f:
-            json.dump(history, f, indent=2)
+        with open(self.messages_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(message) + "\n")
+        self._recent_messages.append(message)
     
     def decide_workflow(self, user_query, has_image):
-        """Use GPT-4 to decide which agent to call"""
+        """Decide which agent to call: deterministic rules, then cached decisions, then the router model"""
+        
+        # Special case: No image = always conversational
+        if not has_image:
+            print(f"\n💬 Auto-routing: No image → Conversational VLM")
+            return {
+                "agent": "CONVERSATIONAL_VLM",
+                "reasoning": "No image provided - routing to conversational agent"
+            }
+        # Special case: No query + has image = calorie calculation
+        if not user_query:
+            print(f"\n📊 Auto-routing: No query with image → Calorie Model")
+            return {
+                "agent": "CALORIE_MODEL",
+                "reasoning": "Image provided without query - assuming calorie calculation request"
+            }
+        
+        # Only the prompt's deterministic rules are decided above: keyword questions ("more protein than my
+        # last meal?") may be about history, which is the model's call
+        query_key = re.sub(r'\s+', ' ', (user_query or '').lower().strip())[:ROUTING_QUERY_KEY_CHARS]
         
         # Get conversation context
-        history = self._load_conversation_history()
-        recent_messages = history["messages"][-5:]  # Last 5 messages for context
+        recent_messages = self._recent_messages  # Last 5 messages for context
         
         context_str = "\n".join([
             f"{msg['role']}: {msg['content']}" 
             for msg in recent_messages
         ])
         
+        # The model sees the context too, so the same follow-up text only reuses a decision made in the same conversation state
+        context_key = hashlib.sha256(context_str.encode('utf-8')).hexdigest()
+        cache_key = ("decide_workflow", ROUTER_MODEL, query_key, has_image, context_key)
+        cached_decision = self.routing_cache.get(cache_key)
+        if cached_decision is not None:
+            print(f"♻️  Reusing routing decision for an identical query and context")
+            return cached_decision
+        
         decision_prompt = f"""You are a router agent for a food calorie estimation app. Analyze the user's query and decide which agent to call.
 
 AVAILABLE AGENTS:
@@ -112,30 +199,27 @@ OUTPUT (JSON only):
   "context_to_pass": "What context from history is relevant (if any)"
 }}"""
 
+        print(f"\n🤔 Analyzing intent with {ROUTER_MODEL}...")
         response = self.client.chat.completions.create(
-            model="gpt-4",
+            model=ROUTER_MODEL,
             messages=[
                 {"role": "system", "content": "You are an intelligent routing agent. Always respond with valid JSON."},
                 {"role": "user", "content": decision_prompt}
             ],
-            temperature=0.1
+            temperature=0.1,
+            response_format={"type": "json_object"}
         )
         
-        # Parse decision
+        # Parse decision (JSON mode: the whole message is the object)
         try:
-            decision_text = response.choices[0].message.content
-            json_start = decision_text.find('{')
-            json_end = decision_text.rfind('}') + 1
-            decision = json.loads(decision_text[json_start:json_end])
+            decision = json.loads(response.choices[0].message.content)
             
+            self.routing_cache.set(cache_key, decision, expire=ROUTING_CACHE_TTL_SECONDS)
             return decision
         except Exception as e:
             print(f"❌ Error parsing decision: {e}")
             # Default fallback
-            if has_image and not user_query:
-                return {"agent": "CALORIE_MODEL", "reasoning": "Image without query - assume calculation needed"}
-            else:
-                return {"agent": "CONVERSATIONAL_VLM", "reasoning": "Default to conversational"}
+            return {"agent": "CONVERSATIONAL_VLM", "reasoning": "Default to conversational"}
     
     # In router_agent.py
 
@@ -149,40 +233,37 @@ OUTPUT (JSON only):
         try:
             # --- START OF CHANGES ---
 
-            # 1. Define the KNOWN, FIXED path of the output file from the pipeline.
-            hardcoded_output_path = "agent3_output.json"
+            # 1. Decide the session file up front; the pipeline moves its final output straight there.
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            session_output_path = f"{self.session_folder}/calorie_outputs/calc_{timestamp}.json"
 
-            # 2. Build the command. It no longer needs the output path argument.
+            # 2. Build the command.
             #    NOTE: Replace "calai.py" with your actual pipeline script name.
-            command = ["python", "calai.py", image_path, self.session_folder]
+            command = [sys.executable, "calai.py", image_path, self.session_folder, "--output", session_output_path]
 
             # 3. Run the subprocess interactively (no output capture).
-            result = subprocess.run(
-                command,
-                check=True,
-                timeout=900  # 5 minute timeout
-            )
+            # Absolute interpreter path + close_fds=False keeps CPython on its posix_spawn fast path
+            # (no fork of this process); Python's own fds are non-inheritable anyway
+            if sys.stdout is sys.__stdout__:
+                result = subprocess.run(
+                    command,
+                    check=True,
+                    close_fds=False,
+                    timeout=900  # 5 minute timeout
+                )
+            else:
+                # Running in-process with stdout redirected (ui_st.py): relay the child's output
+                _run_echoed(command, timeout=900)
             
             # --- END OF CHANGES ---
             
             print(f"\n{'-'*70}")
             print(f"✅ Interactive Calorie Model Success!")
             
-            # 4. After success, find the hardcoded file, read it, and copy it to the session folder.
-            if os.path.exists(hardcoded_output_path):
-                with open(hardcoded_output_path, 'r', encoding='utf-8') as f:
+            # 4. After success, read the result from the session folder (no copy or cleanup needed).
+            if os.path.exists(session_output_path):
+                with open(session_output_path, 'r', encoding='utf-8') as f:
                     calorie_data = json.load(f)
-
-                # Create a unique name for the result inside the session folder
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                session_output_path = f"{self.session_folder}/calorie_outputs/calc_{timestamp}.json"
-                
-                # Save the copied data to the new session file
-                with open(session_output_path, 'w', encoding='utf-8') as f:
-                    json.dump(calorie_data, f, indent=2)
-
-                # Clean up the original hardcoded file
-                os.remove(hardcoded_output_path)
                 
                 return {
                     "success": True,
@@ -192,7 +273,7 @@ OUTPUT (JSON only):
             else:
                 return {
                     "success": False,
-                    "error": f"Pipeline finished but the output file '{hardcoded_output_path}' was not found."
+                    "error": f"Pipeline finished but the output file '{session_output_path}' was not found."
                 }
                 
         except subprocess.TimeoutExpired:
@@ -206,42 +287,72 @@ OUTPUT (JSON only):
             return {"success": False, "error": str(e)}
     
     def call_conversational_vlm(self, query, image_path=None):
-        """Call conversational VLM via subprocess"""
+        """Call conversational VLM in-process (or via subprocess with ROUTER_VLM_SUBPROCESS=1)"""
         print(f"\n💬 Calling Conversational VLM...")
         print(f"📝 Query: {query}")
         if image_path:
             print(f"📷 Image: {image_path}")
         
         try:
+            if not USE_SUBPROCESS_VLM:
+                # No second interpreter + openai/PIL import per reply; tokens stream straight to stdout
+                response_text = vlm_run(query, image_path, self.session_folder, stream=sys.stdout).strip()
+                print(f"✅ Conversational VLM Success!")
+                return {
+                    "success": True,
+                    "response": response_text
+                }
+            
             # Build command
-            cmd = ["python", "conversational_vlm.py", query]
+            # vlm_client.py reuses a running VLM daemon for the session, else runs conversational_vlm.py
+            cmd = [sys.executable, "vlm_client.py", query]
             if image_path:
                 cmd.append(image_path)
             
             # Pass session folder so VLM can access history
             cmd.extend(["--session", self.session_folder])
             
-            result = subprocess.run(
+            proc = subprocess.Popen(
                 cmd,
-                capture_output=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
                 text=True,
-                timeout=60
+                bufsize=1,
+                close_fds=False  # posix_spawn fast path, see call_calorie_model
             )
             
-            if result.returncode == 0:
-                print(f"✅ Conversational VLM Success!")
-                response_text = result.stdout.strip()
+            # Reply is shown as it streams in; stderr gets its own reader so neither pipe can fill up and stall the child
+            stdout_lines, stderr_lines = [], []
+            readers = [
+                threading.Thread(target=_drain, args=(proc.stdout, stdout_lines, True), daemon=True),
+                threading.Thread(target=_drain, args=(proc.stderr, stderr_lines), daemon=True)
+            ]
+            for reader in readers:
+                reader.start()
+            try:
+                returncode = proc.wait(timeout=VLM_TIMEOUT_SECONDS)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                raise
+            finally:
+                for reader in readers:
+                    reader.join()
+            
+            if returncode == 0:
+                print(f"\n✅ Conversational VLM Success!")
+                response_text = "".join(stdout_lines).strip()
                 
                 return {
                     "success": True,
                     "response": response_text
                 }
             else:
+                stderr_text = "".join(stderr_lines)
                 print(f"❌ Conversational VLM Failed!")
-                print(f"Error: {result.stderr}")
+                print(f"Error: {stderr_text}")
                 return {
                     "success": False,
-                    "error": result.stderr
+                    "error": stderr_text
                 }
                 
         except subprocess.TimeoutExpired:
@@ -274,24 +385,7 @@ OUTPUT (JSON only):
         
         # Decide workflow
         has_image = bool(image_path)
-        
-        # Special case: No query + has image = calorie calculation
-        if not user_query and has_image:
-            print(f"\n📊 Auto-routing: No query with image → Calorie Model")
-            decision = {
-                "agent": "CALORIE_MODEL",
-                "reasoning": "Image provided without query - assuming calorie calculation request"
-            }
-        # Special case: No image = always conversational
-        elif not has_image:
-            print(f"\n💬 Auto-routing: No image → Conversational VLM")
-            decision = {
-                "agent": "CONVERSATIONAL_VLM",
-                "reasoning": "No image provided - routing to conversational agent"
-            }
-        else:
-            print(f"\n🤔 Analyzing intent with GPT-4...")
-            decision = self.decide_workflow(user_query, has_image)
+        decision = self.decide_workflow(user_query, has_image)
         
         print(f"\n✅ Decision: {decision['agent']}")
         print(f"💡 Reasoning: {decision['reasoning']}")
@@ -341,6 +435,23 @@ OUTPUT (JSON only):
                 return result
 
 
+def run(session_folder, user_query=None, image_path=None):
+    """One routed request (what the CLI does, callable in-process); prints and returns the result"""
+    # Initialize router
+    router = RouterAgent(session_folder)
+    
+    # Process request
+    result = router.process_request(user_query, image_path)
+    
+    # Print final result
+    print(f"\n{'='*70}")
+    print(f"FINAL RESULT")
+    print(f"{'='*70}")
+    print(json.dumps(result, indent=2))
+    print(f"{'='*70}\n")
+    return result
+
+
 def main():
     """Main entry point for router agent"""
     
@@ -361,18 +472,7 @@ def main():
         print(f"❌ Error: Image file not found: {image_path}")
         sys.exit(1)
     
-    # Initialize router
-    router = RouterAgent(session_folder)
-    
-    # Process request
-    result = router.process_request(user_query, image_path)
-    
-    # Print final result
-    print(f"\n{'='*70}")
-    print(f"FINAL RESULT")
-    print(f"{'='*70}")
-    print(json.dumps(result, indent=2))
-    print(f"{'='*70}\n")
+    run(session_folder, user_query, image_path)
 
 
 if __name__ == "__main__":
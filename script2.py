@@ -1,43 +1,90 @@
 import json
+import orjson
+import asyncio
 from pathlib import Path
-from openai import OpenAI
-from PIL import Image
+from openai import OpenAI, AsyncOpenAI
 import sys
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+import mimetypes
+import numpy as np
 import os
 import config 
 from agents.dialogue_agent import DialogueAgent
-import base64
+import image_cache
+import hashlib
+import diskcache
 import time
+from functools import lru_cache
+from typing import Optional
+
+# Segment VLM calls in flight at once (network-bound, so overlap the request latency)
+VLM_CONCURRENCY = 8
+# Segment images are shrunk to this long edge before upload; the VLM downsamples larger ones anyway
+VLM_IMAGE_SIDE = 768
+VLM_JPEG_QUALITY = 85
+VLM_IMAGE_DETAIL = "low"  # fixed low-res image token cost; "auto"/"high" if small segments get misread
+VLM_MODEL = "gpt-5-mini"  # or "gpt-4o-mini" for cheaper
+
+# Per-segment VLM answers keyed by segment image content + volume, so re-running a plate skips the VLM
+VLM_CACHE_DIR = ".vlm_cache"
+
+# Keep-alive pool for the volume API: repeated pipeline runs in one process reuse the TCP connection.
+# Retry covers connection failures (and 502/503/504 on idempotent requests; the upload POST is not resent)
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+))
+
+# Above this many segments the volume threshold is applied as one NumPy comparison; below it NumPy's call overhead loses
+VECTOR_FILTER_MIN_SEGMENTS = 256
+
+
+@lru_cache(maxsize=4)
+def get_client(api_key: str) -> OpenAI:
+    """Process-wide sync OpenAI client per key, on the shared connection pool from config.py.
+    Async clients are not cached: they are bound to the event loop they first ran on."""
+    return OpenAI(api_key=api_key, http_client=config.http_client, max_retries=config.OPENAI_MAX_RETRIES)
+
 
 # PASTE THIS ENTIRE FUNCTION AT THE TOP OF YOUR SCRIPT2.PY FILE
 
-def filter_metadata_file(filepath: str, min_volume: float = 0.1):
+def filter_metadata_file(filepath: str, min_volume: float = 0.1) -> Optional[dict]:
     """
     Opens the specified JSON file, removes segments with volume < min_volume,
     and saves the changes back to the same file.
+    Returns the filtered metadata (so callers need not re-read the file), or None on failure.
     """
     print("-" * 60)
     print(f"CLEANUP: Filtering metadata file: {filepath}")
     
     if not os.path.exists(filepath):
         print(f"❌ ERROR: Cannot filter file. Not found at '{filepath}'")
-        return False
+        return None
 
     try:
-        with open(filepath, 'r') as f:
-            metadata = json.load(f)
+        metadata = orjson.loads(Path(filepath).read_bytes())
 
         original_segments = metadata.get('segments', [])
         if not original_segments:
             print("No segments found in the file to filter.")
-            return True
+            return metadata
 
         print(f"Found {len(original_segments)} segments in file.")
 
-        filtered_segments = [
-            segment for segment in original_segments if segment.get('volume', 0) >= min_volume
-        ]
+        if len(original_segments) > VECTOR_FILTER_MIN_SEGMENTS:
+            # float64 so the cut matches the list comprehension exactly at the threshold
+            volumes = np.fromiter((segment.get('volume', 0) for segment in original_segments),
+                                  dtype=np.float64, count=len(original_segments))
+            filtered_segments = [original_segments[i] for i in np.flatnonzero(volumes >= min_volume).tolist()]
+        else:
+            filtered_segments = [
+                segment for segment in original_segments if segment.get('volume', 0) >= min_volume
+            ]
 
         removed_count = len(original_segments) - len(filtered_segments)
         if removed_count > 0:
@@ -45,20 +92,28 @@ def filter_metadata_file(filepath: str, min_volume: float = 0.1):
         else:
             print("No segments needed to be removed.")
 
+        # Nothing filtered and the count already right: the file on disk is already the result
+        if removed_count == 0 and metadata.get('total_segments') == len(filtered_segments):
+            print("-" * 60)
+            return metadata
+
         metadata['segments'] = filtered_segments
         metadata['total_segments'] = len(filtered_segments)
 
-        with open(filepath, 'w') as f:
-            json.dump(metadata, f, indent=2)
+        # Write a sibling temp file and swap it in, so a crash never leaves a half-written metadata file
+        tmp_path = f"{filepath}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_path, filepath)
 
         print(f"✅ Successfully cleaned and saved '{filepath}'.")
         print("-" * 60)
-        return True
+        return metadata
 
     except Exception as e:
         print(f"❌ ERROR during file filtering: {e}")
         print("-" * 60)
-        return False
+        return None
 
 def call_volume_estimation_api(image_path, api_url='http://localhost:5000/estimate-volume'):
     print(f"Calling volume estimation API for image: {image_path}")
@@ -67,8 +122,10 @@ def call_volume_estimation_api(image_path, api_url='http://localhost:5000/estima
         return None
     try:
         with open(image_path, 'rb') as f:
-            files = {'image': (os.path.basename(image_path), f)}
-            response = requests.post(api_url, files=files, timeout=150)
+            # Streamed multipart body: the photo is read and sent in chunks, never held in memory as a whole
+            content_type = mimetypes.guess_type(image_path)[0] or 'application/octet-stream'
+            encoder = MultipartEncoder(fields={'image': (os.path.basename(image_path), f, content_type)})
+            response = _SESSION.post(api_url, data=encoder, headers={'Content-Type': encoder.content_type}, timeout=150)
         if response.status_code == 200:
             data = response.json()
             print("API call successful.")
@@ -80,18 +137,8 @@ def call_volume_estimation_api(image_path, api_url='http://localhost:5000/estima
         print(f"An error occurred while calling the API: {e}")
         return None
 
-def analyze_food_image(client: OpenAI, image_path: str, volume_l: float) -> dict:
-    """Analyze a single food segment image using Gemini VLM"""
-    
-    image = Image.open(image_path)
-    
-    prompt = f"""CRITICAL: This image shows a plate. You must identify ONLY the ONE specific food item that is segmented/highlighted in this image. IGNORE everything else on the plate.
-
-CONTEXT:
-- Volume of THIS ITEM: {volume_l:.3f} litres
-- Focus on the highlighted/segmented food only
-
-YOUR TASK:
+# Identification rules shared by the single-image and the batched prompt
+_SEGMENT_RULES = """YOUR TASK:
 1. Identify this specific food item. Focus on uncertainties that SIGNIFICANTLY affect calorie count.
 2. Based on the most significant uncertainty, formulate ONLY ONE critical question to ask the user. This question should aim to resolve the biggest potential calorie difference.
 
@@ -111,7 +158,7 @@ DO NOT worry about:
 - Minor brand differences
 
 RESPONSE FORMAT (JSON):
-{{
+{
   "food_name": "best guess for THIS ITEM only",
   "confidence": 0.0-1.0,
   "major_uncertainties": [
@@ -119,7 +166,7 @@ RESPONSE FORMAT (JSON):
   ],
   "most_important_question": "The single most critical question to resolve calorie ambiguity. Should be an empty string if confidence is > 0.94.",
   "ambiguity_flag": true/false
-}}
+}
 
 CONFIDENCE LEVELS:
 - 0.95-1.0: I know exactly what this is. No question needed.
@@ -141,119 +188,209 @@ Resulting JSON field: `"most_important_question": "Is this ketchup or a homemade
 
 Uncertainty: "Cannot tell if this is a fried pakora (high cal) or a steamed idli (low cal)"
 Resulting JSON field: `"most_important_question": "Is this item fried or steamed?"`
+"""
+
+# Single-segment prompt around the one per-call value (the volume), built once at import
+_SINGLE_PROMPT_HEAD = """CRITICAL: This image shows a plate. You must identify ONLY the ONE specific food item that is segmented/highlighted in this image. IGNORE everything else on the plate.
+
+CONTEXT:
+- Volume of THIS ITEM: """
+
+_SINGLE_PROMPT_TAIL = """ litres
+- Focus on the highlighted/segmented food only
 
+""" + _SEGMENT_RULES + """
 Respond ONLY with the JSON object."""
 
+_BATCH_PROMPT_HEAD = """CRITICAL: Each of the following images shows a plate. In EACH image you must identify ONLY the ONE specific food item that is segmented/highlighted in that image. IGNORE everything else on the plate.
+
+CONTEXT:
+- Every image is preceded by its number and the volume of ITS item
+- Analyze each image independently; RESPONSE FORMAT below describes the object for ONE image
+
+"""
+
+_BATCH_PROMPT_TAIL = """
+Respond ONLY with a JSON object {"results": [...]} holding exactly one object in the format above per image, in image order."""
+
+_ANALYSIS_FALLBACK = {
+    "food_name": "Unknown food",
+    "confidence": 0.0,
+    "ambiguity_flag": True,
+    "what_i_cannot_determine": [],
+    "assumptions_i_am_making": []
+}
+
+
+def _image_content(image_path: str) -> dict:
+    """Chat content part carrying the image as a base64 data URL"""
+    # Shared per-process cache: retries, fallback passes and the other agents reuse one encoding
+    image_url = image_cache.data_url(image_path, VLM_IMAGE_SIDE, VLM_JPEG_QUALITY)
+    return {"type": "image_url", "image_url": {"url": image_url, "detail": VLM_IMAGE_DETAIL}}
+
+
+def _segment_cache_key(image_path: str, volume_l: float) -> str:
+    """sha256 of the segment image bytes, the volume as shown in the prompt, the model and the segment rules"""
+    digest = hashlib.sha256(f"{VLM_MODEL}|{VLM_IMAGE_DETAIL}|{volume_l:.3f}|{_SEGMENT_RULES}".encode("utf-8"))
+    digest.update(Path(image_path).read_bytes())
+    return f"segment:{digest.hexdigest()}"
+
+
+def _normalize_analysis(result: dict) -> dict:
+    """Flag meal descriptions and fill in missing fields of one VLM analysis"""
+    # Validate we got a specific food, not a meal description
+    food_name = result.get('food_name', 'Unknown')
+    if any(word in food_name.lower() for word in ['meal', 'plate', 'dish with', 'and', 'rice meal', 'with dal']):
+        print(f"  WARNING: VLM returned meal description instead of specific item: {food_name}")
+        print(f"  Attempting to extract specific food...")
+        # Try to force it to be more specific
+        result['ambiguity_flag'] = True
+        result['confidence'] = min(result.get('confidence', 0.5), 0.7)
+    
+    # Ensure required fields
+    if 'food_name' not in result:
+        result['food_name'] = 'Unknown food'
+    if 'confidence' not in result:
+        result['confidence'] = 0.5
+    if 'ambiguity_flag' not in result:
+        result['ambiguity_flag'] = True
+    if 'what_i_cannot_determine' not in result:
+        result['what_i_cannot_determine'] = []
+    if 'assumptions_i_am_making' not in result:
+        result['assumptions_i_am_making'] = []
+    
+    return result
+
+
+async def analyze_food_image(client: AsyncOpenAI, image_path: str, volume_l: float) -> dict:
+    """Analyze a single food segment image using Gemini VLM"""
+    
+    prompt = f"{_SINGLE_PROMPT_HEAD}{volume_l:.3f}{_SINGLE_PROMPT_TAIL}"
+
     try:
-    # Encode image to base64
-        with open(image_path, 'rb') as img_file:
-            image_data = base64.b64encode(img_file.read()).decode('utf-8')
-        
-        response = client.chat.completions.create(
-            model="gpt-5-mini",  # or "gpt-4o-mini" for cheaper
+        response = await client.chat.completions.create(
+            model=VLM_MODEL,
             messages=[
                 {
                     "role": "user",
                     "content": [
                         {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_data}"
-                            }
-                        }
+                        _image_content(image_path)
                     ]
                 }
             ],
             response_format={"type": "json_object"}
         )
         
-        result = json.loads(response.choices[0].message.content)
-            
-        # Validate we got a specific food, not a meal description
-        food_name = result.get('food_name', 'Unknown')
-        if any(word in food_name.lower() for word in ['meal', 'plate', 'dish with', 'and', 'rice meal', 'with dal']):
-            print(f"  WARNING: VLM returned meal description instead of specific item: {food_name}")
-            print(f"  Attempting to extract specific food...")
-            # Try to force it to be more specific
-            result['ambiguity_flag'] = True
-            result['confidence'] = min(result.get('confidence', 0.5), 0.7)
-        
-        # Ensure required fields
-        if 'food_name' not in result:
-            result['food_name'] = 'Unknown food'
-        if 'confidence' not in result:
-            result['confidence'] = 0.5
-        if 'ambiguity_flag' not in result:
-            result['ambiguity_flag'] = True
-        if 'what_i_cannot_determine' not in result:
-            result['what_i_cannot_determine'] = []
-        if 'assumptions_i_am_making' not in result:
-            result['assumptions_i_am_making'] = []
-            
-        return result
+        return _normalize_analysis(json.loads(response.choices[0].message.content))
         
+    # Transient API errors were already retried by the client (config.OPENAI_MAX_RETRIES); a bad reply is not
     except json.JSONDecodeError as e:
         print(f"Warning: VLM returned invalid JSON: {e}")
-        return {
-            "food_name": "Unknown food",
-            "confidence": 0.0,
-            "ambiguity_flag": True,
-            "what_i_see": "Error parsing response",
-            "what_i_cannot_determine": [],
-            "assumptions_i_am_making": [],
-            "error": str(e)
-        }
+        return dict(_ANALYSIS_FALLBACK, what_i_see="Error parsing response", error=str(e))
     except Exception as e:
         print(f"Error during Gemini API call: {e}")
-        return {
-            "food_name": "Unknown food",
-            "confidence": 0.0,
-            "ambiguity_flag": True,
-            "what_i_cannot_determine": [],
-            "assumptions_i_am_making": [],
-            "error": str(e)
-        }
-
-def run_vlm_analysis(metadata_path, api_key):
-    """Analyze all food segments using VLM"""
+        return dict(_ANALYSIS_FALLBACK, error=str(e))
+
+
+async def analyze_food_images_batch(client: AsyncOpenAI, items: list) -> list:
+    """Analyze all (image_path, volume_l) segments in ONE multi-image request
+    Returns: one analysis per item in order, or None if the batch answer is unusable"""
+    content = [{"type": "text", "text": _BATCH_PROMPT_HEAD + _SEGMENT_RULES + _BATCH_PROMPT_TAIL}]
+    for number, (image_path, volume_l) in enumerate(items, 1):
+        content.append({"type": "text", "text": f"Image {number}: volume of its item {volume_l:.3f} litres"})
+        content.append(_image_content(image_path))
+    
+    try:
+        response = await client.chat.completions.create(
+            model=VLM_MODEL,
+            messages=[{"role": "user", "content": content}],
+            response_format={"type": "json_object"}
+        )
+        results = json.loads(response.choices[0].message.content).get('results')
+    except Exception as e:
+        print(f"Warning: batched VLM request failed ({e}), analyzing segments one by one")
+        return None
+    
+    if not isinstance(results, list) or len(results) != len(items) or not all(isinstance(r, dict) for r in results):
+        print("Warning: batched VLM answer does not match the segments, analyzing segments one by one")
+        return None
+    return [_normalize_analysis(result) for result in results]
+
+
+def run_vlm_analysis(metadata, api_key, concurrency=VLM_CONCURRENCY, use_cache=True):
+    """Synchronous entry point, see arun_vlm_analysis"""
+    return asyncio.run(arun_vlm_analysis(metadata, api_key, concurrency, use_cache=use_cache))
+
+
+async def arun_vlm_analysis(metadata: dict, api_key: str, concurrency=VLM_CONCURRENCY, client=None, use_cache=True):
+    """Analyze all food segments of the (already filtered) volume metadata using VLM: one batched request,
+    else up to `concurrency` segments at a time. Segments answered in a previous run (same image bytes and volume) come from .vlm_cache/ instead
+    (client: an AsyncOpenAI built ahead of time and closed by the caller; otherwise a private one is used)"""
     print("\n" + "="*60)
     print("PART 1: VLM FOOD IDENTIFICATION")
     print("="*60)
     
-    client = OpenAI(api_key=api_key)
+    # Private client: this runs on a short-lived event loop (asyncio.run, often in a worker thread)
+    owns_client = client is None
+    client = client or AsyncOpenAI(api_key=api_key, max_retries=config.OPENAI_MAX_RETRIES)
+    semaphore = asyncio.Semaphore(concurrency)
     
-    # Load metadata
-    with open(metadata_path, 'r') as f:
-        metadata = json.load(f)
+    segments = metadata['segments']
+    print(f"\nFound {len(segments)} food segments to analyze\n")
     
-    print(f"\nFound {len(metadata['segments'])} food segments to analyze\n")
+    cache = diskcache.Cache(VLM_CACHE_DIR) if use_cache else None
+    cache_keys = [_segment_cache_key(segment['image_path'], segment['volume']) if cache is not None else None
+                  for segment in segments]
+    analyses = [cache.get(key) if key else None for key in cache_keys]
+    pending = [i for i, analysis in enumerate(analyses) if analysis is None]
+    if len(pending) < len(segments):
+        print(f"♻️  {len(segments) - len(pending)} segment(s) already identified in a previous run, skipping their VLM calls\n")
     
-    results = []
-    for i, segment in enumerate(metadata['segments'], 1):
-        segment_id = segment['segment_id']
-        volume_litres = segment['volume']
-        image_path = segment['image_path']
-        
-        print(f"[{i}/{len(metadata['segments'])}] Analyzing Segment {segment_id}...")
-        print(f"  Volume: {volume_litres:.3f} litres")
-        print(f"  Image: {segment['image_filename']}")
-        
-        # Analyze with VLM
-        analysis = analyze_food_image(client, image_path, volume_litres)
-        
-        print(f"  Identified: {analysis.get('food_name', 'Unknown')}")
-        print(f"  Confidence: {analysis.get('confidence', 0):.2f}")
-        print(f"  Ambiguous: {analysis.get('ambiguity_flag', True)}")
-        print()
+    def record(i, segment, analysis):
+        # One print per finished segment, so concurrent segments don't interleave their lines
+        print(f"[{i}/{len(segments)}] Segment {segment['segment_id']}\n"
+              f"  Volume: {segment['volume']:.3f} litres\n"
+              f"  Image: {segment['image_filename']}\n"
+              f"  Identified: {analysis.get('food_name', 'Unknown')}\n"
+              f"  Confidence: {analysis.get('confidence', 0):.2f}\n"
+              f"  Ambiguous: {analysis.get('ambiguity_flag', True)}\n")
         
         # Store results with volume
-        analysis['original_volume_litres'] = volume_litres
-        analysis['segment_id'] = segment_id
-        analysis['image_path'] = image_path
+        analysis['original_volume_litres'] = segment['volume']
+        analysis['segment_id'] = segment['segment_id']
+        analysis['image_path'] = segment['image_path']
+        return analysis
+    
+    async def analyze_segment(i):
+        segment = segments[i]
+        async with semaphore:
+            print(f"[{i + 1}/{len(segments)}] Analyzing Segment {segment['segment_id']}...")
+            # Analyze with VLM
+            return await analyze_food_image(client, segment['image_path'], segment['volume'])
+    
+    try:
+        # Several segments left: one request for all their images (one round trip, shared prompt tokens)
+        batch = None
+        if len(pending) > 1:
+            print(f"Analyzing {len(pending)} segments in one request...\n")
+            batch = await analyze_food_images_batch(
+                client, [(segments[i]['image_path'], segments[i]['volume']) for i in pending])
         
-        results.append(analysis)
+        if batch is None:
+            # gather keeps the results in segment order
+            batch = await asyncio.gather(*[analyze_segment(i) for i in pending])
+    finally:
+        if owns_client:
+            await client.close()
+    
+    for i, analysis in zip(pending, batch):
+        analyses[i] = analysis
+        # Failed calls come back as the fallback with an "error" field; those are retried next run
+        if cache is not None and 'error' not in analysis:
+            cache.set(cache_keys[i], dict(analysis))
     
+    results = [record(i, segment, analysis) for i, (segment, analysis) in enumerate(zip(segments, analyses), 1)]
     output = {"analysis_results": results}
     
     print("="*60)
@@ -263,76 +400,112 @@ def run_vlm_analysis(metadata_path, api_key):
     return output
 
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python script2.py \"<path_to_your_image>\"")
-        sys.exit(1)
-        
-    input_image_path = sys.argv[1]
-    
+def run(input_image_path, concurrency=VLM_CONCURRENCY, use_cache=True):
+    """Synchronous entry point, see arun"""
+    return asyncio.run(arun(input_image_path, concurrency, use_cache))
+
+
+async def arun(input_image_path, concurrency=VLM_CONCURRENCY, use_cache=True):
+    """Volume estimation → VLM analysis → user confirmation; writes final_confirmed_output.json"""
     print("\n" + "="*60)
     print("FOOD ANALYSIS PIPELINE")
     print("="*60 + "\n")
     
+    api_key = config.OPENAI_API_KEY
+    if not api_key:
+        print("Error: OpenAI API key not found in config.py")
+        sys.exit(1) # Changed from 'return' to 'sys.exit(1)'
+    
     # Step 1: Call Volume Estimation API
     # Step 1: Call Volume Estimation API
     print("STEP 1: Volume Estimation")
     print("-" * 60)
     
+    # The OpenAI clients (httpx pool, SSL context) are built while the volume API is working. The async one
+    # lives for this run's event loop and is used by the VLM analysis; the dialogue agent shares the sync one
     volume_start_time = time.time()
-    metadata_file_path = call_volume_estimation_api(input_image_path)
+    metadata_file_path, vlm_client, sync_client = await asyncio.gather(
+        asyncio.to_thread(call_volume_estimation_api, input_image_path),
+        asyncio.to_thread(AsyncOpenAI, api_key=api_key, max_retries=config.OPENAI_MAX_RETRIES),
+        asyncio.to_thread(get_client, api_key)
+    )
     volume_end_time = time.time()
-    print(f"Volume Estimation API call took: {volume_end_time - volume_start_time:.2f} seconds")
+    try:
+        dialogue_agent = DialogueAgent(api_key=api_key, client=sync_client)
+        print(f"Volume Estimation API call took: {volume_end_time - volume_start_time:.2f} seconds")
     
-    # --- THIS IS THE FIX ---
-    # If the API call fails, now it will stop the entire pipeline.
-    if not metadata_file_path:
-        print("Critical Error: Volume estimation failed. Halting pipeline.")
-        sys.exit(1) # Changed from 'return' to 'sys.exit(1)'
-    # --- END OF FIX ---
+        # --- THIS IS THE FIX ---
+        # If the API call fails, now it will stop the entire pipeline.
+        if not metadata_file_path:
+            print("Critical Error: Volume estimation failed. Halting pipeline.")
+            sys.exit(1) # Changed from 'return' to 'sys.exit(1)'
+        # --- END OF FIX ---
     
-    print(f"Metadata received: {metadata_file_path}\n")
-    if not filter_metadata_file(metadata_file_path):
-        print("Critical Error: Failed to filter metadata file. Halting pipeline.")
-        sys.exit(1)
+        print(f"Metadata received: {metadata_file_path}\n")
+        metadata = filter_metadata_file(metadata_file_path)
+        if metadata is None:
+            print("Critical Error: Failed to filter metadata file. Halting pipeline.")
+            sys.exit(1)
     
-    # Step 2: Run VLM Analysis
-    # Step 2: Run VLM Analysis
-    api_key = config.OPENAI_API_KEY
-    if not api_key:
-        print("Error: OpenAI API key not found in config.py")
-        sys.exit(1) # Changed from 'return' to 'sys.exit(1)'
-    
-    vlm_start_time = time.time()
-    vlm_results = run_vlm_analysis(metadata_file_path, api_key)
-    vlm_end_time = time.time()
-    print(f"VLM analysis took: {vlm_end_time - vlm_start_time:.2f} seconds")
+        # Step 2: Run VLM Analysis
+        # Step 2: Run VLM Analysis
+        vlm_start_time = time.time()
+        vlm_results = await arun_vlm_analysis(metadata, api_key, concurrency, client=vlm_client,
+                                              use_cache=use_cache)
+        vlm_end_time = time.time()
+        print(f"VLM analysis took: {vlm_end_time - vlm_start_time:.2f} seconds")
     
-    with open("vlm_analysis_output.json", 'w') as f:
-        json.dump(vlm_results, f, indent=2)
-    print(f"VLM results saved: vlm_analysis_output.json\n")
+        with open("vlm_analysis_output.json", 'wb') as f:
+            f.write(orjson.dumps(vlm_results, option=orjson.OPT_INDENT_2))
+        print(f"VLM results saved: vlm_analysis_output.json\n")
     
-    # Step 3: Run Dialogue Agent for Confirmation
-    # Step 3: Run Dialogue Agent for Confirmation
-    print("STEP 2: User Confirmation")
-    print("-" * 60)
+        # Step 3: Run Dialogue Agent for Confirmation
+        # Step 3: Run Dialogue Agent for Confirmation
+        print("STEP 2: User Confirmation")
+        print("-" * 60)
     
-    dialogue_start_time = time.time()
-    dialogue_agent = DialogueAgent(api_key=api_key)
-    confirmed_results = dialogue_agent.confirm_analysis(vlm_results)
-    dialogue_end_time = time.time()
+        dialogue_start_time = time.time()
+        confirmed_results = await dialogue_agent.aconfirm_analysis(vlm_results)
+        dialogue_end_time = time.time()
+    finally:
+        await vlm_client.close()
     print(f"Dialogue Agent (including user input time) took: {dialogue_end_time - dialogue_start_time:.2f} seconds")
     
     # Step 4: Save Final Output
     FINAL_OUTPUT_FILE = "final_confirmed_output.json"
-    with open(FINAL_OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(confirmed_results, f, indent=2, ensure_ascii=False)
+    # orjson always writes UTF-8 without escaping (what ensure_ascii=False did); NON_STR_KEYS stringifies
+    # int keys like json.dump did
+    with open(FINAL_OUTPUT_FILE, 'wb') as f:
+        f.write(orjson.dumps(confirmed_results, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
     
     print("\n" + "="*60)
     print("PIPELINE COMPLETE!")
     print("="*60)
     print(f"Final output: {FINAL_OUTPUT_FILE}")
     print("="*60 + "\n")
+    
+    return confirmed_results
+
+
+def main():
+    # -c / --concurrency N: segment VLM calls in flight at once; --no-cache: ignore answers from previous runs
+    use_cache = "--no-cache" not in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "--no-cache"]
+    concurrency = VLM_CONCURRENCY
+    for flag in ('-c', '--concurrency'):
+        if flag in args:
+            flag_idx = args.index(flag)
+            if flag_idx + 1 >= len(args) or not args[flag_idx + 1].isdigit() or int(args[flag_idx + 1]) < 1:
+                print(f"Error: {flag} needs a positive integer")
+                sys.exit(1)
+            concurrency = int(args[flag_idx + 1])
+            del args[flag_idx:flag_idx + 2]
+    
+    if len(args) < 1:
+        print("Usage: python script2.py \"<path_to_your_image>\" [-c|--concurrency N] [--no-cache]")
+        sys.exit(1)
+        
+    run(args[0], concurrency, use_cache)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
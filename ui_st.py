@@ -4,12 +4,28 @@ import os
 import time
 from datetime import datetime
 import uuid
+import hashlib
 import threading
 import queue
-import subprocess
+from collections import deque
+import asyncio
+import contextlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+import sys
 import requests
+from requests.adapters import HTTPAdapter
 import json
 
+# Browser-side refresh timer (pip install streamlit-autorefresh); without it the terminal falls back to sleep + rerun
+try:
+    from streamlit_autorefresh import st_autorefresh
+except ImportError:
+    st_autorefresh = None
+
+# Set to 1 to launch router_agent.py as a separate interpreter per run (old behaviour)
+USE_SUBPROCESS_ROUTER = os.getenv('UI_ROUTER_SUBPROCESS') == '1'
+
 # -------------------- PAGE CONFIG --------------------
 st.set_page_config(page_title="Interactive Nutrition Assistant", page_icon="🍽️", layout="wide")
 
@@ -64,10 +80,17 @@ def create_new_session():
     os.makedirs(f"{session_folder}/calorie_outputs", exist_ok=True)
     return session_folder
 
+@st.cache_resource
+def get_http_session():
+    """One keep-alive session for the input server, shared across reruns (no handshake per rerun)"""
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    return session
+
 def check_input_server():
     """Check if input server is running"""
     try:
-        response = requests.get('http://localhost:5001/status', timeout=2)
+        response = get_http_session().get('http://localhost:5001/status', timeout=2)
         return response.status_code == 200
     except:
         return False
@@ -75,7 +98,7 @@ def check_input_server():
 def submit_user_input(user_input):
     """Submit user input to the input server"""
     try:
-        response = requests.post(
+        response = get_http_session().post(
             'http://localhost:5001/submit-input',
             json={'input': user_input},
             timeout=5
@@ -85,55 +108,109 @@ def submit_user_input(user_input):
         st.error(f"Failed to submit input: {e}")
         return False
 
-def read_output_thread(pipe, output_queue):
-    """Thread to read stdout"""
-    try:
-        for line in iter(pipe.readline, ''):
-            if line:
-                output_queue.put(('output', line))
-        pipe.close()
-    except Exception as e:
-        output_queue.put(('error', f"Read error: {e}"))
+# Agent output can be long lines (JSON dumps); asyncio's default 64 KiB line limit is too small
+AGENT_OUTPUT_LINE_LIMIT = 1024 * 1024
+
+async def stream_agent_process(command, output_queue, env):
+    """Spawn the agent and forward its stdout+stderr lines to the queue as they arrive"""
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        close_fds=False,  # with an absolute interpreter path, lets CPython use posix_spawn instead of fork
+        env=env,
+        limit=AGENT_OUTPUT_LINE_LIMIT
+    )
+    
+    async for line in process.stdout:
+        output_queue.put(('output', line.decode('utf-8', errors='replace')))
+    
+    return await process.wait()
 
 def run_agent_process(command, output_queue):
-    """Run agent process"""
+    """Run agent process (on the caller's thread; reading and waiting share one event loop)"""
     try:
         env = os.environ.copy()
         env['PYTHONUNBUFFERED'] = '1'
         env['PYTHONIOENCODING'] = 'utf-8'
         
-        process = subprocess.Popen(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            bufsize=1,
-            env=env,
-            text=True,
-            encoding='utf-8'
-        )
-        
-        # Start reader thread
-        reader_thread = threading.Thread(
-            target=read_output_thread,
-            args=(process.stdout, output_queue),
-            daemon=True
-        )
-        reader_thread.start()
+        returncode = asyncio.run(stream_agent_process(command, output_queue, env))
         
-        # Wait for process to complete
-        process.wait()
-        reader_thread.join(timeout=2)
-        
-        output_queue.put(('finished', process.returncode))
+        output_queue.put(('finished', returncode))
         
     except Exception as e:
         output_queue.put(('error', str(e)))
 
+class QueueWriter(io.TextIOBase):
+    """Text stream that puts complete lines on the output queue, the same messages the subprocess reader sends"""
+    def __init__(self, output_queue):
+        self.output_queue = output_queue
+        self._partial = ""
+    
+    def writable(self):
+        return True
+    
+    def write(self, text):
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self.output_queue.put(('output', line + '\n'))
+        return len(text)
+    
+    def close(self):
+        if self._partial:
+            self.output_queue.put(('output', self._partial))
+            self._partial = ""
+        super().close()
+
+@st.cache_resource
+def get_router_executor():
+    """One worker for in-process router runs, shared across reruns and sessions.
+    redirect_stdout swaps the process-wide sys.stdout, so runs must not overlap"""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="router")
+
+def run_router_in_process(session_folder, user_query, image_path, output_queue):
+    """Run the router in this interpreter (openai/PIL imported once, not per click), output into the queue"""
+    writer = QueueWriter(output_queue)
+    try:
+        import router_agent
+        with contextlib.redirect_stdout(writer), contextlib.redirect_stderr(writer):
+            router_agent.run(session_folder, user_query or None, image_path)
+        writer.close()
+        output_queue.put(('finished', 0))
+    except SystemExit as e:
+        writer.close()
+        output_queue.put(('finished', e.code if isinstance(e.code, int) else int(e.code is not None)))
+    except Exception as e:
+        writer.close()
+        output_queue.put(('error', str(e)))
+
+# Terminal keeps only the most recent chunks (lines); older output scrolls off instead of growing every rerun
+TERMINAL_MAX_CHUNKS = 2000
+
+def reset_terminal(*chunks):
+    """Start a fresh bounded terminal buffer"""
+    st.session_state.terminal_output = deque(chunks, maxlen=TERMINAL_MAX_CHUNKS)
+    st.session_state.terminal_text = "".join(chunks)
+    st.session_state.terminal_dirty = False
+
+def append_terminal(text):
+    """Add output; the joined text is rebuilt at most once per rerun by terminal_text()"""
+    st.session_state.terminal_output.append(text)
+    st.session_state.terminal_dirty = True
+
+def terminal_text():
+    """Joined terminal output, reused as-is on idle reruns where nothing new arrived"""
+    if st.session_state.terminal_dirty:
+        st.session_state.terminal_text = "".join(st.session_state.terminal_output)
+        st.session_state.terminal_dirty = False
+    return st.session_state.terminal_text
+
 # -------------------- SESSION STATE --------------------
 if "session_folder" not in st.session_state:
     st.session_state.session_folder = None
 if "terminal_output" not in st.session_state:
-    st.session_state.terminal_output = []
+    reset_terminal()
 if "process_running" not in st.session_state:
     st.session_state.process_running = False
 if "waiting_for_input" not in st.session_state:
@@ -158,7 +235,7 @@ if not check_input_server():
 st.sidebar.markdown("### Session Management")
 if st.sidebar.button("🆕 New Session", use_container_width=True):
     st.session_state.session_folder = create_new_session()
-    st.session_state.terminal_output = []
+    reset_terminal()
     st.session_state.process_running = False
     st.session_state.waiting_for_input = False
     st.session_state.output_queue = None
@@ -181,11 +258,16 @@ with col1:
     image_path = None
     if uploaded_file:
         image_path = os.path.join(st.session_state.session_folder, "uploaded_image.jpg")
-        image = Image.open(uploaded_file)
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        image.save(image_path, 'JPEG')
-        st.image(image_path, caption="Uploaded", width=250)
+        image_bytes = uploaded_file.getvalue()
+        # Decode + re-encode + write once per upload, not on every rerun (the agent may be reading the file)
+        upload_key = (image_path, hashlib.blake2b(image_bytes, digest_size=16).hexdigest())
+        if st.session_state.get("saved_upload") != upload_key or not os.path.exists(image_path):
+            image = Image.open(uploaded_file)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.save(image_path, 'JPEG')
+            st.session_state.saved_upload = upload_key
+        st.image(image_bytes, caption="Uploaded", width=250)
 
 with col2:
     st.markdown("### 💬 Your Query")
@@ -197,48 +279,51 @@ with col2:
     )
     
     if st.button("▶️ Run Agent", disabled=st.session_state.process_running):
-        # Build command
-        cmd = [
-            "python", "-u",
-            "router_agent.py", 
-            st.session_state.session_folder,
-            user_query if user_query else ""
-        ]
-        
-        if image_path:
-            cmd.append(image_path)
-        
         # Initialize
         st.session_state.output_queue = queue.Queue()
-        st.session_state.terminal_output = ["🚀 Starting agent...\n\n"]
+        reset_terminal("🚀 Starting agent...\n\n")
         st.session_state.process_running = True
         st.session_state.waiting_for_input = False
         st.session_state.last_output_line = ""
         
-        # Start process
-        st.session_state.process_thread = threading.Thread(
-            target=run_agent_process,
-            args=(cmd, st.session_state.output_queue),
-            daemon=True
-        )
-        st.session_state.process_thread.start()
+        if USE_SUBPROCESS_ROUTER:
+            # Build command
+            cmd = [
+                sys.executable, "-u",
+                "router_agent.py", 
+                st.session_state.session_folder,
+                user_query if user_query else ""
+            ]
+            
+            if image_path:
+                cmd.append(image_path)
+            
+            # Start process
+            st.session_state.process_thread = threading.Thread(
+                target=run_agent_process,
+                args=(cmd, st.session_state.output_queue),
+                daemon=True
+            )
+            st.session_state.process_thread.start()
+        else:
+            # Same queue messages as the subprocess path, so the terminal below is unchanged
+            get_router_executor().submit(
+                run_router_in_process,
+                st.session_state.session_folder, user_query, image_path, st.session_state.output_queue
+            )
         st.rerun()
 
 # -------------------- TERMINAL OUTPUT --------------------
 if st.session_state.process_running or st.session_state.waiting_for_input:
     st.markdown("### 🖥️ Agent Terminal")
     
-    # Process output queue
-    messages_processed = 0
-    max_messages = 200
-    
-    while not st.session_state.output_queue.empty() and messages_processed < max_messages:
+    # Process output queue (everything queued since the last refresh)
+    while True:
         try:
             msg_type, msg_data = st.session_state.output_queue.get_nowait()
-            messages_processed += 1
             
             if msg_type == 'output':
-                st.session_state.terminal_output.append(msg_data)
+                append_terminal(msg_data)
                 st.session_state.last_output_line = msg_data.strip()
                 
                 # Check if waiting for input
@@ -248,12 +333,12 @@ if st.session_state.process_running or st.session_state.waiting_for_input:
             elif msg_type == 'finished':
                 st.session_state.process_running = False
                 st.session_state.waiting_for_input = False
-                st.session_state.terminal_output.append(f"\n\n✅ Agent finished (exit code: {msg_data})\n")
+                append_terminal(f"\n\n✅ Agent finished (exit code: {msg_data})\n")
             
             elif msg_type == 'error':
                 st.session_state.process_running = False
                 st.session_state.waiting_for_input = False
-                st.session_state.terminal_output.append(f"\n\n❌ Error: {msg_data}\n")
+                append_terminal(f"\n\n❌ Error: {msg_data}\n")
         
         except queue.Empty:
             break
@@ -265,9 +350,8 @@ if st.session_state.process_running or st.session_state.waiting_for_input:
         st.markdown('<p class="status-running">▶️ Agent Running...</p>', unsafe_allow_html=True)
     
     # Display terminal
-    terminal_text = "".join(st.session_state.terminal_output)
     st.markdown('<div class="terminal-output">', unsafe_allow_html=True)
-    st.code(terminal_text, language='text')
+    st.code(terminal_text(), language='text')
     st.markdown('</div>', unsafe_allow_html=True)
     
     # -------------------- INPUT FORM --------------------
@@ -292,7 +376,7 @@ if st.session_state.process_running or st.session_state.waiting_for_input:
                 if user_input.strip():
                     # Submit to input server
                     if submit_user_input(user_input.strip()):
-                        st.session_state.terminal_output.append(f"\n✅ [YOU SUBMITTED]:\n{user_input}\n\n")
+                        append_terminal(f"\n✅ [YOU SUBMITTED]:\n{user_input}\n\n")
                         st.session_state.waiting_for_input = False
                         st.success(f"✅ Sent: {user_input[:50]}...")
                         time.sleep(0.5)
@@ -302,10 +386,14 @@ if st.session_state.process_running or st.session_state.waiting_for_input:
                 else:
                     st.warning("Please enter a response")
     else:
-        # Auto-refresh when running
+        # Auto-refresh when running: a browser-side timer reruns the script, nothing sleeps here.
+        # Not rendered once the agent finishes (or waits for input), which stops the refreshes
         if st.session_state.process_running:
-            time.sleep(0.5)
-            st.rerun()
+            if st_autorefresh is not None:
+                st_autorefresh(interval=500, limit=None, key="terminal_refresh")
+            else:
+                time.sleep(0.5)
+                st.rerun()
 
 # -------------------- RESULTS --------------------
 # -------------------- RESULTS --------------------
@@ -317,7 +405,7 @@ if not st.session_state.process_running and not st.session_state.waiting_for_inp
     
     with col_a:
         if st.button("🔄 New Query (Same Session)", use_container_width=True):
-            st.session_state.terminal_output = []
+            reset_terminal()
             st.session_state.process_running = False
             st.session_state.waiting_for_input = False
             st.rerun()
@@ -325,7 +413,7 @@ if not st.session_state.process_running and not st.session_state.waiting_for_inp
     with col_b:
         if st.button("🆕 New Session", use_container_width=True):
             st.session_state.session_folder = create_new_session()
-            st.session_state.terminal_output = []
+            reset_terminal()
             st.session_state.process_running = False
             st.session_state.waiting_for_input = False
             st.rerun()
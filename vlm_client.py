@@ -0,0 +1,74 @@
+"""
+Thin Conversational VLM client
+Forwards a turn to a running `conversational_vlm.py --daemon` for the session,
+so the per-turn cost is a socket round trip instead of a full interpreter + openai boot.
+Falls back to running conversational_vlm.py directly when no daemon is listening.
+
+Usage: python vlm_client.py <query> [image_path] --session <session_folder>
+(same arguments as conversational_vlm.py)
+"""
+
+import os
+import sys
+import json
+import socket
+
+# Must match DAEMON_SOCKET in conversational_vlm.py (not imported: that module pulls in openai)
+DAEMON_SOCKET = ".vlm.sock"
+
+
+def forward_to_daemon(session_folder, query, image_path=None, use_cache=True):
+    """Send one turn to the session daemon and stream its reply to stdout; False if no daemon"""
+    socket_path = os.path.join(session_folder, DAEMON_SOCKET)
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+        return False
+
+    try:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(socket_path)
+    except OSError:
+        # Stale socket left behind by a daemon that died
+        return False
+
+    with conn, conn.makefile('rwb') as conn_file:
+        conn_file.write(json.dumps({"query": query, "image_path": image_path, "use_cache": use_cache}).encode("utf-8") + b"\n")
+        conn_file.flush()
+
+        for line in conn_file:
+            message = json.loads(line)
+            if "delta" in message:
+                sys.stdout.write(message["delta"])
+                sys.stdout.flush()
+            elif "error" in message:
+                print(f"❌ Error: {message['error']}", file=sys.stderr)
+                sys.exit(1)
+            elif message.get("done"):
+                break
+
+    return True
+
+
+def main():
+    args = sys.argv[1:]
+    session_folder = None
+    if '--session' in args:
+        session_idx = args.index('--session')
+        if session_idx + 1 < len(args):
+            session_folder = args[session_idx + 1]
+
+    if args and args[0] != '--session' and session_folder:
+        query = args[0]
+        image_path = None
+        if len(args) > 1 and args[1] != '--session' and os.path.exists(args[1]):
+            image_path = os.path.abspath(args[1])
+
+        if forward_to_daemon(session_folder, query, image_path, use_cache='--no-cache' not in args):
+            return
+
+    # No daemon (or bad arguments): run the full agent, which also prints usage errors
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversational_vlm.py")
+    os.execv(sys.executable, [sys.executable, script] + args)
+
+
+if __name__ == "__main__":
+    main()
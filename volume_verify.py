@@ -3,68 +3,67 @@ Volume Verification Agent
 Verifies and refines volume estimates using VLM analysis
 Takes final_confirmed_output.json + original image → outputs verified_volumes.json
 
-Usage: python volume_verify.py <final_confirmed_output.json> <original_image_path>
+Usage: python volume_verify.py <final_confirmed_output.json> <original_image_path> [--high-accuracy]
 """
 
+import re
 import sys
 import json
-import base64
+import orjson
+import mmap
 import os
-from openai import OpenAI
+import functools
+import asyncio
+import contextvars
+from openai import AsyncOpenAI
+from pydantic import BaseModel, ConfigDict, TypeAdapter
+from typing import List
 from dotenv import load_dotenv
+import config
+import image_cache
 
 load_dotenv()
 
+# Images per request in verify_volumes_batch
+VERIFY_BATCH_SIZE = 20
+# Images are shrunk to this long edge before upload (gpt-4o tiles large images down anyway);
+# VOLUME_VERIFY_NO_RESIZE=1 sends the original file instead
+VERIFY_IMAGE_SIDE = 1024
+VERIFY_JPEG_QUALITY = 85
+RESIZE_IMAGES = os.getenv('VOLUME_VERIFY_NO_RESIZE') != '1'
+# Completion budget per request grows with the food count instead of reserving 2000 tokens of TPM every
+# time: one verified_volumes entry with its reasoning is ~80-100 tokens, plus the overall fields
+VERIFY_BASE_TOKENS = 200
+VERIFY_TOKENS_PER_FOOD = 120
+VERIFY_MAX_TOKENS = 2000
+# Typical single-serving volume bands (litres) per food class, matched as words in the confirmed name.
+# When every food sits inside its band the VLM call is skipped; VOLUME_VERIFY_ALWAYS_VLM=1 disables this
+VOLUME_PRIORS = {
+    'rice': (0.10, 0.35),
+    'dal': (0.15, 0.40),
+    'curry': (0.15, 0.40),
+    'roti': (0.03, 0.10),
+    'chapati': (0.03, 0.10),
+}
+_PRIOR_PATTERN = re.compile(r'\b(' + '|'.join(VOLUME_PRIORS) + r')\b')
+USE_VOLUME_PRIORS = os.getenv('VOLUME_VERIFY_ALWAYS_VLM') != '1'
+# Input JSON at least this large is parsed straight from a read-only mmap instead of a read() copy
+MMAP_MIN_BYTES = 1 << 20
+# Judging whether volumes look right is well within the small model; its low-confidence answers are
+# re-asked of the large one (which --high-accuracy uses from the start)
+VERIFY_MODEL = "gpt-4o-mini"
+VERIFY_HIGH_ACCURACY_MODEL = "gpt-4o"
+VERIFY_PROMOTE_CONFIDENCE = 0.6
+# VLM requests in flight at once when verifying several meals (keep under the account's RPM)
+VERIFY_CONCURRENCY = 10
 
-class VolumeVerifyAgent:
-    def __init__(self, api_key):
-        """Initialize the volume verification agent"""
-        self.client = OpenAI(api_key=api_key)
-    
-    def encode_image(self, image_path):
-        """Encode image to base64 for GPT-4V"""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-    
-    def verify_volumes_with_vlm(self, confirmed_foods, image_path):
-        """
-        Use VLM to verify volume estimates for each food item
-        
-        Args:
-            confirmed_foods: List of confirmed food items with volumes
-            image_path: Path to original food image
-        
-        Returns:
-            List of foods with verified volumes
-        """
-        
-        print("\n" + "="*70)
-        print("VOLUME VERIFICATION WITH VLM")
-        print("="*70 + "\n")
-        
-        # Encode image
-        base64_image = self.encode_image(image_path)
-        
-        # Build food summary for VLM
-        foods_summary = []
-        for food in confirmed_foods:
-            seg_id = food.get('segment_id')
-            name = food.get('final_food_name')
-            volume_litres = food.get('volume_litres')
-            
-            foods_summary.append({
-                'segment_id': seg_id,
-                'food_name': name,
-                'estimated_volume_litres': volume_litres
-            })
-        
-        # Create VLM prompt
-        prompt = f"""You are a food volume verification expert. Analyze this food image and verify the volume estimates.
+_VERIFY_PROMPT_HEAD = """You are a food volume verification expert. Analyze this food image and verify the volume estimates.
 
 FOOD ITEMS WITH ESTIMATED VOLUMES:
-{json.dumps(foods_summary, indent=2)}
+"""
 
-YOUR TASK:
+# Task, reference guide and output format shared by the single-image and the batched prompt
+_VERIFY_RULES = """YOUR TASK:
 1. Look at the image and identify each food item
 2. Assess if the volume estimates seem reasonable
 3. For each item, provide:
@@ -88,9 +87,9 @@ ASSESSMENT CRITERIA:
 - Account for irregular shapes
 
 OUTPUT FORMAT (JSON):
-{{
+{
   "verified_volumes": [
-    {{
+    {
       "segment_id": 1,
       "food_name": "Rice",
       "original_volume_litres": 0.250,
@@ -99,8 +98,8 @@ OUTPUT FORMAT (JSON):
       "confidence": 0.85,
       "reasoning": "Volume looks appropriate for rice portion shown",
       "adjustment_made": false
-    }},
-    {{
+    },
+    {
       "segment_id": 2,
       "food_name": "Dal",
       "original_volume_litres": 0.500,
@@ -109,11 +108,11 @@ OUTPUT FORMAT (JSON):
       "confidence": 0.75,
       "reasoning": "Dal portion appears smaller than 500ml, suggesting 300ml",
       "adjustment_made": true
-    }}
+    }
   ],
   "overall_confidence": 0.80,
   "notes": "Overall volumes seem reasonable with minor adjustments"
-}}
+}
 
 IMPORTANT:
 - Be conservative with adjustments
@@ -121,11 +120,189 @@ IMPORTANT:
 - Consider relative proportions between items
 - Account for perspective and camera angle"""
 
+_BATCH_PROMPT_HEAD = """You are a food volume verification expert. Analyze EACH of the following food images and verify the volume estimates of ITS food items.
+
+CONTEXT:
+- Every image is preceded by its number and its food items with estimated volumes
+- Analyze each image independently; OUTPUT FORMAT below describes the object for ONE image
+
+"""
+
+_BATCH_PROMPT_TAIL = """
+
+Respond ONLY with a JSON object {"results": [...]} holding exactly one object in the format above per image, in image order, each with an added "image_index" (the image number)."""
+
+
+def _load_json(path):
+    """orjson parse of a JSON file (orjson.JSONDecodeError is a json.JSONDecodeError)"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < MMAP_MIN_BYTES:
+            return orjson.loads(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            return orjson.loads(view)
+
+
+def _max_tokens(n_foods):
+    """max_tokens for verifying one image with n_foods items"""
+    return min(VERIFY_MAX_TOKENS, VERIFY_BASE_TOKENS + VERIFY_TOKENS_PER_FOOD * n_foods)
+
+
+def _prior_band(food):
+    """(low, high) typical volume for the food's class, or None if no prior covers it"""
+    match = _PRIOR_PATTERN.search((food.get('final_food_name') or '').lower())
+    return VOLUME_PRIORS[match.group(1)] if match else None
+
+
+def _within_priors(confirmed_foods):
+    """True when every food has a prior and its volume lies inside the band"""
+    for food in confirmed_foods:
+        band = _prior_band(food)
+        volume = food.get('volume_litres')
+        if band is None or not isinstance(volume, (int, float)) or not band[0] <= volume <= band[1]:
+            return False
+    return True
+
+
+def _prompt_volume(volume_litres):
+    """Volume as the VLM sees it: millilitre precision (what the prompt examples show), fewer tokens"""
+    return round(volume_litres, 3) if isinstance(volume_litres, float) else volume_litres
+
+
+# Structured-output schemas: the API constrains decoding to these, so replies always parse
+class VerifiedVolume(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    segment_id: int
+    food_name: str
+    original_volume_litres: float
+    volume_reasonable: bool
+    suggested_volume_litres: float
+    confidence: float
+    reasoning: str
+    adjustment_made: bool
+
+
+class VolumeVerification(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    verified_volumes: List[VerifiedVolume]
+    overall_confidence: float
+    notes: str
+
+
+class ImageVolumeVerification(VolumeVerification):
+    image_index: int
+
+
+class VolumeVerificationBatch(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    results: List[ImageVolumeVerification]
+
+
+VERIFICATION_ADAPTER = TypeAdapter(VolumeVerification)
+VERIFICATION_BATCH_ADAPTER = TypeAdapter(VolumeVerificationBatch)
+
+
+@functools.cache
+def _schema_format(model):
+    """response_format for strict JSON-schema structured outputs, built on first use and then reused
+    (model_json_schema walks the whole model every call)"""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": model.__name__, "strict": True, "schema": model.model_json_schema()}
+    }
+
+
+# An AsyncOpenAI connection pool is bound to the event loop it runs on, so a client lives exactly as long as
+# the outermost agent coroutine that opened it; nested calls and the tasks they gather inherit it
+_ASYNC_CLIENT = contextvars.ContextVar("volume_verify_async_client", default=None)
+
+
+def _with_async_client(method):
+    """Runs an async agent method with an open AsyncOpenAI, closed when the outermost such call returns"""
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        client = _ASYNC_CLIENT.get()
+        if client is not None and client.api_key == self.api_key:
+            return await method(self, *args, **kwargs)
+        async with AsyncOpenAI(api_key=self.api_key, max_retries=config.OPENAI_MAX_RETRIES) as client:
+            token = _ASYNC_CLIENT.set(client)
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                _ASYNC_CLIENT.reset(token)
+    return wrapper
+
+
+class VolumeVerifyAgent:
+    def __init__(self, api_key, model=VERIFY_MODEL):
+        """Initialize the volume verification agent"""
+        self.model = model
+        # Every VLM call is async so several meals can be verified concurrently (process_many);
+        # the sync methods are asyncio.run wrappers
+        self.api_key = api_key
+    
+    @property
+    def async_client(self):
+        """The current call's client (only valid inside the agent's coroutines, see _with_async_client)"""
+        return _ASYNC_CLIENT.get()
+    
+    def encode_image(self, image_path):
+        """Encode image to base64 for GPT-4V (as JPEG, scaled down to VERIFY_IMAGE_SIDE)"""
+        return image_cache.encode_image(image_path, VERIFY_IMAGE_SIDE, VERIFY_JPEG_QUALITY, RESIZE_IMAGES)
+    
+    def image_url(self, image_path):
+        """data: URL of the encoded image, shared with the other agents while the file is unchanged"""
+        return image_cache.data_url(image_path, VERIFY_IMAGE_SIDE, VERIFY_JPEG_QUALITY, RESIZE_IMAGES)
+    
+    def _foods_summary(self, confirmed_foods):
+        """The per-food fields the VLM sees (missing fields become null, as before)"""
+        return [
+            {
+                'segment_id': food.get('segment_id'),
+                'food_name': food.get('final_food_name'),
+                'estimated_volume_litres': _prompt_volume(food.get('volume_litres'))
+            }
+            for food in confirmed_foods
+        ]
+    
+    def verify_volumes_with_vlm(self, confirmed_foods, image_path, model=None):
+        """Synchronous entry point, see averify_volumes_with_vlm"""
+        return asyncio.run(self.averify_volumes_with_vlm(confirmed_foods, image_path, model))
+    
+    @_with_async_client
+    async def averify_volumes_with_vlm(self, confirmed_foods, image_path, model=None):
+        """
+        Use VLM to verify volume estimates for each food item
+        
+        Args:
+            confirmed_foods: List of confirmed food items with volumes
+            image_path: Path to original food image
+            model: VLM to ask (default: the agent's model); a small-model answer below
+                VERIFY_PROMOTE_CONFIDENCE is asked again of VERIFY_HIGH_ACCURACY_MODEL
+        
+        Returns:
+            List of foods with verified volumes
+        """
+        
+        print("\n" + "="*70)
+        print("VOLUME VERIFICATION WITH VLM")
+        print("="*70 + "\n")
+        
+        # Encode image (decode/resize/JPEG/base64 on a worker thread: other meals' requests keep flowing)
+        image_url = await asyncio.to_thread(self.image_url, image_path)
+        
+        # Build food summary for VLM
+        foods_summary = self._foods_summary(confirmed_foods)
+        
+        # Create VLM prompt
+        # Compact JSON: indentation only costs prompt tokens
+        prompt = f"{_VERIFY_PROMPT_HEAD}{orjson.dumps(foods_summary).decode()}\n\n{_VERIFY_RULES}"
+
         try:
-            print("Calling VLM for volume verification...\n")
+            model = model or self.model
+            print(f"Calling VLM ({model}) for volume verification...\n")
             
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
+            response = await self.async_client.chat.completions.create(
+                model=model,
                 messages=[
                     {
                         "role": "user",
@@ -137,60 +314,212 @@ IMPORTANT:
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
+                                    "url": image_url
                                 }
                             }
                         ]
                     }
                 ],
-                response_format={"type": "json_object"},
-                max_tokens=2000,
+                response_format=_schema_format(VolumeVerification),
+                max_tokens=_max_tokens(len(confirmed_foods)),
                 temperature=0.3
             )
             
-            result = json.loads(response.choices[0].message.content)
+            # Schema-constrained, so this only fails on a truncated or refused reply (generic handler below)
+            result = VERIFICATION_ADAPTER.validate_json(response.choices[0].message.content).model_dump()
+            
+            confidence = result.get('overall_confidence')
+            if (model != VERIFY_HIGH_ACCURACY_MODEL and isinstance(confidence, (int, float))
+                    and confidence < VERIFY_PROMOTE_CONFIDENCE):
+                print(f"⚠️  {model} is unsure (confidence {confidence:.0%}), asking {VERIFY_HIGH_ACCURACY_MODEL}\n")
+                return await self.averify_volumes_with_vlm(confirmed_foods, image_path, VERIFY_HIGH_ACCURACY_MODEL)
             
             print("✅ VLM verification complete!\n")
             
-            return result
+            return self._match_to_foods(confirmed_foods, result)
             
-        except json.JSONDecodeError as e:
-            print(f"❌ Error: VLM returned invalid JSON: {e}")
-            # Return original volumes as fallback
-            return self._create_fallback_response(confirmed_foods)
-        
         except Exception as e:
             print(f"❌ Error during VLM verification: {e}")
             return self._create_fallback_response(confirmed_foods)
     
-    def _create_fallback_response(self, confirmed_foods):
-        """Create fallback response if VLM fails"""
-        verified = []
+    def verify_volumes_batch(self, jobs, batch_size=VERIFY_BATCH_SIZE, concurrency=VERIFY_CONCURRENCY):
+        """Synchronous entry point, see averify_volumes_batch"""
+        return asyncio.run(self.averify_volumes_batch(jobs, batch_size, concurrency))
+    
+    @_with_async_client
+    async def averify_volumes_batch(self, jobs, batch_size=VERIFY_BATCH_SIZE, concurrency=VERIFY_CONCURRENCY):
+        """
+        Verify several meals with one VLM request per batch_size images, up to `concurrency` requests at a time
         
-        for food in confirmed_foods:
-            verified.append({
-                "segment_id": food.get('segment_id'),
-                "food_name": food.get('final_food_name'),
-                "original_volume_litres": food.get('volume_litres'),
-                "volume_reasonable": True,
-                "suggested_volume_litres": food.get('volume_litres'),
-                "confidence": 0.5,
-                "reasoning": "VLM verification failed, using original estimate",
-                "adjustment_made": False
+        Args:
+            jobs: List of (confirmed_foods, image_path) pairs
+            batch_size: Images per request
+            concurrency: Requests in flight at once
+        
+        Returns:
+            One verification result per job, in order (images the batched answer
+            does not cover are re-verified one by one with averify_volumes_with_vlm)
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def verify_one(confirmed_foods, image_path):
+            async with semaphore:
+                return await self.averify_volumes_with_vlm(confirmed_foods, image_path)
+        
+        async def verify_batch(batch):
+            batch_results = None
+            if len(batch) > 1:
+                async with semaphore:
+                    batch_results = await self._verify_batch_request(batch)
+            if batch_results is None:
+                batch_results = [None] * len(batch)
+            # Only the images without a usable batched answer cost a request of their own
+            retry = [i for i, result in enumerate(batch_results) if result is None]
+            redone = await asyncio.gather(*[verify_one(*batch[i]) for i in retry])
+            for i, result in zip(retry, redone):
+                batch_results[i] = result
+            return batch_results
+        
+        # gather keeps the batches (and so the results) in job order
+        batches = [jobs[start:start + batch_size] for start in range(0, len(jobs), batch_size)]
+        return [result for batch_results in await asyncio.gather(*[verify_batch(batch) for batch in batches])
+                for result in batch_results]
+    
+    async def _verify_batch_request(self, batch):
+        """One multi-image request for a batch: a result per image, None for images the answer
+        does not cover (None overall if the request or its answer is unusable)"""
+        # All of the batch's images are prepared in parallel worker threads, off the event loop
+        image_urls = await asyncio.gather(*[asyncio.to_thread(self.image_url, path) for _, path in batch])
+        
+        content = [{"type": "text", "text": _BATCH_PROMPT_HEAD + _VERIFY_RULES + _BATCH_PROMPT_TAIL}]
+        for number, ((confirmed_foods, _), image_url) in enumerate(zip(batch, image_urls), 1):
+            content.append({
+                "type": "text",
+                "text": f"IMAGE {number}: food items with estimated volumes\n"
+                        f"{orjson.dumps(self._foods_summary(confirmed_foods)).decode()}"
+            })
+            content.append({
+                "type": "image_url",
+                "image_url": {"url": image_url}
             })
         
+        try:
+            print(f"Calling VLM for volume verification of {len(batch)} images in one request...\n")
+            response = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": content}],
+                response_format=_schema_format(VolumeVerificationBatch),
+                max_tokens=min(sum(_max_tokens(len(foods)) for foods, _ in batch), 16000),
+                temperature=0.3
+            )
+            batch_answer = VERIFICATION_BATCH_ADAPTER.validate_json(response.choices[0].message.content)
+            results = batch_answer.model_dump()['results']
+        except Exception as e:
+            print(f"⚠️  Batched volume verification failed ({e}), verifying images one by one")
+            return None
+        
+        # The schema fixes the shape of each result, not how many there are: answers may come back
+        # in any order, short or with duplicates; image_index (1-based) puts each back with its image
+        numbers = range(1, len(batch) + 1)
+        if len(results) == len(batch) and all(result.get('image_index') is None for result in results):
+            # No indices at all: one answer per image, in the order given
+            by_index = dict(zip(numbers, results))
+        else:
+            by_index = {}
+            duplicated = set()
+            for result in results:
+                index = result.get('image_index')
+                if index in by_index:
+                    duplicated.add(index)
+                by_index.setdefault(index, result)
+            # segment_ids restart at 1 in every image, so an answer claimed by two images must not be
+            # guessed at: those images are re-verified on their own
+            for index in duplicated:
+                del by_index[index]
+        
+        missing = [number for number in numbers if number not in by_index]
+        if len(missing) == len(batch):
+            print("⚠️  Batched VLM answer does not match the images, verifying images one by one")
+            return None
+        if missing:
+            print(f"⚠️  Batched VLM answer has no result for image(s) {missing}, verifying those one by one")
+        else:
+            print("✅ Batched VLM verification complete!\n")
+        return [self._match_to_foods(foods, by_index[number]) if number in by_index else None
+                for number, (foods, _) in zip(numbers, batch)]
+    
+    def _match_to_foods(self, confirmed_foods, result):
+        """Line the VLM's verified_volumes up with the confirmed foods by segment_id, not by position:
+        one entry per confirmed food, in input order, names and original volumes taken from the input.
+        A food the VLM skipped keeps its original volume."""
+        answered = result.get('verified_volumes')
+        by_segment = {}
+        if isinstance(answered, list):
+            # str(): the model sometimes echoes ids as strings
+            by_segment = {str(item.get('segment_id')): item for item in answered if isinstance(item, dict)}
+        
+        verified = []
+        for food in confirmed_foods:
+            item = by_segment.get(str(food.get('segment_id')))
+            if item is None:
+                verified.append(self._retained_item(food, "Not assessed by VLM, using original estimate"))
+                continue
+            item['segment_id'] = food.get('segment_id')
+            item['food_name'] = food.get('final_food_name')
+            item['original_volume_litres'] = food.get('volume_litres')
+            if not isinstance(item.get('suggested_volume_litres'), (int, float)):
+                item['suggested_volume_litres'] = food.get('volume_litres')
+                item['adjustment_made'] = False
+            verified.append(item)
+        
+        result['verified_volumes'] = verified
+        return result
+    
+    def _retained_item(self, food, reasoning, confidence=0.5):
+        """Verification entry that keeps the food's original volume"""
+        return {
+            "segment_id": food.get('segment_id'),
+            "food_name": food.get('final_food_name'),
+            "original_volume_litres": food.get('volume_litres'),
+            "volume_reasonable": True,
+            "suggested_volume_litres": food.get('volume_litres'),
+            "confidence": confidence,
+            "reasoning": reasoning,
+            "adjustment_made": False
+        }
+    
+    def _create_fallback_response(self, confirmed_foods):
+        """Create fallback response if VLM fails"""
+        verified = [
+            self._retained_item(food, "VLM verification failed, using original estimate")
+            for food in confirmed_foods
+        ]
+        
         return {
             "verified_volumes": verified,
             "overall_confidence": 0.5,
             "notes": "VLM verification failed, original volumes retained"
         }
     
+    def _create_prior_response(self, confirmed_foods):
+        """Verification result for foods whose volumes all lie inside VOLUME_PRIORS (no VLM call)"""
+        verified = []
+        for food in confirmed_foods:
+            low, high = _prior_band(food)
+            verified.append(self._retained_item(
+                food, f"Volume within the typical {low:.2f}-{high:.2f}L serving range", confidence=0.9))
+        
+        return {
+            "verified_volumes": verified,
+            "overall_confidence": 0.9,
+            "notes": "All volumes within typical serving ranges, VLM verification skipped"
+        }
+    
     def print_verification_summary(self, verification_result):
         """Print a summary of verification results"""
         
-        print("="*70)
-        print("VOLUME VERIFICATION SUMMARY")
-        print("="*70 + "\n")
+        # Built up line by line and written once: one stdout write however many segments there are
+        lines = ["="*70, "VOLUME VERIFICATION SUMMARY", "="*70, ""]
         
         verified_items = verification_result.get('verified_volumes', [])
         
@@ -204,28 +533,54 @@ IMPORTANT:
             confidence = item.get('confidence')
             reasoning = item.get('reasoning')
             
-            print(f"Segment {seg_id}: {name}")
-            print(f"  Original Volume: {original:.3f}L")
+            lines.append(f"Segment {seg_id}: {name}")
+            lines.append(f"  Original Volume: {original:.3f}L")
             
             if adjusted:
-                print(f"  ⚠️  ADJUSTED to: {suggested:.3f}L")
+                lines.append(f"  ⚠️  ADJUSTED to: {suggested:.3f}L")
                 change_pct = ((suggested - original) / original) * 100
-                print(f"  Change: {change_pct:+.1f}%")
+                lines.append(f"  Change: {change_pct:+.1f}%")
             else:
-                print(f"  ✅ VERIFIED: {suggested:.3f}L")
+                lines.append(f"  ✅ VERIFIED: {suggested:.3f}L")
             
-            print(f"  Confidence: {confidence:.0%}")
-            print(f"  Reasoning: {reasoning}")
-            print()
+            lines.append(f"  Confidence: {confidence:.0%}")
+            lines.append(f"  Reasoning: {reasoning}")
+            lines.append("")
         
         overall_conf = verification_result.get('overall_confidence', 0.0)
         notes = verification_result.get('notes', '')
         
-        print(f"Overall Confidence: {overall_conf:.0%}")
-        print(f"Notes: {notes}")
-        print("="*70 + "\n")
+        lines.append(f"Overall Confidence: {overall_conf:.0%}")
+        lines.append(f"Notes: {notes}")
+        lines.append("="*70)
+        lines.append("")
+        sys.stdout.write("\n".join(lines) + "\n")
     
     def process(self, confirmed_output_path, image_path):
+        """Synchronous entry point, see aprocess"""
+        return asyncio.run(self.aprocess(confirmed_output_path, image_path))
+    
+    @_with_async_client
+    async def process_many(self, jobs, concurrency=VERIFY_CONCURRENCY):
+        """
+        Verify several meals concurrently, at most `concurrency` VLM calls in flight
+        
+        Args:
+            jobs: List of (confirmed_output_path, image_path) pairs
+        
+        Returns:
+            One verification results dict per job, in order
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def process_one(confirmed_output_path, image_path):
+            async with semaphore:
+                return await self.aprocess(confirmed_output_path, image_path)
+        
+        return await asyncio.gather(*[process_one(path, image_path) for path, image_path in jobs])
+    
+    @_with_async_client
+    async def aprocess(self, confirmed_output_path, image_path):
         """
         Main processing logic
         
@@ -246,8 +601,7 @@ IMPORTANT:
         
         # Load confirmed output
         try:
-            with open(confirmed_output_path, 'r', encoding='utf-8') as f:
-                confirmed_data = json.load(f)
+            confirmed_data = _load_json(confirmed_output_path)
         except FileNotFoundError:
             print(f"❌ Error: File not found: {confirmed_output_path}")
             sys.exit(1)
@@ -269,8 +623,12 @@ IMPORTANT:
         
         print(f"Found {len(confirmed_foods)} food items to verify\n")
         
-        # Verify volumes with VLM
-        verification_result = self.verify_volumes_with_vlm(confirmed_foods, image_path)
+        # Verify volumes with VLM, unless every volume is already a typical serving for its food
+        if USE_VOLUME_PRIORS and _within_priors(confirmed_foods):
+            print("✅ All volumes within typical serving ranges, skipping VLM verification\n")
+            verification_result = self._create_prior_response(confirmed_foods)
+        else:
+            verification_result = await self.averify_volumes_with_vlm(confirmed_foods, image_path)
         
         # Print summary
         self.print_verification_summary(verification_result)
@@ -283,17 +641,8 @@ IMPORTANT:
         return verification_result
 
 
-def main():
-    """Main entry point"""
-    
-    if len(sys.argv) < 3:
-        print("Usage: python volume_verify.py <final_confirmed_output.json> <original_image_path>")
-        print("\nExample:")
-        print('  python volume_verify.py final_confirmed_output.json food_image.jpg')
-        sys.exit(1)
-    
-    confirmed_output_path = sys.argv[1]
-    image_path = sys.argv[2]
+def run(confirmed_output_path, image_path, output_file="verified_volumes.json", model=VERIFY_MODEL):
+    """Verify volumes for one image and write them to output_file"""
     
     # Get API key from environment
     api_key = os.getenv("OPENAI_API_KEY")
@@ -302,20 +651,37 @@ def main():
         sys.exit(1)
     
     # Initialize agent
-    agent = VolumeVerifyAgent(api_key)
+    agent = VolumeVerifyAgent(api_key, model=model)
     
     # Process
+    result = agent.process(confirmed_output_path, image_path)
+    
+    # Save output: orjson always writes UTF-8 without escaping (what ensure_ascii=False did); NON_STR_KEYS
+    # stringifies int keys like json.dump did
+    with open(output_file, 'wb') as f:
+        f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    
+    print(f"✅ Volume verification complete!")
+    print(f"📄 Output saved to: {output_file}")
+    
+    return result
+
+
+def main():
+    """Main entry point"""
+    
+    # --high-accuracy: verify with the large model from the start
+    model = VERIFY_HIGH_ACCURACY_MODEL if "--high-accuracy" in sys.argv else VERIFY_MODEL
+    args = [arg for arg in sys.argv[1:] if arg != "--high-accuracy"]
+    
+    if len(args) < 2:
+        print("Usage: python volume_verify.py <final_confirmed_output.json> <original_image_path> [--high-accuracy]")
+        print("\nExample:")
+        print('  python volume_verify.py final_confirmed_output.json food_image.jpg')
+        sys.exit(1)
+    
     try:
-        result = agent.process(confirmed_output_path, image_path)
-        
-        # Save output
-        output_file = "verified_volumes.json"
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(result, f, indent=2, ensure_ascii=False)
-        
-        print(f"✅ Volume verification complete!")
-        print(f"📄 Output saved to: {output_file}")
-        
+        run(args[0], args[1], model=model)
     except Exception as e:
         print(f"\n❌ Error during volume verification: {e}")
         import traceback